@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# This file is part of Script of Scripts (SoS), a workflow system
+# for the execution of commands and scripts in different languages.
+# Please visit https://github.com/vatlab/SOS for more information.
+#
+# Copyright (C) 2016 Bo Peng (bpeng@mdanderson.org)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''Time resource sampling of ProcessMonitor for a task with a large process
+tree, with processes read by psutil, from /proc (by listing children of
+processes, or by scanning all processes), and from the cgroup of the task
+if the script is executed in its own cgroup (v2), e.g.
+
+    systemd-run --user --scope python benchmark_monitor.py
+'''
+import argparse
+import os
+import subprocess
+import time
+
+from sos.monitor import ProcessMonitor, ProcReader, CgroupReader
+
+
+def spawn_tree(num_procs, fanout):
+    '''Start num_procs sleeping processes in groups of fanout under shells'''
+    shells = []
+    for i in range(0, num_procs, fanout):
+        n = min(fanout, num_procs - i)
+        shells.append(subprocess.Popen(['sh', '-c', ' '.join(['sleep 600 &'] * n) + ' wait']))
+    return shells
+
+
+def time_check(monitor, repeat):
+    monitor._check()
+    start = time.perf_counter()
+    for i in range(repeat):
+        (cpu, mem, nch, ch_cpu, ch_mem), usage = monitor._check()
+    return (time.perf_counter() - start) / repeat, nch
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('benchmark_monitor')
+    parser.add_argument('-n', '--num-procs', type=int, default=200)
+    parser.add_argument('-f', '--fanout', type=int, default=10)
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    shells = spawn_tree(args.num_procs, args.fanout)
+    # wait for all processes to start
+    time.sleep(2)
+    m = ProcessMonitor('benchmark_monitor', monitor_interval=1, resource_monitor_interval=1)
+    samplers = [('psutil', None, None)]
+    if ProcReader.available():
+        reader = ProcReader()
+        if reader._list_children:
+            samplers.append(('/proc (children)', reader, None))
+        reader = ProcReader()
+        reader._list_children = False
+        samplers.append(('/proc (scan)', reader, None))
+        cgroup = CgroupReader.of_task(os.getpid())
+        if cgroup is not None:
+            samplers.append(('cgroup v2', ProcReader(), cgroup))
+    try:
+        for name, reader, cgroup in samplers:
+            m._reader = reader
+            m._cgroup = cgroup
+            elapsed, nch = time_check(m, args.repeat)
+            print(f'{name:20s} {nch:6d} processes {elapsed * 1000:10.2f} ms per sample')
+    finally:
+        for shell in shells:
+            subprocess.call(['pkill', '-P', str(shell.pid)])
+            shell.kill()
+        os.remove(m.pulse_file)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+#
+# This file is part of Script of Scripts (SoS), a workflow system
+# for the execution of commands and scripts in different languages.
+# Please visit https://github.com/vatlab/SOS for more information.
+#
+# Copyright (C) 2016 Bo Peng (bpeng@mdanderson.org)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+'''Measure the time spent by task commands (sos status, execute and purge) on
+importing modules, with the slowest modules, e.g.
+
+    python benchmark_startup.py -r 5
+
+These commands are called repeatedly by task engines, so they should not
+import modules that are only needed to run workflows.
+'''
+import argparse
+import subprocess
+import sys
+
+
+def import_times(cmd):
+    '''Self import time of modules in microseconds'''
+    imported = {}
+    for line in subprocess.run([sys.executable, '-X', 'importtime', '-m', 'sos'] + cmd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).stderr.decode().splitlines():
+        if line.startswith('import time:') and 'self [us]' not in line:
+            self_time, _, name = line[12:].split('|')
+            imported[name.strip()] = int(self_time)
+    return imported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('benchmark_startup')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-t', '--top', type=int, default=5)
+    args = parser.parse_args()
+
+    for cmd in (['status', 'nonexisting_task'], ['execute', 'nonexisting_task'],
+        ['purge', 'nonexisting_task']):
+        # the fastest run, which is least affected by other processes
+        imported = min((import_times(cmd) for i in range(args.repeat)),
+            key=lambda x: sum(x.values()))
+        print(f'sos {cmd[0]}: {len(imported)} modules imported in {sum(imported.values()) / 1000:.1f}ms')
+        for name, self_time in sorted(imported.items(), key=lambda x: -x[1])[:args.top]:
+            print(f'    {name}: {self_time / 1000:.1f}ms')
@@ -119,6 +119,7 @@ sos = sos.converter:SoS_Lexer
 
 [sos_targets]
 file_target = sos.targets:file_target
+dir_target = sos.targets:dir_target
 dynamic = sos.targets:dynamic
 remote = sos.targets:remote
 executable = sos.targets:executable
@@ -169,6 +170,7 @@ docker_build = sos.docker.actions:docker_build
 
 [sos_taskengines]
 process = sos.tasks:BackgroundProcess_TaskEngine
+pool = sos.tasks:ProcessPool_TaskEngine
 
 [sos_previewers]
 *.pdf,1 = sos.preview:preview_pdf
@@ -23,7 +23,6 @@
 import os
 import sys
 import argparse
-import pkg_resources
 
 script_help = '''A SoS script that defines one or more workflows, in format
     .sos or .ipynb. The script can be a filename or a URL from which the
@@ -115,7 +114,8 @@ def get_convert_parser(desc_only=False):
     parser.set_defaults(func=cmd_convert)
     subparsers = parser.add_subparsers(title='converters (name of converter is not needed from command line)',
         dest='converter_name')
-    for entrypoint in pkg_resources.iter_entry_points(group='sos_converters'):
+    from .plugins import iter_entry_points
+    for entrypoint in iter_entry_points('sos_converters'):
         try:
             name = entrypoint.name
             if not name.endswith('.parser'):
@@ -162,7 +162,8 @@ def print_converter_help():
     from_format, to_format = get_converter_formats([x for x in sys.argv[2:] if x != '-h'])
     if from_format is None or to_format is None:
         return
-    for entrypoint in pkg_resources.iter_entry_points(group='sos_converters'):
+    from .plugins import iter_entry_points
+    for entrypoint in iter_entry_points('sos_converters'):
         try:
             name = entrypoint.name
             if not name.endswith('.parser'):
@@ -178,7 +179,8 @@ def print_converter_help():
 
 def cmd_convert(args, unknown_args):
     from .utils import env, get_traceback
-    for entrypoint in pkg_resources.iter_entry_points(group='sos_converters'):
+    from .plugins import iter_entry_points
+    for entrypoint in iter_entry_points('sos_converters'):
         try:
             if entrypoint.name == args.converter_name + '.func':
                 func = entrypoint.load()
@@ -433,10 +435,8 @@ def workflow_status(workflow):
     import time
     from .utils import env, load_var, load_config_files, PrettyRelativeTime
     from .hosts import Host
-    from .tasks import check_tasks
+    from .tasks import query_task_status
     from .eval import interpolate
-    from io import StringIO
-    from contextlib import redirect_stdout
     from collections import defaultdict
     import re
     pending_tasks = defaultdict(list)
@@ -478,15 +478,13 @@ def workflow_status(workflow):
     #
     for k,v in pending_tasks.items():
         if k in ('', 'localhost'):
-            with StringIO() as buf, redirect_stdout(buf):
-                check_tasks(v, 0, False, False, None)
-                status = buf.getvalue().strip().split('\n')
+            status = [x[2] for x in query_task_status(v)]
         else:
             # remote host?
             load_config_files(config_file)
             try:
                 host = Host(k)
-                status = host._task_engine.query_tasks(v, 0, False, False, None).strip().split('\n')
+                status = [x[2] for x in host._task_engine.query_task_status(v)]
             except Exception as e:
                 env.logger.warning('Failed to check status of task {} at host {}'.format(v, k))
                 status = ['unknown'] * len(v)
@@ -939,16 +937,14 @@ def get_execute_parser(desc_only=False):
 
 
 def cmd_execute(args, workflow_args):
-    from .tasks import execute_task, check_task, monitor_interval, resource_monitor_interval
-    from .monitor import summarizeExecution
+    from .tasks import execute_task, check_task, match_tasks, monitor_interval, resource_monitor_interval
     from .utils import env, load_config_files
-    import glob
     if args.queue is None:
         # local machine ...
         exit_code = []
         for task in args.tasks:
             #
-            matched = [os.path.basename(x)[:-5] for x in glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task + '*.task'))]
+            matched = [x[0] for x in match_tasks([task])]
             if not matched:
                 env.logger.error('{} does not match any existing task'.format(task))
                 exit_code.append(1)
@@ -968,6 +964,7 @@ def cmd_execute(args, workflow_args):
                 if args.verbosity <= 1:
                     print(status)
                 else:
+                    from .monitor import summarizeExecution
                     print(summarizeExecution(task, status=status))
                 exit_code.append(1)
                 continue
@@ -1069,6 +1066,14 @@ def get_status_parser(desc_only=False):
         help='''Output results in HTML format. This option will override option
             verbosity and output detailed status information in HTML tables and
             figures.''')
+    parser.add_argument('--json', action='store_true',
+        help='''Output ID, status, modification time and tags of tasks in JSON
+            format, which is used by sos to query the status of tasks on remote
+            hosts.''')
+    parser.add_argument('--stats', action='store_true',
+        help='''Output 50%% and 90%% percentiles and maximum of run time, peak
+            memory and cpu use of completed and failed tasks, grouped by steps
+            and tags of the tasks.''')
     parser.add_argument('--start-time', action='store_true',
         help=argparse.SUPPRESS)
     parser.set_defaults(func=cmd_status)
@@ -1078,7 +1083,6 @@ def get_status_parser(desc_only=False):
 def cmd_status(args, workflow_args):
     from .tasks import check_tasks
     from .utils import env, load_config_files, get_traceback
-    from .hosts import Host
     #from .monitor import summarizeExecution
     env.verbosity = args.verbosity
     try:
@@ -1089,12 +1093,20 @@ def cmd_status(args, workflow_args):
             return
         if not args.queue:
             check_tasks(tasks=args.tasks, verbosity=args.verbosity, html=args.html, start_time=args.start_time,
-                    age=args.age, tags=args.tags, status=args.status)
+                    age=args.age, tags=args.tags, status=args.status, json=args.json, stats=args.stats)
         else:
             # remote host?
+            from .hosts import Host
             host = Host(args.queue)
-            print(host._task_engine.query_tasks(tasks=args.tasks, verbosity=args.verbosity, html=args.html,
-                start_time=args.start_time, age=args.age, tags=args.tags, status=args.status))
+            if args.json:
+                import json
+                print(json.dumps([{'id': t, 'status': s, 'time': d} for t, d, s in
+                    host._task_engine.query_task_status(tasks=args.tasks, age=args.age,
+                    tags=args.tags, status=args.status)]))
+            else:
+                print(host._task_engine.query_tasks(tasks=args.tasks, verbosity=args.verbosity, html=args.html,
+                    start_time=args.start_time, age=args.age, tags=args.tags, status=args.status,
+                    stats=args.stats))
     except Exception as e:
         if args.verbosity and args.verbosity > 2:
             sys.stderr.write(get_traceback())
@@ -1145,7 +1157,6 @@ def get_purge_parser(desc_only=False):
 def cmd_purge(args, workflow_args):
     from .tasks import purge_tasks
     from .utils import env, load_config_files, get_traceback
-    from .hosts import Host
     #from .monitor import summarizeExecution
     env.verbosity = args.verbosity
     try:
@@ -1159,6 +1170,7 @@ def cmd_purge(args, workflow_args):
         else:
             # remote host?
             cfg = load_config_files(args.config)
+            from .hosts import Host
             host = Host(args.queue)
             print(host._task_engine.purge_tasks(args.tasks, args.all, args.age, args.status, args.tags, args.verbosity))
     except Exception as e:
@@ -1202,7 +1214,6 @@ def get_kill_parser(desc_only=False):
 def cmd_kill(args, workflow_args):
     from .tasks import kill_tasks
     from .utils import env, load_config_files
-    from .hosts import Host
     env.verbosity = args.verbosity
     if args.queue == '':
         cfg = load_config_files(args.config)
@@ -1224,6 +1235,7 @@ def cmd_kill(args, workflow_args):
     else:
         # remote host?
         cfg = load_config_files(args.config)
+        from .hosts import Host
         host = Host(args.queue)
         print(host._task_engine.kill_tasks(tasks=args.tasks, tags=args.tags))
 
@@ -1303,32 +1315,30 @@ class AnswerMachine:
                 return False
 
 def get_tracked_files(sig_file):
-    from .targets import file_target
-    with open(sig_file) as sig:
-        tracked_files = []
-        script_files = []
-        runtime_files = [sig_file]
-        for line in sig:
-            if line.startswith('IN_FILE') or line.startswith('OUT_FILE'):
-                # format is something like IN_FILE\tfilename=xxxx\tsession=...
-                tracked_files.append(line.rsplit('\t', 4)[1][9:])
-                t = file_target(tracked_files[-1])
-                if t.target_exists('signature'):
-                    runtime_files.append(t.sig_file())
-            elif line.startswith('EXE_SIG'):
-                runtime_files.append('.sos/.runtime/{}.exe_info'.format(line.split('session=', 1)[1].strip()))
-            elif line.startswith('# script:'):
-                script_files.append(line.split(':', 1)[1].strip())
-            elif line.startswith('# included:'):
-                script_files.extend(line.split(':', 1)[-1].strip().split(','))
-    return set([x for x in script_files if x.strip()]), set(tracked_files), set(runtime_files)
+    from .signatures import read_workflow_sig, workflow_journals
+    tracked_files = []
+    script_files = []
+    # journals of runtime signatures that have not been merged to sig_file
+    runtime_files = [sig_file] + workflow_journals(sig_file)
+    step_sigs = []
+    for line in read_workflow_sig(sig_file):
+        if line.startswith('IN_FILE') or line.startswith('OUT_FILE'):
+            # format is something like IN_FILE\tfilename=xxxx\tsession=...
+            tracked_files.append(line.rsplit('\t', 4)[1][9:])
+        elif line.startswith('EXE_SIG'):
+            step_sigs.append(line.split('session=', 1)[1].strip())
+        elif line.startswith('# script:'):
+            script_files.append(line.split(':', 1)[1].strip())
+        elif line.startswith('# included:'):
+            script_files.extend(line.split(':', 1)[-1].strip().split(','))
+    return set([x for x in script_files if x.strip()]), set(tracked_files), set(runtime_files), set(step_sigs)
 
 
 def cmd_remove(args, unknown_args):
     import glob
     from .utils import env
-    import shutil
     from .targets import file_target
+    from .signatures import signature_store
     env.verbosity = args.verbosity
 
     # what about global signature?
@@ -1336,24 +1346,21 @@ def cmd_remove(args, unknown_args):
     tracked_files = set()
     runtime_files = set()
     for sig_file in sig_files:
-        s, t, r = get_tracked_files(sig_file)
+        s, t, r, _ = get_tracked_files(sig_file)
         tracked_files |= t
         runtime_files |= r
     #
     if args.signature and not args.targets:
         # a special case where all file and runtime signatures are removed.
         # no other options are allowed.
-        removed_cnt = 0
-        for s in glob.glob(os.path.join('.sos', '.runtime', '*.file_info')):
-            try:
-                if args.dryrun:
-                    print('Would remove {}'.format(os.path.basename(s)))
-                else:
-                    env.logger.debug('Remove {}'.format(s))
-                    os.remove(s)
-                removed_cnt += 1
-            except Exception as e:
-                env.logger.warning('Failed to remove signature {}: {}'.format(s, e))
+        store = signature_store()
+        if args.dryrun:
+            names = store.list_targets()
+            for name in names:
+                print('Would remove signature of {}'.format(name))
+            removed_cnt = len(names)
+        else:
+            removed_cnt = store.clear_targets()
         if args.dryrun:
             env.logger.info('Would remove {} runtime signatures'.format(removed_cnt))
         elif removed_cnt:
@@ -1404,7 +1411,7 @@ def cmd_remove(args, unknown_args):
             if not args.dryrun:
                 env.logger.debug('Remove {}'.format(s))
                 try:
-                    os.remove(target.sig_file())
+                    target.remove_sig()
                 except Exception as e:
                     env.logger.warning('Failed to remove signature of {}: {}'.format(filename, e))
                 return True
@@ -1489,9 +1496,7 @@ def cmd_remove(args, unknown_args):
                 if not args.dryrun:
                     env.logger.debug('Zap {}'.format(s))
                     try:
-                        target.write_sig()
-                        shutil.copy(target.sig_file(), filename + '.zapped')
-                        os.remove(filename)
+                        target.zap()
                     except Exception as e:
                         env.logger.warning('Failed to zap {}: {}'.format(filename, e))
                     return True
@@ -1552,6 +1557,61 @@ def cmd_remove(args, unknown_args):
     env.logger.info('{}{} file{} {}'.format('Signagure of ' if args.signature else '', removed,
         's' if removed > 1 else '', 'zapped' if args.zap else 'removed'))
 
+#
+# subcommand cache
+#
+def get_cache_parser(desc_only=False):
+    parser = argparse.ArgumentParser('cache',
+        description='''List or prune the cache of step outputs that is shared across
+            projects. The cache is enabled by option sos_output_cache (directory of the
+            cache) of sos configuration files, with its size limited by option
+            sos_output_cache_size (default to 10G).''')
+    parser.short_description = '''Inspect and prune cache of step outputs'''
+    if desc_only:
+        return parser
+    parser.add_argument('--prune', nargs='?', const='0', metavar='SIZE',
+        help='''Remove least recently used entries until the size of the cache
+        is no larger than specified size (e.g. 1G), or remove all entries if no size
+        is specified.''')
+    parser.add_argument('-n', '--dryrun', action='store_true',
+        help='''List entries that would be removed by option --prune.''')
+    parser.add_argument('-c', '--config', help='''A configuration file in which
+        the cache is defined, in case it is not defined in global sos config.yml files.''')
+    parser.add_argument('-v', dest='verbosity', type=int, choices=range(5), default=2,
+        help='''Output error (0), warning (1), info (2), debug (3) and trace (4)
+            information to standard output (default to 2).''')
+    parser.set_defaults(func=cmd_cache)
+    return parser
+
+
+def cmd_cache(args, unknown_args):
+    import time
+    from .utils import env, load_config_files, get_traceback, pretty_size
+    from .cache import output_cache
+    env.verbosity = args.verbosity
+    try:
+        load_config_files(args.config)
+        cache = output_cache()
+        if cache is None:
+            raise ValueError('Cache of step outputs is not enabled. Please set option sos_output_cache to a directory.')
+        if args.prune is not None:
+            removed = cache.prune(args.prune, dryrun=args.dryrun)
+            if args.dryrun:
+                for entry in removed:
+                    print(f'Would remove {entry[0]} ({", ".join(entry[1])}, {pretty_size(entry[2])})')
+            else:
+                env.logger.info(f'{len(removed)} entr{"ies" if len(removed) != 1 else "y"} ({pretty_size(sum(x[2] for x in removed))}) removed from {cache.cache_dir}')
+            return
+        entries = cache.entries()
+        for key, outputs, size, created, accessed in entries:
+            print(f'{key}\t{pretty_size(size)}\t{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(accessed))}\t{", ".join(outputs)}')
+        env.logger.info(f'{len(entries)} entr{"ies" if len(entries) != 1 else "y"} ({pretty_size(cache.size())}) in {cache.cache_dir}')
+    except Exception as e:
+        if args.verbosity and args.verbosity > 2:
+            sys.stderr.write(get_traceback())
+        env.logger.error(e)
+        sys.exit(1)
+
 #
 # subcommand config
 #
@@ -1817,7 +1877,7 @@ def locate_files(session, include, exclude, all_files):
                 'Available sessions are:\n' +
                 '\n'.join(os.path.basename(x)[:-4] for x in sig_files))
     #
-    script_files, tracked_files, runtime_files = get_tracked_files(sig_file)
+    script_files, tracked_files, runtime_files, step_sigs = get_tracked_files(sig_file)
     # all
     if not all_files:
         external_files = []
@@ -1840,7 +1900,7 @@ def locate_files(session, include, exclude, all_files):
     for ex in exclude:
         tracked_files = [x for x in tracked_files if not fnmatch.fnmatch(x, ex)]
     #
-    return script_files, tracked_files, runtime_files
+    return script_files, tracked_files, runtime_files, step_sigs
 
 def cmd_pack(args, unknown_args):
     import tarfile
@@ -1848,106 +1908,123 @@ def cmd_pack(args, unknown_args):
     from tqdm import tqdm as ProgressBar
     from .utils import pretty_size, env, ProgressFileObj
     from .targets import file_target
+    from .signatures import signature_store
     #
     env.verbosity = args.verbosity
     try:
-        script_files, tracked_files, runtime_files = locate_files(args.session, args.include, args.exclude, args.__all__)
+        script_files, tracked_files, runtime_files, step_sigs = locate_files(args.session, args.include, args.exclude, args.__all__)
     except Exception as e:
         env.logger.error(e)
         sys.exit(1)
     #
-    # get information about files
-    file_sizes = {x: file_target(x).size() for x in tracked_files}
-    # getting file size to create progress bar
-    total_size = sum(file_sizes.values())
-
-    if args.output == '-':
-        tar_args = {'fileobj': sys.stdout.buffer, 'mode': 'w:gz'}
-    elif not args.output.endswith('.sar'):
-        tar_args = {'name': args.output + '.sar', 'mode': 'w:gz'}
-    else:
-        tar_args = {'name': args.output, 'mode': 'w:gz'}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # signatures of tracked files and steps are exported to separate databases for
+        # the project and for external targets, which are imported to the project and
+        # global signature databases by sos unpack
+        sig_keys = [file_target(x).sig_key() for x in tracked_files]
+        for store, name in ((signature_store(), 'signatures.db'),
+            (signature_store(external=True), 'external_signatures.db')):
+            store.export_to(os.path.join(tmpdir, name), targets=sig_keys, steps=step_sigs)
+            runtime_files.add(os.path.join(tmpdir, name))
+        # tracked directories are archived with all files under them
+        tracked_dirs = [x for x in tracked_files if os.path.isdir(x)]
+        tracked_files = set(tracked_files) - set(tracked_dirs)
+        for tracked_dir in tracked_dirs:
+            for dirname, dirlist, filelist in os.walk(tracked_dir):
+                tracked_files.update(os.path.join(dirname, x) for x in filelist)
+        #
+        # get information about files
+        file_sizes = {x: file_target(x).size() for x in tracked_files}
+        # getting file size to create progress bar
+        total_size = sum(file_sizes.values())
+
+        if args.output == '-':
+            tar_args = {'fileobj': sys.stdout.buffer, 'mode': 'w:gz'}
+        elif not args.output.endswith('.sar'):
+            tar_args = {'name': args.output + '.sar', 'mode': 'w:gz'}
+        else:
+            tar_args = {'name': args.output, 'mode': 'w:gz'}
 
-    resp = AnswerMachine(always_yes=False, confirmed=args.__confirm__)
-    if os.path.isfile(args.output) and not args.__confirm__ and not resp.get('Overwrite {}'.format(args.output)):
-        env.logger.info('Operation aborted due to existing output file')
-        sys.exit(0)
+        resp = AnswerMachine(always_yes=False, confirmed=args.__confirm__)
+        if os.path.isfile(args.output) and not args.__confirm__ and not resp.get('Overwrite {}'.format(args.output)):
+            env.logger.info('Operation aborted due to existing output file')
+            sys.exit(0)
 
-    prog = ProgressBar(desc='Checking', total=total_size, disable=args.verbosity != 1)
-    manifest_file = tempfile.NamedTemporaryFile(delete=False).name
-    with open(manifest_file, 'w') as manifest:
-        # write message in repr format (with "\n") to keep it in the same line
-        manifest.write('# {!r}\n'.format(args.message if args.message else ''))
-        # add .archive.info file
-        for f in script_files:
-            if f == 'None':
-                continue
-            ft = file_target(f)
-            if not ft.target_exists():
-                env.logger.warning('Missing script file {}'.format(ft.target_name()))
-            else:
-                manifest.write('SCRIPTS\t{}\t{}\t{}\t{}\n'.format(os.path.basename(f), ft.mtime(), ft.size(), ft.target_signature()))
-        for f in tracked_files:
-            env.logger.info('Checking {}'.format(f))
-            ft = file_target(f)
-            if not ft.target_exists():
-                env.logger.warning('Missing tracked file {}'.format(ft.target_name()))
-            elif ft.is_external():
-                manifest.write('EXTERNAL\t{}\t{}\t{}\t{}\n'.format(f.replace('\\', '/'), ft.mtime(), ft.size(), ft.target_signature()))
-            else:
-                manifest.write('TRACKED\t{}\t{}\t{}\t{}\n'.format(f.replace('\\', '/'), ft.mtime(), ft.size(), ft.target_signature()))
-        for f in runtime_files:
-            ft = file_target(f)
-            if not ft.target_exists():
-                env.logger.warning('Missing runtime file {}'.format(ft.target_name()))
-            else:
-                manifest.write('RUNTIME\t{}\t{}\t{}\t{}\n'.format(os.path.basename(f), ft.mtime(), ft.size(), ft.target_signature()))
-    prog.close()
-    #
-    if args.dryrun:
-        print('A total of {} files ({}) with additional scripts and runtime files would be archived.'.
-            format(len(tracked_files), pretty_size(total_size)))
-        sys.exit(0)
-    else:
-        env.logger.info('Archiving {} files ({})...'.format(len(tracked_files), pretty_size(total_size)))
-    #
-    prog = ProgressBar(desc=args.output, total=total_size, disable=args.verbosity != 1)
-    with tarfile.open(**tar_args) as archive:
-        # add manifest
-        archive.add(manifest_file, arcname='MANIFEST.txt')
-        # add .archive.info file
-        for f in script_files:
-            if not os.path.isfile(f):
-                continue
-            env.logger.info('Adding {}'.format(os.path.basename(f)))
-            archive.add(f, arcname='scripts/' + os.path.basename(f))
-        for f in tracked_files:
-            if not os.path.isfile(f):
-                if os.path.isfile(f + '.zapped'):
-                    f = f + '.zapped'
-                else:
+        prog = ProgressBar(desc='Checking', total=total_size, disable=args.verbosity != 1)
+        manifest_file = tempfile.NamedTemporaryFile(delete=False).name
+        with open(manifest_file, 'w') as manifest:
+            # write message in repr format (with "\n") to keep it in the same line
+            manifest.write('# {!r}\n'.format(args.message if args.message else ''))
+            # add .archive.info file
+            for f in script_files:
+                if f == 'None':
                     continue
-            env.logger.info('Adding {}'.format(f))
-            if file_target(f).is_external():
-                # external files
-                if args.verbosity == 1:
-                    tarinfo = archive.gettarinfo(f, arcname='external/' + f)
-                    archive.addfile(tarinfo, fileobj=ProgressFileObj(prog, f, 'rb'))
+                ft = file_target(f)
+                if not ft.target_exists():
+                    env.logger.warning('Missing script file {}'.format(ft.target_name()))
                 else:
-                    archive.add(f, arcname='external/' + f)
-            else:
-                if args.verbosity == 1:
-                    tarinfo = archive.gettarinfo(f, arcname='tracked/' + f)
-                    archive.addfile(tarinfo, fileobj=ProgressFileObj(prog, f, 'rb'))
+                    manifest.write('SCRIPTS\t{}\t{}\t{}\t{}\n'.format(os.path.basename(f), ft.mtime(), ft.size(), ft.target_signature()))
+            for f in tracked_files:
+                env.logger.info('Checking {}'.format(f))
+                ft = file_target(f)
+                if not ft.target_exists():
+                    env.logger.warning('Missing tracked file {}'.format(ft.target_name()))
+                elif ft.is_external():
+                    manifest.write('EXTERNAL\t{}\t{}\t{}\t{}\n'.format(f.replace('\\', '/'), ft.mtime(), ft.size(), ft.target_signature()))
                 else:
-                    archive.add(f, arcname='tracked/' + f)
-        env.logger.info('Adding runtime files')
-        for f in runtime_files:
-            if not os.path.isfile(f):
-                continue
-            env.logger.trace('Adding {}'.format(os.path.basename(f)))
-            archive.add(f, arcname='runtime/' + os.path.basename(f))
-    prog.close()
+                    manifest.write('TRACKED\t{}\t{}\t{}\t{}\n'.format(f.replace('\\', '/'), ft.mtime(), ft.size(), ft.target_signature()))
+            for f in runtime_files:
+                ft = file_target(f)
+                if not ft.target_exists():
+                    env.logger.warning('Missing runtime file {}'.format(ft.target_name()))
+                else:
+                    manifest.write('RUNTIME\t{}\t{}\t{}\t{}\n'.format(os.path.basename(f), ft.mtime(), ft.size(), ft.target_signature()))
+        prog.close()
+        #
+        if args.dryrun:
+            print('A total of {} files ({}) with additional scripts and runtime files would be archived.'.
+                format(len(tracked_files), pretty_size(total_size)))
+            sys.exit(0)
+        else:
+            env.logger.info('Archiving {} files ({})...'.format(len(tracked_files), pretty_size(total_size)))
+        #
+        prog = ProgressBar(desc=args.output, total=total_size, disable=args.verbosity != 1)
+        with tarfile.open(**tar_args) as archive:
+            # add manifest
+            archive.add(manifest_file, arcname='MANIFEST.txt')
+            # add .archive.info file
+            for f in script_files:
+                if not os.path.isfile(f):
+                    continue
+                env.logger.info('Adding {}'.format(os.path.basename(f)))
+                archive.add(f, arcname='scripts/' + os.path.basename(f))
+            for f in tracked_files:
+                if not os.path.isfile(f):
+                    if os.path.isfile(f + '.zapped'):
+                        f = f + '.zapped'
+                    else:
+                        continue
+                env.logger.info('Adding {}'.format(f))
+                if file_target(f).is_external():
+                    # external files
+                    if args.verbosity == 1:
+                        tarinfo = archive.gettarinfo(f, arcname='external/' + f)
+                        archive.addfile(tarinfo, fileobj=ProgressFileObj(prog, f, 'rb'))
+                    else:
+                        archive.add(f, arcname='external/' + f)
+                else:
+                    if args.verbosity == 1:
+                        tarinfo = archive.gettarinfo(f, arcname='tracked/' + f)
+                        archive.addfile(tarinfo, fileobj=ProgressFileObj(prog, f, 'rb'))
+                    else:
+                        archive.add(f, arcname='tracked/' + f)
+            env.logger.info('Adding runtime files')
+            for f in runtime_files:
+                if not os.path.isfile(f):
+                    continue
+                env.logger.trace('Adding {}'.format(os.path.basename(f)))
+                archive.add(f, arcname='runtime/' + os.path.basename(f))
+        prog.close()
 
 #
 # command unpack
@@ -2000,7 +2077,9 @@ def cmd_unpack(args, unknown_args):
     from tqdm import tqdm as ProgressBar
     from .utils import env, pretty_size, ProgressFileObj
     from .targets import fileMD5
+    from .signatures import SignatureStore
     import fnmatch
+    import tempfile
     import time
 
     resp = AnswerMachine(always_yes=False, confirmed=False)
@@ -2039,6 +2118,7 @@ def cmd_unpack(args, unknown_args):
                 print('   ------                  ----')
                 print('{:>9s}                  {} files'.format(pretty_size(total_size), total_files) )
                 return
+            legacy_sigs = False
             while True:
                 f = archive.next()
                 if f is None:
@@ -2068,12 +2148,24 @@ def cmd_unpack(args, unknown_args):
                     f.name = f.name[8:]
                 elif f.name.startswith('runtime/'):
                     is_runtime = True
-                    if f.name.endswith('.sig'):
+                    if f.name.endswith('.sig') or f.name.endswith('.journal'):
                         # this goes to local directory
                         dest = os.path.join(args.dest, '.sos')
+                    elif f.name in ('runtime/signatures.db', 'runtime/external_signatures.db'):
+                        # signatures are merged to the signature database of the project,
+                        # or to the global one for external targets
+                        with tempfile.TemporaryDirectory() as tmpdir:
+                            archive.extract(f, path=tmpdir)
+                            store = SignatureStore(os.path.join(args.dest, '.sos', 'signatures.db')
+                                if f.name == 'runtime/signatures.db' else
+                                os.path.join(os.path.expanduser('~'), '.sos', 'signatures.db'))
+                            store.import_from(os.path.join(tmpdir, f.name))
+                            store.close()
+                        continue
                     else:
-                        # this goes to global signature directory
-                        dest = '.sos/.runtime'
+                        # signature files from archives of older versions of SoS
+                        dest = os.path.join(args.dest, '.sos', '.runtime')
+                        legacy_sigs = True
                     f.name = f.name[8:]
                 elif f.name.startswith('scripts/'):
                     if not args.script:
@@ -2100,6 +2192,10 @@ def cmd_unpack(args, unknown_args):
                 else:
                     env.logger.debug('Extracting {}'.format(f.name))
                 archive.extract(f, path=dest)
+        if legacy_sigs:
+            store = SignatureStore(os.path.join(args.dest, '.sos', 'signatures.db'))
+            store.import_legacy()
+            store.close()
     except Exception as e:
         raise ValueError('Failed to unpack SoS archive: {}'.format(e))
     prog.close()
@@ -2109,7 +2205,8 @@ def cmd_unpack(args, unknown_args):
 # Handling addon commands
 #
 def handle_addon(args, unknown_args):
-    for entrypoint in pkg_resources.iter_entry_points(group='sos_addons'):
+    from .plugins import iter_entry_points
+    for entrypoint in iter_entry_points('sos_addons'):
         name = entrypoint.name.strip()
         if name.endswith('.func') and name.rsplit('.', 1)[0] == args.addon_name:
             func = entrypoint.load()
@@ -2173,7 +2270,7 @@ def main():
             version='%(prog)s {}'.format(SOS_FULL_VERSION))
         subparsers = master_parser.add_subparsers(title='subcommands',
             # hide pack and unpack
-            metavar = '{install,run,resume,dryrun,status,push,pull,execute,kill,purge,config,convert,remove}')
+            metavar = '{install,run,resume,dryrun,status,push,pull,execute,kill,purge,config,convert,remove,cache}')
 
         # command install
         # add_sub_parser(subparsers, get_install_parser(desc_only='install'!=subcommand))
@@ -2219,6 +2316,9 @@ def main():
         # command remove
         add_sub_parser(subparsers, get_remove_parser(desc_only='remove'!=subcommand))
         #
+        # command cache
+        add_sub_parser(subparsers, get_cache_parser(desc_only='cache'!=subcommand))
+        #
         # command pack
         add_sub_parser(subparsers, get_pack_parser(desc_only='pack'!=subcommand), hidden=True)
         #
@@ -2226,9 +2326,11 @@ def main():
         add_sub_parser(subparsers, get_unpack_parser(desc_only='unpack'!=subcommand), hidden=True)
         #
         # addon packages
-        if subcommand is None or subcommand not in ['install', 'run', 'dryrun', 'convert', 'push', 'pull',
-                'remove', 'config', 'pack', 'unpack']:
-            for entrypoint in pkg_resources.iter_entry_points(group='sos_addons'):
+        if subcommand is None or subcommand not in ['install', 'run', 'resume', 'dryrun', 'status',
+                'push', 'pull', 'preview', 'execute', 'kill', 'purge', 'config', 'convert', 'remove',
+                'cache', 'pack', 'unpack']:
+            from .plugins import iter_entry_points
+            for entrypoint in iter_entry_points('sos_addons'):
                 if entrypoint.name.strip().endswith('.parser'):
                     name = entrypoint.name.rsplit('.', 1)[0]
                     func = entrypoint.load()
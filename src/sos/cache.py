@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+# This file is part of Script of Scripts (SoS), a workflow system
+# for the execution of commands and scripts in different languages.
+# Please visit https://github.com/vatlab/SOS for more information.
+#
+# Copyright (C) 2016 Bo Peng (bpeng@mdanderson.org)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import json
+import time
+import shutil
+
+from .utils import env, expand_size
+from .signatures import SQLiteDB, signature_store
+from .targets import file_target, textMD5
+
+__all__ = ['OutputCache', 'output_cache', 'cache_output']
+
+# ioctl request to clone a file on file systems with copy-on-write support (Linux)
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dest):
+    import fcntl
+    try:
+        with open(src, 'rb') as s, open(dest, 'wb') as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+    except Exception:
+        if os.path.exists(dest):
+            os.remove(dest)
+        raise
+
+
+def _copy_file(src, dest):
+    '''Copy src to dest, sharing blocks of the files if the file system allows'''
+    try:
+        _reflink(src, dest)
+        shutil.copystat(src, dest)
+    except Exception:
+        shutil.copy2(src, dest)
+
+
+def _cache_size(size):
+    # expand_size does not accept sizes without unit as strings
+    return int(size) if isinstance(size, str) and size.strip().isdigit() else expand_size(size)
+
+
+class OutputCache(SQLiteDB):
+    '''A content-addressed cache of step outputs that can be shared across projects.
+    Outputs are keyed by step signature id and signatures of input and dependent
+    files, so a step executed with the same script, variables and input content
+    in another directory can restore its output from the cache instead of being
+    executed. Least recently used entries are evicted when the size of the cache
+    exceeds max_size.'''
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        super(OutputCache, self).__init__(os.path.join(self.cache_dir, 'cache.db'))
+        self.max_size = None if max_size is None else _cache_size(max_size)
+
+    def _init_db(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            sig_id TEXT,
+            outputs TEXT,
+            content TEXT,
+            size INTEGER,
+            created REAL,
+            accessed REAL
+        )''')
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    def cache_key(self, sig):
+        '''Return key of a step signature (RuntimeInfo), or None if the step
+        cannot be cached'''
+        if not sig.output_files or not isinstance(sig.output_files, list) or \
+            not isinstance(sig.dependent_files, list) or \
+            not all(isinstance(x, file_target) for x in sig.output_files):
+            return None
+        try:
+            return textMD5(sig.sig_id + '\n' + '\n'.join(f'{x}\t{x.target_signature()}'
+                for x in sig.input_files + sig.dependent_files))
+        except Exception as e:
+            env.logger.debug(f'Failed to create cache key for {sig.sig_id}: {e}')
+            return None
+
+    def add(self, sig):
+        '''Copy output of a step with written signature to the cache'''
+        key = self.cache_key(sig)
+        if key is None:
+            return False
+        content = signature_store(sig.external_output).get_step(sig.sig_id)
+        if content is None or any(not os.path.isfile(x.fullname()) for x in sig.output_files):
+            return False
+        conn = self.conn
+        if conn.execute('SELECT key FROM entries WHERE key=?', (key,)).fetchone():
+            return True
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            size = 0
+            for idx, f in enumerate(sig.output_files):
+                _copy_file(f.fullname(), os.path.join(tmp_dir, str(idx)))
+                size += os.path.getsize(f.fullname())
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.rename(tmp_dir, entry_dir)
+            now = time.time()
+            self._write([('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(key, sig.sig_id, json.dumps([str(x) for x in sig.output_files]), content, size, now, now)])])
+        except Exception as e:
+            env.logger.warning(f'Failed to save output of step {sig.sig_id} to cache {self.cache_dir}: {e}')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        env.logger.debug(f'Output {", ".join(str(x) for x in sig.output_files)} saved to cache as {key}')
+        if self.max_size is not None and self.size() > self.max_size:
+            self.prune(self.max_size)
+        return True
+
+    def restore(self, sig):
+        '''Restore output of a step from the cache and save its signature. Returns
+        True if the output is restored. Files are copied (or reflinked) from the
+        cache so that changes to the restored files do not change the cache. The
+        restored signature should be validated and the entry be removed (e.g.
+        corrupted) if validation fails.'''
+        key = self.cache_key(sig)
+        if key is None:
+            return False
+        rec = self.conn.execute('SELECT outputs, content FROM entries WHERE key=?', (key,)).fetchone()
+        if rec is None:
+            return False
+        outputs = json.loads(rec[0])
+        if outputs != [str(x) for x in sig.output_files]:
+            return False
+        entry_dir = self._entry_dir(key)
+        try:
+            for idx, f in enumerate(sig.output_files):
+                dest = f.fullname()
+                if os.path.exists(dest):
+                    os.remove(dest)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                _copy_file(os.path.join(entry_dir, str(idx)), dest)
+        except Exception as e:
+            env.logger.warning(f'Failed to restore output of step {sig.sig_id} from cache {self.cache_dir}: {e}')
+            self.remove([key])
+            return False
+        self._write([('UPDATE entries SET accessed=? WHERE key=?', [(time.time(), key)])])
+        # the step signature will be validated as if the step had been executed here
+        signature_store(sig.external_output).write(steps=[(sig.sig_id, rec[1])])
+        env.logger.debug(f'Output {", ".join(outputs)} restored from cache {key}')
+        return True
+
+    def entries(self):
+        '''Return (key, outputs, size, created, accessed) of entries, most recently used first'''
+        return [(x[0], json.loads(x[1]), x[2], x[3], x[4]) for x in self.conn.execute(
+            'SELECT key, outputs, size, created, accessed FROM entries ORDER BY accessed DESC')]
+
+    def size(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def remove(self, keys):
+        self._write([('DELETE FROM entries WHERE key=?', [(x,) for x in keys])])
+        for key in keys:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def prune(self, max_size=0, dryrun=False):
+        '''Remove least recently used entries until the size of the cache is no
+        larger than max_size. Returns removed (or to be removed if dryrun) entries.'''
+        max_size = _cache_size(max_size)
+        entries = self.entries()
+        total = sum(x[2] for x in entries)
+        removed = []
+        while entries and total > max_size:
+            entry = entries.pop()
+            total -= entry[2]
+            removed.append(entry)
+        if removed and not dryrun:
+            self.remove([x[0] for x in removed])
+        return removed
+
+
+_caches = {}
+
+
+def output_cache():
+    '''Return the output cache specified by option sos_output_cache of sos
+    configuration (with size limited by option sos_output_cache_size, default
+    to 10G), or None if caching of outputs is not enabled.'''
+    cfg = env.sos_dict['CONFIG'] if 'CONFIG' in env.sos_dict else {}
+    cache_dir = cfg.get('sos_output_cache', None)
+    if not cache_dir:
+        return None
+    max_size = cfg.get('sos_output_cache_size', '10G')
+    if (cache_dir, max_size) not in _caches:
+        _caches[(cache_dir, max_size)] = OutputCache(cache_dir, max_size)
+    return _caches[(cache_dir, max_size)]
+
+
+def cache_output(sig):
+    '''Save output of a step with written signature to the output cache, if enabled'''
+    cache = output_cache()
+    if cache is not None:
+        cache.add(sig)
@@ -23,6 +23,7 @@
 import networkx as nx
 from collections import defaultdict
 import copy
+import heapq
 import pickle
 import time
 import fasteners
@@ -122,10 +123,37 @@ class SoS_Node(object):
 
 class SoS_DAG(nx.DiGraph):
     def __init__(self, *args, **kwargs):
+        # expected durations of steps, and lengths of critical paths that are
+        # cached until nodes or edges are added to or removed from the DAG
+        self._durations = None
+        self._path_lengths = None
+        # nodes that are ready to be executed, in a heap ordered by lengths of
+        # their critical paths, and nodes that have been returned by find_executable
+        # but have not been completed, which are built from _path_lengths
+        self._ready = None
+        self._ready_lengths = None
+        self._outstanding = None
         nx.DiGraph.__init__(self, *args, **kwargs)
         # all_dependent files includes input and depends files
         self._all_dependent_files = defaultdict(list)
         self._all_output_files = defaultdict(list)
+        self._path_lengths = None
+
+    def add_node(self, *args, **kwargs):
+        self._path_lengths = None
+        nx.DiGraph.add_node(self, *args, **kwargs)
+
+    def remove_node(self, *args, **kwargs):
+        self._path_lengths = None
+        nx.DiGraph.remove_node(self, *args, **kwargs)
+
+    def add_edge(self, *args, **kwargs):
+        self._path_lengths = None
+        nx.DiGraph.add_edge(self, *args, **kwargs)
+
+    def remove_edge(self, *args, **kwargs):
+        self._path_lengths = None
+        nx.DiGraph.remove_edge(self, *args, **kwargs)
 
     def num_nodes(self):
         return nx.number_of_nodes(self)
@@ -183,28 +211,91 @@ class SoS_DAG(nx.DiGraph):
                 if node not in self._all_output_files[x]:
                     self._all_output_files[x].append(node)
 
+    def step_duration(self, node):
+        '''Expected duration of a node, which is the average duration of previous
+        runs of the step, or the average duration of all steps if the step has
+        not been executed before.'''
+        if self._durations is None:
+            from .signatures import signature_store
+            try:
+                self._durations = signature_store().get_durations()
+            except Exception as e:
+                env.logger.debug(f'Failed to read durations of steps: {e}')
+                self._durations = {}
+        step_name = node._node_id.split(' ')[0]
+        if step_name in self._durations:
+            return self._durations[step_name]
+        elif self._durations:
+            return sum(self._durations.values()) / len(self._durations)
+        else:
+            return 1
+
+    def critical_path_lengths(self):
+        '''Return a dictionary of nodes and the lengths of the longest paths,
+        weighted by expected durations of nodes, from the nodes to the end of
+        the DAG.'''
+        if self._path_lengths is not None:
+            return self._path_lengths
+        try:
+            nodes = list(nx.topological_sort(self))
+        except nx.NetworkXUnfeasible:
+            # circular dependencies are reported elsewhere
+            lengths = {x: 0 for x in self.nodes()}
+        else:
+            lengths = {}
+            for node in reversed(nodes):
+                lengths[node] = self.step_duration(node) + \
+                    max([lengths[x] for x in self.successors(node)], default=0)
+        self._path_lengths = lengths
+        return lengths
+
+    def _is_ready(self, node):
+        return node._status is None and all(x._status == 'completed' for x in self.predecessors(node))
+
+    def _push_ready(self, nodes):
+        lengths = self._path_lengths
+        for node in nodes:
+            if self._is_ready(node):
+                heapq.heappush(self._ready, (-lengths.get(node, 0), node._node_uuid, node))
+
+    def _update_ready(self):
+        '''Update the heap of ready nodes with status changes of outstanding nodes,
+        or rebuild it if the DAG has been changed'''
+        if self._ready is None or self._path_lengths is None or self._ready_lengths is not self._path_lengths:
+            self.critical_path_lengths()
+            self._ready_lengths = self._path_lengths
+            self._ready = []
+            self._outstanding = {x for x in self.nodes() if x._status not in (None, 'completed')}
+            self._push_ready(self.nodes())
+            return
+        for node in [x for x in self._outstanding if x._status in (None, 'completed')]:
+            self._outstanding.discard(node)
+            self._push_ready([node] if node._status is None else self.successors(node))
+
     def find_executable(self):
         '''Find an executable node, which means nodes that has not been completed
-        and has no input dependency.'''
-        for node in self.nodes():
-            # if it has not been executed
+        and has no input dependency. Nodes on the longest (critical) path to the
+        end of the DAG are executed first.'''
+        self._update_ready()
+        while self._ready:
+            node = self._ready[0][2]
             if node._status is None:
-                with_dependency = False
-                for edge in self.in_edges(node):
-                    if edge[0]._status != 'completed':
-                        with_dependency = True
-                        break
-                if not with_dependency:
-                    return node
+                return node
+            # the node is being executed, or has been completed
+            heapq.heappop(self._ready)
+            if node._status == 'completed':
+                self._push_ready(self.successors(node))
+            else:
+                self._outstanding.add(node)
         # if no node could be found, let use try pending ones
-        pending_jobs = [x for x in self.nodes() if x._status == 'signature_pending']
+        pending_jobs = [x for x in self._outstanding if x._status == 'signature_pending']
         if pending_jobs:
             try:
-                notifier = ActivityNotifier(f'Waiting for {len(pending_jobs)} pending job{"s: e.g." if len(pending_jobs) > 1 else ":"} output {short_repr(pending_jobs[0]._signature[0])} with signature file {pending_jobs[0]._signature[1] + "_"}. You can manually remove this lock file if you are certain that no other process is working on the output.')
+                notifier = ActivityNotifier(f'Waiting for {len(pending_jobs)} pending job{"s: e.g." if len(pending_jobs) > 1 else ":"} output {short_repr(pending_jobs[0]._signature[0])} with lock file {pending_jobs[0]._signature[1]}. You can manually remove this lock file if you are certain that no other process is working on the output.')
                 while True:
                     for node in pending_jobs:
                         # if it has not been executed
-                        lock = fasteners.InterProcessLock(node._signature[1] + '_')
+                        lock = fasteners.InterProcessLock(node._signature[1])
                         if lock.acquire(blocking=False):
                             lock.release()
                             node._status = None
@@ -269,6 +360,8 @@ class SoS_DAG(nx.DiGraph):
                     else:
                         env.logger.info(f'Re-running {node._node_id} to generate {target}')
                         node._status = None
+                        # nodes that are ready to be executed have to be found again
+                        self._ready = None
             return True
         else:
             # so the signature exists but the step is not in all output files
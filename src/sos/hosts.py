@@ -20,23 +20,25 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 import os
+import re
 import sys
 import stat
+import threading
 
 import pexpect
 import subprocess
-import multiprocessing as mp
 import pickle
 import shutil
 import glob
-import pkg_resources
 from collections.abc import Sequence
 
 from .utils import env, short_repr, expand_size, format_HHMMSS, expand_time, DelayedAction
 from .eval import Undetermined, cfg_interpolate
-from .tasks import BackgroundProcess_TaskEngine, loadTask
+from .tasks import BackgroundProcess_TaskEngine, loadTask, loadTaskHeader, blob_dir
+from .task_store import task_store
 from .syntax import SOS_LOGLINE
 from .targets import sos_targets, path
+from .plugins import iter_entry_points
 
 #
 # A 'queue' is defined by queue configurations in SoS configuration files.
@@ -70,50 +72,15 @@ from .targets import sos_targets, path
 # Implementation wise, a queue instance is created for each queue.
 #
 
-class DaemonizedProcess(mp.Process):
-    def __init__(self, cmd, *args, **kwargs):
-        super(DaemonizedProcess, self).__init__(*args, **kwargs)
-        self.cmd = cmd
-
-    def run(self):
-        try:
-            pid = os.fork()
-            if pid > 0:
-                # exit from second parent
-                sys.exit(0)
-        except OSError as err:
-            env.logger.error(f'_Fork #1 failed: {err}\n')
-            sys.exit(1)
-
-        os.setsid()
-        os.umask(0)
-        # do second fork
-        try:
-            pid = os.fork()
-            if pid > 0:
-                # exit from second parent
-                sys.exit(0)
-        except OSError as err:
-            env.logger.error(f'_Fork #2 failed: {err}\n')
-            sys.exit(1)
-        # the following is also need to properly daemonize the process
-        # redirect standard file descriptors
-        sys.stdout.flush()
-        sys.stderr.flush()
-        try:
-            si = open(os.devnull, 'r')
-            so = open(os.devnull, 'w')
-            se = open(os.devnull, 'w')
-            os.dup2(si.fileno(), sys.stdin.fileno())
-            os.dup2(so.fileno(), sys.stdout.fileno())
-            os.dup2(se.fileno(), sys.stderr.fileno())
-        except Exception:
-            # #493
-            pass
-
-        # fork a new process
-        subprocess.Popen(self.cmd, shell=True, close_fds=True)
-        return
+def daemonize(cmd, **kwargs):
+    '''Run cmd in a new session, detached from the terminal and the standard
+    streams of sos. The command is started with fork/exec by subprocess so no
+    python code is executed in the forked process, which could otherwise
+    deadlock on locks held by other threads (e.g. those submitting tasks).'''
+    kwargs.setdefault('stdin', subprocess.DEVNULL)
+    kwargs.setdefault('stdout', subprocess.DEVNULL)
+    kwargs.setdefault('stderr', subprocess.DEVNULL)
+    subprocess.Popen(cmd, shell=True, close_fds=True, start_new_session=True, **kwargs)
 
 def _show_err_and_out(task_id):
     sys_task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
@@ -158,6 +125,10 @@ class LocalHost:
     def send_to_host(self, items):
         return {x:x for x in items}
 
+    def forget_sent_blobs(self):
+        # blobs are not sent to localhost
+        pass
+
     def receive_from_host(self, items):
         return {x:x for x in items}
 
@@ -165,12 +136,14 @@ class LocalHost:
         def_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.def')
         task_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', self.alias, task_id + '.task')
         # add server restriction on task file
-        params = loadTask(def_file)
-        task_vars = params.sos_dict
-
         if 'max_mem' not in self.config and 'max_cores' not in self.config and 'max_walltime' not in self.config:
+            # runtime options are read from the header of the task file without loading the task
+            task_runtime = loadTaskHeader(def_file)['runtime']
             shutil.copyfile(def_file, task_file)
         else:
+            params = loadTask(def_file)
+            task_vars = params.sos_dict
+            task_runtime = task_vars['_runtime']
 
             task_vars['_runtime']['max_mem'] = self.config.get('max_mem', None)
             task_vars['_runtime']['max_cores'] = self.config.get('max_cores', None)
@@ -196,8 +169,8 @@ class LocalHost:
 
             params.save(task_file)
         #
-        if 'to_host' in task_vars['_runtime'] and isinstance(task_vars['_runtime']['to_host'], dict):
-            for l, r in task_vars['_runtime']['to_host'].items():
+        if 'to_host' in task_runtime and isinstance(task_runtime['to_host'], dict):
+            for l, r in task_runtime['to_host'].items():
                 if l != r:
                     shutil.copy(l, r)
         self.send_task_file(task_file)
@@ -208,6 +181,12 @@ class LocalHost:
         dest_task_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', os.path.basename(task_file))
         if task_file != dest_task_file:
             shutil.copyfile(task_file, dest_task_file)
+        # index the task, or mark it as submitted with its job file
+        task_id, ext = os.path.splitext(os.path.basename(task_file))
+        if ext == '.task':
+            task_store().add(task_id, task_mtime=os.path.getmtime(dest_task_file))
+        elif ext == '.sh' and '-' not in task_id:
+            task_store().update(task_id, status='submitted')
 
     def check_output(self, cmd: object) -> object:
         # get the output of command
@@ -236,9 +215,7 @@ class LocalHost:
         elif wait_for_task or sys.platform == 'win32':
             return subprocess.Popen(cmd, shell=True, **kwargs)
         else:
-            p = DaemonizedProcess(cmd, **kwargs)
-            p.start()
-            p.join()
+            daemonize(cmd, **kwargs)
 
     def receive_result(self, task_id):
         sys_task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
@@ -315,6 +292,10 @@ class RemoteHost:
         self.task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', self.alias)
         if not os.path.isdir(self.task_dir):
             os.mkdir(self.task_dir)
+        # blobs of tasks that exist on the remote host, which are sent by
+        # concurrent submitters of tasks
+        self._sent_blobs = None
+        self._blob_lock = threading.Lock()
 
     def _get_shared_dirs(self):
         value = self.config.get('shared', [])
@@ -541,21 +522,24 @@ class RemoteHost:
 
     def _prepare_task(self, task_id):
         def_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.def')
-        params = loadTask(def_file)
-        task_vars = params.sos_dict
+        # resources are checked from the header of the task file before the task is loaded
+        task_runtime = loadTaskHeader(def_file)['runtime']
 
-        if self.config.get('max_mem', None) is not None and task_vars['_runtime'].get('mem', None) is not None \
-                and self.config['max_mem'] < task_vars['_runtime']['mem']:
+        if self.config.get('max_mem', None) is not None and task_runtime.get('mem', None) is not None \
+                and self.config['max_mem'] < task_runtime['mem']:
             raise ValueError(
-                f'Task {task_id} requested more mem ({task_vars["_runtime"]["mem"]}) than allowed max_mem ({self.config["max_mem"]})')
-        if self.config.get('max_cores', None) is not None and task_vars['_runtime'].get('cores', None) is not None \
-                and self.config['max_cores'] < task_vars['_runtime']['cores']:
+                f'Task {task_id} requested more mem ({task_runtime["mem"]}) than allowed max_mem ({self.config["max_mem"]})')
+        if self.config.get('max_cores', None) is not None and task_runtime.get('cores', None) is not None \
+                and self.config['max_cores'] < task_runtime['cores']:
             raise ValueError(
-                f"Task {task_id} requested more cores ({task_vars['_runtime']['cores']}) than allowed max_cores ({self.config['max_cores']})")
-        if self.config.get('max_walltime', None) is not None and task_vars['_runtime'].get('walltime', None) is not None \
-                and expand_time(self.config['max_walltime']) < expand_time(task_vars['_runtime']['walltime']):
+                f"Task {task_id} requested more cores ({task_runtime['cores']}) than allowed max_cores ({self.config['max_cores']})")
+        if self.config.get('max_walltime', None) is not None and task_runtime.get('walltime', None) is not None \
+                and expand_time(self.config['max_walltime']) < expand_time(task_runtime['walltime']):
             raise ValueError(
-                f'Task {task_id} requested more walltime ({task_vars["_runtime"]["walltime"]}) than allowed max_walltime ({self.config["max_walltime"]})')
+                f'Task {task_id} requested more walltime ({task_runtime["walltime"]}) than allowed max_walltime ({self.config["max_walltime"]})')
+
+        params = loadTask(def_file)
+        task_vars = params.sos_dict
 
         if task_vars['_input'] and not isinstance(task_vars['_input'], Undetermined):
             env.logger.info(f'{task_id} ``sending`` {short_repr(task_vars["_input"])}')
@@ -621,8 +605,57 @@ class RemoteHost:
         params.save(task_file)
         self.send_task_file(task_file)
 
+    def _send_blobs(self, task_file):
+        '''Send blobs referenced by a task that do not exist on the remote host,
+        so that blobs shared by tasks are sent only once'''
+        blobs = loadTaskHeader(task_file).get('blobs', [])
+        if not blobs:
+            return
+        with self._blob_lock:
+            if self._sent_blobs is None:
+                try:
+                    self._sent_blobs = set(subprocess.check_output(
+                        f'ssh -q {self.address} -p {self.port} "ls ~/.sos/tasks/blobs 2>/dev/null || true"',
+                        shell=True).decode().split())
+                except subprocess.CalledProcessError as e:
+                    env.logger.debug(f'Failed to list blobs on {self.alias}: {e}')
+                    self._sent_blobs = set()
+            blobs = [x for x in blobs if x not in self._sent_blobs]
+            if not blobs:
+                return
+            send_cmd = cfg_interpolate('ssh -q {address} -p {port} "[ -d ~/.sos/tasks/blobs ] || mkdir -p ~/.sos/tasks/blobs" && scp -q -P {port} {blob_files:ap} {address}:.sos/tasks/blobs/',
+                    {'blob_files': sos_targets([os.path.join(blob_dir(), x) for x in blobs]), 'address': self.address, 'port': self.port})
+            try:
+                subprocess.check_call(send_cmd, shell=True)
+            except subprocess.CalledProcessError as e:
+                # blobs on the remote host are listed again for the next task
+                self._sent_blobs = None
+                raise RuntimeError(f'Failed to copy blobs of {task_file} to {self.alias} using command {send_cmd}: {e}')
+            self._sent_blobs.update(blobs)
+
+    def forget_sent_blobs(self):
+        '''Forget blobs that have been sent so that they are listed again, e.g.
+        after they are purged on the remote host'''
+        with self._blob_lock:
+            self._sent_blobs = None
+
+    def _check_missing_blobs(self, task_id):
+        '''Forget blobs that have been sent if a task failed because of missing
+        blobs, which are removed by sos purge on the remote host'''
+        err_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.err')
+        try:
+            with open(err_file) as err:
+                if re.search(r'Blob \w+ of task is not found', err.read()):
+                    env.logger.debug(f'Blobs of {task_id} are missing on {self.alias}')
+                    self.forget_sent_blobs()
+        except OSError:
+            pass
+
     @check_connection
     def send_task_file(self, task_file):
+        # blobs are sent before the task so that the task can be executed once it is sent
+        if task_file.endswith('.task'):
+            self._send_blobs(task_file)
         send_cmd = cfg_interpolate('ssh -q {address} -p {port} "[ -d ~/.sos/tasks ] || mkdir -p ~/.sos/tasks" && scp -q -P {port} {job_file:ap} {address}:.sos/tasks/',
                 {'job_file': sos_targets(task_file), 'address': self.address, 'port': self.port})
         # use scp for this simple case
@@ -683,9 +716,7 @@ class RemoteHost:
             # keep proc persistent to avoid a subprocess is still running warning.
             return subprocess.Popen(cmd, shell=True, **kwargs)
         else:
-            p = DaemonizedProcess(cmd, **kwargs)
-            p.start()
-            p.join()
+            daemonize(cmd, **kwargs)
 
     @check_connection
     def receive_result(self, task_id):
@@ -712,6 +743,7 @@ class RemoteHost:
                 raise RuntimeError('Failed to retrieve result of job {} from {} with cmd\n{}'.format(task_id, self.alias, receive_cmd))
         res_file = os.path.join(sys_task_dir, task_id + '.res')
         if not os.path.isfile(res_file):
+            self._check_missing_blobs(task_id)
             _show_err_and_out(task_id)
             env.logger.debug(f'Result for {task_id} is not received')
             return {'ret_code': 1, 'output': {}}
@@ -720,6 +752,7 @@ class RemoteHost:
             res = pickle.load(result)
 
         if ('ret_code' in res and res['ret_code'] != 0) or ('succ' in res and res['succ'] != 0):
+            self._check_missing_blobs(task_id)
             _show_err_and_out(task_id)
             env.logger.info(f'Ignore remote results for failed job {task_id}')
         else:
@@ -889,7 +922,7 @@ class Host:
                 task_engine = None
 
                 available_engines = []
-                for entrypoint in pkg_resources.iter_entry_points(group='sos_taskengines'):
+                for entrypoint in iter_entry_points('sos_taskengines'):
                     try:
                         if entrypoint.name == self._task_engine_type:
                             task_engine = entrypoint.load()(self.host_instances[self.alias])
@@ -950,11 +983,10 @@ def list_queues(cfg, verbosity = 1, check_status=False):
             continue
         if check_status or verbosity > 2:
             try:
-                status = h._task_engine.query_tasks(tasks=[], verbosity=0)
+                status = [x[2] for x in h._task_engine.query_task_status(tasks=[])]
             except Exception as e:
                 env.logger.warning(f"Failed to check status of remote host {host}: {e}")
                 continue
-            status = [x.strip() for x in status.splitlines() if x.strip()]
             running = str(status.count('running'))
             pending = str(status.count('pending'))
             completed = str(status.count('completed'))
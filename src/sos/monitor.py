@@ -20,18 +20,164 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 import os
+import sys
 import psutil
+import queue
 import threading
 import time
 from datetime import datetime
 import stat
 from .utils import env, expand_time, format_HHMMSS
 
+class ProcReader(object):
+    '''Read cpu and memory use of a process tree from /proc on Linux. Cpu times
+    of processes are kept between samples so that cpu use is measured over
+    the sampling interval, or since the start of processes that are sampled
+    for the first time.'''
+
+    def __init__(self):
+        self._ticks = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        self._boot_time = psutil.boot_time()
+        # pid: (start time, cpu time, time of sample)
+        self._samples = {}
+        # children of processes are listed in /proc/{pid}/task/{tid}/children
+        # if the kernel is configured with CONFIG_PROC_CHILDREN
+        self._list_children = os.path.isfile(f'/proc/{os.getpid()}/task/{os.getpid()}/children')
+
+    @staticmethod
+    def available():
+        return sys.platform.startswith('linux') and os.path.isfile('/proc/self/stat')
+
+    def _read_stat(self, pid):
+        '''Return ppid, start time (in ticks since boot), cpu time and rss of a process'''
+        with open(f'/proc/{pid}/stat', 'rb') as stat_file:
+            content = stat_file.read()
+        # the name of the command, which is enclosed in () could contain spaces
+        fields = content[content.rindex(b')') + 2:].split()
+        return int(fields[1]), int(fields[19]), (int(fields[11]) + int(fields[12])) / self._ticks, \
+            int(fields[21]) * self._page_size
+
+    def _cpu_percent(self, pid, start, cpu_time, now, samples):
+        prev = self._samples.get(pid, None)
+        if prev is None or prev[0] != start:
+            prev = (start, 0, self._boot_time + start / self._ticks)
+        samples[pid] = (start, cpu_time, now)
+        return 0 if now <= prev[2] else (cpu_time - prev[1]) * 100 / (now - prev[2])
+
+    def stat(self, pid):
+        '''Return (ppid, cpu, mem) of a process'''
+        ppid, start, cpu_time, rss = self._read_stat(pid)
+        samples = {x: y for x, y in self._samples.items() if x != pid}
+        cpu = self._cpu_percent(pid, start, cpu_time, time.time(), samples)
+        self._samples = samples
+        return ppid, cpu, rss
+
+    def _children(self, pid):
+        children = []
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as child_file:
+                children.extend(int(x) for x in child_file.read().split())
+        return children
+
+    def tree(self, pid):
+        '''Return (ppid, cpu, mem) of a process and its descendants'''
+        stats = {}
+        if self._list_children:
+            pids = [pid]
+            while pids:
+                p = pids.pop()
+                try:
+                    stats[p] = self._read_stat(p)
+                    pids.extend(self._children(p))
+                except (FileNotFoundError, ProcessLookupError):
+                    # the process has ended
+                    if p == pid:
+                        raise
+        else:
+            # scan all processes for their parents
+            for entry in os.listdir('/proc'):
+                if not entry.isdigit():
+                    continue
+                try:
+                    stats[int(entry)] = self._read_stat(entry)
+                except (FileNotFoundError, ProcessLookupError):
+                    continue
+            if pid not in stats:
+                raise psutil.NoSuchProcess(pid)
+            descendants = {pid}
+            parents = {x: y[0] for x, y in stats.items()}
+            for p in parents:
+                chain = []
+                while p not in descendants and p in parents and p not in chain:
+                    chain.append(p)
+                    p = parents[p]
+                if p in descendants:
+                    descendants.update(chain)
+            stats = {x: stats[x] for x in descendants}
+        now = time.time()
+        samples = {}
+        res = {p: (ppid, self._cpu_percent(p, start, cpu_time, now, samples), rss)
+            for p, (ppid, start, cpu_time, rss) in stats.items()}
+        self._samples = samples
+        return res
+
+
+class CgroupReader(object):
+    '''Read cpu and memory use of all processes of a task from its cgroup (v2)'''
+
+    def __init__(self, path, start_time):
+        self.path = path
+        # cpu time (in microseconds) and time of last sample
+        self._prev = (0, start_time)
+
+    @staticmethod
+    def of_task(pid):
+        '''Return a reader for the cgroup of process pid if the process is executed
+        in its own cgroup, namely if all processes in the cgroup are pid or its
+        children, and None otherwise'''
+        try:
+            with open(f'/proc/{pid}/cgroup') as cgroup_file:
+                paths = [x[3:].strip() for x in cgroup_file if x.startswith('0::')]
+            if not paths or paths[0] in ('', '/'):
+                return None
+            path = os.path.join('/sys/fs/cgroup', paths[0].lstrip('/'))
+            if not os.path.isfile(os.path.join(path, 'cpu.stat')) or \
+                not os.path.isfile(os.path.join(path, 'memory.current')):
+                return None
+            proc = psutil.Process(pid)
+            tree = {pid} | {x.pid for x in proc.children(recursive=True)}
+            with open(os.path.join(path, 'cgroup.procs')) as procs:
+                if not {int(x) for x in procs.read().split()} <= tree:
+                    return None
+            return CgroupReader(path, proc.create_time())
+        except Exception as e:
+            env.logger.debug(f'Cgroup of process {pid} is not used: {e}')
+            return None
+
+    def sample(self):
+        '''Return cpu, memory use and number of processes of the cgroup'''
+        with open(os.path.join(self.path, 'cpu.stat')) as cpu_stat:
+            usage = [int(x.split()[1]) for x in cpu_stat if x.startswith('usage_usec')][0]
+        now = time.time()
+        with open(os.path.join(self.path, 'memory.current')) as mem:
+            mem = int(mem.read())
+        with open(os.path.join(self.path, 'cgroup.procs')) as procs:
+            nproc = len(procs.read().split())
+        cpu = 0 if now <= self._prev[1] else (usage - self._prev[0]) / 1e4 / (now - self._prev[1])
+        self._prev = (usage, now)
+        return cpu, mem, nproc
+
+
 class ProcessMonitor(threading.Thread):
-    def __init__(self, task_id, monitor_interval, resource_monitor_interval, max_walltime=None, max_mem=None, max_procs=None):
+    def __init__(self, task_id, monitor_interval, resource_monitor_interval, max_walltime=None, max_mem=None, max_procs=None,
+        pooled=False):
         threading.Thread.__init__(self)
         self.task_id = task_id
         self.pid = os.getpid()
+        # the task is executed by a worker of a process pool, which should not
+        # be killed with the task
+        self.pooled = pooled
         self.monitor_interval = monitor_interval
         self.resource_monitor_interval = max(resource_monitor_interval // monitor_interval, 1)
         self.daemon = True
@@ -40,6 +186,21 @@ class ProcessMonitor(threading.Thread):
             self.max_walltime = expand_time(self.max_walltime)
         self.max_mem = max_mem
         self.max_procs = max_procs
+        self._stopped = threading.Event()
+        # processes are kept between samples so that their cpu_percent is
+        # measured over the monitor interval
+        self._procs = {}
+        # subtasks executed by processes of the task, which are registered
+        # directly or reported by worker processes through a queue, and
+        # (subtask, start time, max_walltime, max_mem, max_procs) of subtasks
+        # with limits
+        self._subtasks = {}
+        self._limits = {}
+        self._queue = None
+        # on Linux, usage of processes is read from /proc, or from the cgroup of
+        # the task if the task is executed in its own cgroup (v2)
+        self._reader = ProcReader() if ProcReader.available() else None
+        self._cgroup = None if self._reader is None else CgroupReader.of_task(self.pid)
         self.pulse_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.pulse')
         # remove previous status file, which could be readonly if the job is killed
         if os.path.isfile(self.pulse_file):
@@ -50,19 +211,100 @@ class ProcessMonitor(threading.Thread):
             pd.write(f'#task: {task_id}\n')
             pd.write(f'#started at {datetime.now().strftime("%A, %d. %B %Y %I:%M%p")}\n#\n')
             pd.write('#time\tproc_cpu\tproc_mem\tchildren\tchildren_cpu\tchildren_mem\n')
+        # samples are saved to the task database, and are written to the pulse
+        # file only if the database cannot be written
+        from .task_store import task_store
+        self._store = task_store()
+        try:
+            self._store.remove_samples(task_id)
+        except Exception as e:
+            env.logger.debug(f'Failed to remove resource samples of {task_id}: {e}')
+
+    def subtask_queue(self):
+        '''A queue through which worker processes report (pid, subtask, limits,
+        start time) of the subtasks they execute'''
+        if self._queue is None:
+            import multiprocessing as mp
+            self._queue = mp.Queue()
+        return self._queue
+
+    def register_subtask(self, pid, task_id, limits=None, start_time=None):
+        '''Attribute resources used by process pid and its children to a subtask,
+        or stop doing so if task_id is None. The subtask is killed if it exceeds
+        max_walltime, max_mem or max_procs in limits.'''
+        if task_id is None:
+            self._subtasks.pop(pid, None)
+            self._limits.pop(pid, None)
+            return
+        self._subtasks[pid] = task_id
+        if limits and any(limits.get(x, None) is not None for x in ('max_walltime', 'max_mem', 'max_procs')):
+            max_walltime = limits.get('max_walltime', None)
+            self._limits[pid] = (task_id, time.time() if start_time is None else start_time,
+                None if max_walltime is None else expand_time(max_walltime),
+                limits.get('max_mem', None), limits.get('max_procs', None))
+        else:
+            self._limits.pop(pid, None)
+
+    def _read_queue(self):
+        if self._queue is not None:
+            while True:
+                try:
+                    self.register_subtask(*self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+    def _process(self, pid):
+        if pid not in self._procs:
+            self._procs[pid] = psutil.Process(pid)
+        return self._procs[pid]
+
+    def _psutil_tree(self):
+        '''Return (ppid, cpu, mem) of the task process and its descendants from psutil'''
+        current_process = self._process(self.pid)
+        tree = {self.pid: (None, current_process.cpu_percent(), current_process.memory_info()[0])}
+        for child in current_process.children(recursive=True):
+            try:
+                proc = self._process(child.pid)
+                tree[child.pid] = (proc.ppid(), proc.cpu_percent(), proc.memory_info()[0])
+            except psutil.NoSuchProcess:
+                continue
+        for pid in set(self._procs.keys()) - set(tree.keys()):
+            self._procs.pop(pid)
+        return tree
 
     def _check(self):
-        current_process = psutil.Process(self.pid)
-        par_cpu = current_process.cpu_percent()
-        par_mem = current_process.memory_info()[0]
+        '''Return cpu and memory use of the task, and a dictionary of those of
+        its subtasks, from a single walk of its process tree'''
+        self._read_queue()
+        subtasks = dict(self._subtasks)
+        if self._cgroup is not None and not subtasks:
+            # the process tree does not have to be walked if the task has its own cgroup
+            _, par_cpu, par_mem = self._reader.stat(self.pid)
+            cpu, mem, nproc = self._cgroup.sample()
+            return (par_cpu, par_mem, nproc - 1, max(cpu - par_cpu, 0), max(mem - par_mem, 0)), {}
+        tree = self._psutil_tree() if self._reader is None else self._reader.tree(self.pid)
+        _, par_cpu, par_mem = tree.pop(self.pid)
+        # usage of subtask: [proc_cpu, proc_mem, children, children_cpu, children_mem]
+        usage = {x: [0, 0, 0, 0, 0] for x in subtasks.values()}
+        if self.pid in subtasks:
+            usage[subtasks[self.pid]][:2] = [par_cpu, par_mem]
         ch_cpu = 0
         ch_mem = 0
-        children = current_process.children(recursive=True)
-        n_children = len(children)
-        for child in children:
-            ch_cpu += child.cpu_percent()
-            ch_mem += child.memory_info()[0]
-        return par_cpu, par_mem, n_children, ch_cpu, ch_mem
+        for pid, (ppid, cpu, mem) in tree.items():
+            ch_cpu += cpu
+            ch_mem += mem
+            if pid in subtasks:
+                usage[subtasks[pid]][:2] = [cpu, mem]
+                continue
+            # children of processes that execute subtasks
+            while ppid in tree and ppid not in subtasks:
+                ppid = tree[ppid][0]
+            if ppid in subtasks:
+                rec = usage[subtasks[ppid]]
+                rec[2] += 1
+                rec[3] += cpu
+                rec[4] += mem
+        return (par_cpu, par_mem, len(tree), ch_cpu, ch_mem), usage
 
     def _exceed_resource(self, msg):
         err_file =  os.path.join(os.path.expanduser('~'), '.sos', 'tasks', self.task_id + '.err')
@@ -71,25 +313,94 @@ class ProcessMonitor(threading.Thread):
         # kill the task
         from stat import S_IREAD, S_IRGRP, S_IROTH
         os.chmod(self.pulse_file, S_IREAD|S_IRGRP|S_IROTH)
+        self._kill()
+
+    def _check_subtasks(self, usage=None):
+        '''Kill subtasks that exceed their max_walltime, or their max_procs and
+        max_mem if their usage is provided'''
+        self._read_queue()
+        now = time.time()
+        for pid, (task_id, start_time, max_walltime, max_mem, max_procs) in list(self._limits.items()):
+            if max_walltime is not None and now - start_time > max_walltime:
+                msg = f'Task {task_id} exits because of excessive run time (used {format_HHMMSS(int(now - start_time))}, limit {format_HHMMSS(max_walltime)})'
+            elif usage is not None and task_id in usage and max_procs is not None and usage[task_id][0] > max_procs:
+                msg = f'Task {task_id} exits because of excessive use of procs (used {usage[task_id][0]}, limit {max_procs})'
+            elif usage is not None and task_id in usage and max_mem is not None and usage[task_id][1] > max_mem:
+                msg = f'Task {task_id} exits because of excessive use of max_mem (used {usage[task_id][1]}, limit {max_mem})'
+            else:
+                continue
+            self._limits.pop(pid, None)
+            self._exceed_subtask(pid, task_id, msg)
+
+    def _exceed_subtask(self, pid, task_id, msg):
+        '''Kill child processes of process pid that executes a subtask. The task
+        is killed if there is no child process because the subtask would
+        otherwise continue to run.'''
+        err_file =  os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.err')
+        with open(err_file, 'a') as err:
+            err.write(msg + '\n')
+        try:
+            children = psutil.Process(pid).children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        if not children:
+            self._exceed_resource(msg)
+        for child in children:
+            try:
+                child.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+    def _kill(self):
+        '''Kill the task, namely the process of the task, or child processes of
+        the worker that executes the task if the task is executed by a worker of
+        a process pool. A pool worker is killed only if the task has no child
+        process because it would otherwise continue to execute the task.'''
         p = psutil.Process(self.pid)
-        p.kill()
+        children = p.children(recursive=True) if self.pooled else []
+        if not children:
+            p.kill()
+        for child in children:
+            try:
+                child.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+    def stop(self):
+        '''Stop monitoring a task that has been completed by a process that
+        continues to run (e.g. a worker of a process pool)'''
+        self._stopped.set()
 
     def run(self):
         counter = 0
         start_time = time.time()
         while True:
             try:
-                if not os.access(self.pulse_file, os.W_OK):
+                # the pulse file is made read-only when the task is killed. Mode bits are
+                # checked because os.access always reports writable files for root.
+                if not os.stat(self.pulse_file).st_mode & stat.S_IWUSR:
                     # the job should be killed
-                    p = psutil.Process(self.pid)
-                    p.kill()
+                    self._kill()
                 # most of the time we only update
                 if counter % self.resource_monitor_interval:
                     os.utime(self.pulse_file, None)
+                    self._check_subtasks()
                 else:
-                    cpu, mem, nch, ch_cpu, ch_mem = self._check()
-                    with open(self.pulse_file, 'a') as pd:
-                        pd.write(f'{time.time()}\t{cpu:.2f}\t{mem}\t{nch}\t{ch_cpu}\t{ch_mem}\n')
+                    (cpu, mem, nch, ch_cpu, ch_mem), usage = self._check()
+                    self._check_subtasks(usage)
+                    now = time.time()
+                    samples = [('', now, cpu, mem, nch, ch_cpu, ch_mem)] + \
+                        [(tid, now) + tuple(x) for tid, x in usage.items()]
+                    try:
+                        self._store.add_samples(self.task_id, samples)
+                        os.utime(self.pulse_file, None)
+                    except Exception as e:
+                        env.logger.debug(f'Failed to save resource samples of {self.task_id}: {e}')
+                        with open(self.pulse_file, 'a') as pd:
+                            pd.write(f'{now}\t{cpu:.2f}\t{mem}\t{nch}\t{ch_cpu}\t{ch_mem}\n')
+                            # samples of subtasks have their IDs in an extra column
+                            for tid, (s_cpu, s_mem, s_nch, s_ch_cpu, s_ch_mem) in usage.items():
+                                pd.write(f'{now}\t{s_cpu:.2f}\t{s_mem}\t{s_nch}\t{s_ch_cpu}\t{s_ch_mem}\t{tid}\n')
                     if self.max_procs is not None and cpu > self.max_procs:
                         self._exceed_resource(
                             f'Task {self.task_id} exits because of excessive use of procs (used {cpu}, limit {self.max_procs})')
@@ -101,7 +412,8 @@ class ProcessMonitor(threading.Thread):
                 if self.max_walltime is not None and elapsed > self.max_walltime:
                     self._exceed_resource(
                         f'Task {self.task_id} exits because of excessive run time (used {format_HHMMSS(int(elapsed))}, limit {format_HHMMSS(self.max_walltime)})')
-                time.sleep(self.monitor_interval)
+                if self._stopped.wait(self.monitor_interval):
+                    break
                 counter += 1
             except Exception as e:
                 # if the process died, exit the thread
@@ -111,12 +423,22 @@ class ProcessMonitor(threading.Thread):
                 env.logger.debug(f'Monitor of {self.task_id} failed with message {e}')
                 break
 
-def summarizeExecution(task_id, status='Unknown'):
+def summarizeResources(task_id, subtask=None):
+    '''Return peak and average use of cpu and memory, number of processes, and
+    start and end time of a task, or of one of its subtasks, from samples in the
+    task database or from its pulse file, or None if unavailable'''
+    try:
+        from .task_store import task_store
+        res = task_store().summarize_samples(task_id, '' if subtask is None else subtask)
+        if res is not None:
+            return res
+    except Exception as e:
+        env.logger.debug(f'Failed to summarize resource samples of {task_id}: {e}')
     pulse_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.pulse')
     if not os.path.isfile(pulse_file):
         pulse_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.status')
         if not os.path.isfile(pulse_file):
-            return
+            return None
     peak_cpu = 0
     accu_cpu = 0
     peak_mem = 0
@@ -129,10 +451,19 @@ def summarizeExecution(task_id, status='Unknown'):
         for line in proc:
             if line.startswith('#'):
                 continue
+            fields = line.split()
+            if len(fields) == 7:
+                # sample of a subtask
+                if fields[6] != subtask:
+                    continue
+                fields = fields[:6]
+            elif subtask is not None:
+                continue
             try:
-                t, c, m, nch, cc, cm = line.split()
+                t, c, m, nch, cc, cm = fields
             except Exception as e:
                 env.logger.warning(f'Unrecognized resource line "{line.strip()}": {e}')
+                continue
             if start_time is None:
                 start_time = float(t)
                 end_time = float(t)
@@ -147,24 +478,29 @@ def summarizeExecution(task_id, status='Unknown'):
                 peak_mem = float(m) + float(cm)
             if int(nch) > peak_nch:
                 peak_nch = int(nch)
+    return {'start': start_time, 'end': end_time, 'nproc': peak_nch,
+        'peak_cpu': peak_cpu, 'avg_cpu': 0 if count == 0 else accu_cpu/count,
+        'peak_mem': peak_mem, 'avg_mem': 0 if count == 0 else accu_mem/count}
+
+def summarizeExecution(task_id, status='Unknown', subtask=None):
+    res = summarizeResources(task_id, subtask)
+    if res is None or res['start'] is None:
+        return
     try:
-        second_elapsed = end_time - start_time
+        second_elapsed = res['end'] - res['start']
     except Exception:
         second_elapsed = 0
     result = [
         ('status', status),
-        ('task', task_id),
-        ('nproc', str(peak_nch)),
-        ('start', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))),
-        ('end', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))),
+        ('task', task_id if subtask is None else subtask),
+        ('nproc', str(res['nproc'])),
+        ('start', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(res['start']))),
+        ('end', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(res['end']))),
         ('duration', ('' if second_elapsed < 86400 else f'{int(second_elapsed/86400)} day{"s" if second_elapsed > 172800 else ""} ') + \
          time.strftime('%H:%M:%S', time.gmtime(second_elapsed))),
-        ('cpu_peak', f'{peak_cpu:.1f}'),
-        ('cpu_avg', f'{0 if count == 0 else accu_cpu/count:.1f}'),
-        ('mem_peak', f'{peak_mem/1024/1024:.1f}Mb'),
-        ('mem_avg', f'{0 if count == 0 else accu_mem/1024/1024/count:.1f}Mb')
+        ('cpu_peak', f'{res["peak_cpu"]:.1f}'),
+        ('cpu_avg', f'{res["avg_cpu"]:.1f}'),
+        ('mem_peak', f'{res["peak_mem"]/1024/1024:.1f}Mb'),
+        ('mem_avg', f'{res["avg_mem"]/1024/1024:.1f}Mb')
         ]
     return '\n'.join(f'{x:20s} {y}' for x, y in result)
-
-
-
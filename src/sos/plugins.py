@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# This file is part of Script of Scripts (SoS), a workflow system
+# for the execution of commands and scripts in different languages.
+# Please visit https://github.com/vatlab/SOS for more information.
+#
+# Copyright (C) 2016 Bo Peng (bpeng@mdanderson.org)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import sys
+import json
+import hashlib
+import importlib
+import threading
+
+from ._version import __version__
+
+__all__ = ['EntryPoint', 'PluginRegistry', 'plugin_registry', 'iter_entry_points', 'load_entry_point']
+
+# groups of entry points used by sos and its extensions
+_groups = ['sos_targets', 'sos_actions', 'sos_functions', 'sos_taskengines', 'sos_previewers',
+    'sos_converters', 'sos_addons']
+
+
+def _site_dirs():
+    '''site-packages directories on sys.path'''
+    return [x for x in sys.path if os.path.basename(x) in ('site-packages', 'dist-packages')]
+
+
+class EntryPoint(object):
+    '''A light-weight replacement of pkg_resources.EntryPoint that can be
+    loaded without importing pkg_resources.'''
+
+    def __init__(self, name, module_name, attrs=(), dist='', requirement=''):
+        self.name = name
+        self.module_name = module_name
+        self.attrs = tuple(attrs)
+        self.dist = dist
+        # requirement of sos that is not satisfied by the current version of sos
+        self.requirement = requirement
+
+    def load(self):
+        if self.requirement:
+            raise RuntimeError(f'{self.dist} requires {self.requirement}, '
+                f'please upgrade your version of sos from {__version__}')
+        obj = importlib.import_module(self.module_name)
+        for attr in self.attrs:
+            obj = getattr(obj, attr)
+        return obj
+
+    def __repr__(self):
+        return f'EntryPoint({self.name} = {self.module_name}:{".".join(self.attrs)})'
+
+    def __str__(self):
+        return f'{self.name} = {self.module_name}' + (f':{".".join(self.attrs)}' if self.attrs else '')
+
+
+class PluginRegistry(object):
+    '''An index of entry points of sos plugins. Scanning installed distributions
+    with pkg_resources is slow in large environments, so entry points are saved
+    to an index file under ~/.sos and are only rescanned when metadata of packages
+    on sys.path are added, removed or modified.'''
+
+    def __init__(self, index_file=None):
+        if index_file is None:
+            # other directories on sys.path (e.g. PYTHONPATH) are covered by the stamp
+            key = hashlib.md5('\n'.join([sys.prefix] + _site_dirs()).encode()).hexdigest()[:16]
+            index_file = os.path.join(os.path.expanduser('~'), '.sos', f'plugins_{key}.json')
+        self.index_file = index_file
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _stamp(self):
+        '''Names and modification times of metadata of packages on sys.path,
+        which change when packages are installed, upgraded, or removed. Standard
+        library directories, which do not hold metadata of packages, are skipped.'''
+        stamp = [__version__]
+        site_dirs = _site_dirs()
+        stdlib_prefixes = tuple(os.path.join(x, '') for x in {sys.prefix, sys.base_prefix})
+        for path in sys.path:
+            if path not in site_dirs and os.path.abspath(path or '.').startswith(stdlib_prefixes):
+                continue
+            try:
+                names = sorted(os.listdir(path or '.'))
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(('.egg-info', '.dist-info', '.egg-link', '.egg', '.pth')):
+                    continue
+                for filename in (os.path.join(path, name, 'entry_points.txt'),
+                    os.path.join(path, name, 'EGG-INFO', 'entry_points.txt'), os.path.join(path, name)):
+                    try:
+                        stamp.append(f'{path}/{name}:{os.stat(filename).st_mtime_ns}')
+                        break
+                    except OSError:
+                        continue
+        return hashlib.md5('\n'.join(stamp).encode()).hexdigest()
+
+    def _scan(self):
+        import pkg_resources
+        groups = {}
+        for group in _groups:
+            groups[group] = []
+            for ep in pkg_resources.iter_entry_points(group=group):
+                requirement = ''
+                try:
+                    for req in ep.dist.requires(ep.extras):
+                        if req.project_name == 'sos' and __version__ not in req:
+                            requirement = str(req)
+                except Exception:
+                    pass
+                groups[group].append([ep.name, ep.module_name, list(ep.attrs),
+                    str(ep.dist.project_name) if ep.dist else '', requirement])
+        return groups
+
+    def _load_index(self):
+        stamp = self._stamp()
+        try:
+            with open(self.index_file) as idx:
+                index = json.load(idx)
+            if index['stamp'] == stamp:
+                return index['groups']
+        except Exception:
+            pass
+        groups = self._scan()
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            tmp_file = f'{self.index_file}.{os.getpid()}'
+            with open(tmp_file, 'w') as idx:
+                json.dump({'stamp': stamp, 'prefix': sys.prefix, 'groups': groups}, idx)
+            os.replace(tmp_file, self.index_file)
+            self._remove_stale_indexes()
+        except Exception:
+            # a read-only home directory etc only make the lookups slower
+            pass
+        return groups
+
+    def _remove_stale_indexes(self):
+        '''Remove index files of python environments that no longer exist'''
+        index_dir = os.path.dirname(self.index_file)
+        for name in os.listdir(index_dir):
+            filename = os.path.join(index_dir, name)
+            if not name.startswith('plugins_') or not name.endswith('.json') or filename == self.index_file:
+                continue
+            try:
+                with open(filename) as idx:
+                    prefix = json.load(idx).get('prefix', None)
+                if prefix is None or not os.path.isdir(prefix):
+                    os.remove(filename)
+            except Exception:
+                continue
+
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = {group: [EntryPoint(*x) for x in eps]
+                    for group, eps in self._load_index().items()}
+            return self._index
+
+    def iter_entry_points(self, group, name=None):
+        index = self.index()
+        if group not in index:
+            # a group that is not indexed
+            import pkg_resources
+            yield from pkg_resources.iter_entry_points(group=group, name=name)
+            return
+        for ep in index[group]:
+            if name is None or ep.name.strip() == name:
+                yield ep
+
+    def load(self, group, name):
+        '''Load plugin of specified name, or return None if it does not exist'''
+        for ep in self.iter_entry_points(group, name):
+            return ep.load()
+        return None
+
+    def reset(self):
+        '''Rescan entry points if they are needed again'''
+        with self._lock:
+            self._index = None
+
+
+plugin_registry = PluginRegistry()
+
+
+def iter_entry_points(group, name=None):
+    return plugin_registry.iter_entry_points(group, name)
+
+
+def load_entry_point(group, name):
+    return plugin_registry.load(group, name)
@@ -22,15 +22,14 @@
 import base64
 import argparse
 from sos.utils import env, dehtml
-
-import pkg_resources
+from sos.plugins import iter_entry_points
 
 def get_previewers():
     # Note: data is zest.releaser specific: we want to pass
     # something to the plugin
     group = 'sos_previewers'
     result = []
-    for entrypoint in pkg_resources.iter_entry_points(group=group):
+    for entrypoint in iter_entry_points(group):
         # if ':' in entry point name, it should be a function
         try:
             name, priority = entrypoint.name.split(',', 1)
@@ -20,7 +20,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import pkg_resources
+from .plugins import iter_entry_points
 from .utils import logger, get_output, sos_handle_parameter_
 from .eval import interpolate, sos_namespace_
 from .pattern import expand_pattern
@@ -40,7 +40,7 @@ sos_symbols_ = {
 
 def _load_group(group):
     global sos_symbols_
-    for _entrypoint in pkg_resources.iter_entry_points(group=group):
+    for _entrypoint in iter_entry_points(group):
         # import all targets and actions from entry_points
         # Grab the function that is the actual plugin.
         _name = _entrypoint.name
@@ -49,18 +49,8 @@ def _load_group(group):
             _plugin = _entrypoint.load()
             globals()[_name] = _plugin
         except Exception as e:
-            # look for sos version requirement
-            if 'Requirement.parse' in str(e):
-                import re
-                from ._version import __version__
-                from pkg_resources import parse_version
-                m = re.search("Requirement.parse\('sos>=([^)]*)'\)", str(e))
-                if m:
-                    if parse_version(__version__) < parse_version(m.group(1)):
-                        logger.warning(
-                            f'Failed to load target {_entrypoint.name}: please upgrade your version of sos from {__version__} to at least version {m.group(1)}')
-                        continue
-            if _name == 'run':
+            # plugins requiring a newer version of sos
+            if _entrypoint.requirement or _name == 'run':
                 # this is critical so we print the warning
                 logger.warning(f'Failed to load target {_entrypoint.name}: {e}')
             else:
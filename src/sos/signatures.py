@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+#
+# This file is part of Script of Scripts (SoS), a workflow system
+# for the execution of commands and scripts in different languages.
+# Please visit https://github.com/vatlab/SOS for more information.
+#
+# Copyright (C) 2016 Bo Peng (bpeng@mdanderson.org)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import glob
+import sqlite3
+import threading
+
+from .utils import env, TimeoutInterProcessLock
+
+__all__ = ['SignatureStore', 'signature_store', 'HashCache', 'hash_cache', 'write_workflow_sig',
+    'read_workflow_sig', 'workflow_journals', 'merge_workflow_journals']
+
+# sqlite limits the number of host parameters of a statement
+_BATCH_SIZE = 500
+
+# expected durations of steps are averaged over this number of recent runs
+_DURATION_RUNS = 5
+
+
+class SQLiteDB:
+    '''A sqlite database that can be used from multiple processes. Derived classes
+    should define tables in _init_db.'''
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        # sqlite connections cannot be shared by threads
+        self._local = threading.local()
+
+    def _init_db(self, conn):
+        raise RuntimeError('Undefined base function')
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        # a generous timeout so that concurrent processes wait for each other
+        conn = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._init_db(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            conn.close()
+            raise
+        return conn
+
+    def _db_id(self):
+        try:
+            st = os.stat(self.db_file)
+            return (st.st_dev, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    @property
+    def conn(self):
+        # connections cannot be shared across processes (e.g. after fork). The
+        # database file is not stat-ed here because conn is accessed by every
+        # query, but by validate() and after failed writes.
+        local = self._local
+        if getattr(local, 'conn', None) is None or local.pid != os.getpid():
+            self.close()
+            local.conn = self._connect()
+            local.pid = os.getpid()
+            local.db_id = self._db_id()
+        return local.conn
+
+    def validate(self):
+        '''Reconnect if the database has been removed or replaced (e.g. rm -rf .sos)
+        since it was connected. Return True if the database was reconnected.'''
+        local = self._local
+        if getattr(local, 'conn', None) is None or local.pid != os.getpid():
+            return False
+        if self._db_id() == local.db_id:
+            return False
+        self.close()
+        return True
+
+    def _write(self, statements):
+        '''Execute statements in a transaction and return the numbers of
+        rows modified by each statement'''
+        try:
+            return self._execute_write(statements)
+        except sqlite3.OperationalError:
+            # writing to a database that has been removed or replaced fails
+            # (e.g. with SQLITE_READONLY_DBMOVED), in which case we reconnect
+            if not self.validate():
+                raise
+            return self._execute_write(statements)
+
+    def _select_in(self, query, keys):
+        '''Yield rows of query, in which {} is replaced by placeholders of keys,
+        for batches of keys because sqlite limits the number of parameters.'''
+        keys = list(keys)
+        for i in range(0, len(keys), _BATCH_SIZE):
+            batch = keys[i:i + _BATCH_SIZE]
+            yield from self.conn.execute(query.format(','.join('?' * len(batch))), batch)
+
+    def _execute_write(self, statements):
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            counts = [conn.executemany(stmt, params).rowcount for stmt, params in statements]
+            conn.execute('COMMIT')
+            return counts
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        local = self._local
+        if getattr(local, 'conn', None) is not None and local.pid == os.getpid():
+            local.conn.close()
+        local.conn = None
+
+
+class SignatureStore(SQLiteDB):
+    '''A sqlite database that keeps signatures of targets and steps. It replaces
+    the .file_info and .exe_info files that used to be written, one per target
+    or step, to .sos/.runtime (or ~/.sos/.runtime for external targets). Legacy
+    files found in the runtime directory are imported when the database is
+    first opened.
+    '''
+
+    def __init__(self, db_file):
+        super(SignatureStore, self).__init__(db_file)
+        self.legacy_dir = os.path.join(os.path.dirname(db_file), '.runtime')
+
+    def _init_db(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS targets (
+            name TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER,
+            md5 TEXT,
+            attachments TEXT
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS steps (
+            sig_id TEXT PRIMARY KEY,
+            content TEXT
+        )''')
+        # files under directory targets, which form Merkle trees of the directories
+        conn.execute('''CREATE TABLE IF NOT EXISTS dir_entries (
+            dir TEXT,
+            name TEXT,
+            mtime_ns INTEGER,
+            size INTEGER,
+            md5 TEXT,
+            PRIMARY KEY (dir, name)
+        )''')
+        # average durations of recent runs of steps, used to prioritize steps
+        conn.execute('''CREATE TABLE IF NOT EXISTS durations (
+            step TEXT PRIMARY KEY,
+            duration REAL,
+            runs INTEGER
+        )''')
+        # average durations of tasks of steps, used to size trunks of tasks
+        conn.execute('''CREATE TABLE IF NOT EXISTS task_durations (
+            step TEXT PRIMARY KEY,
+            duration REAL,
+            runs INTEGER
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )''')
+        if not conn.execute('SELECT value FROM meta WHERE key=?', ('legacy_imported',)).fetchone():
+            self._import_legacy(conn)
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('legacy_imported', '1'))
+
+    def _import_legacy(self, conn):
+        '''Import .file_info and .exe_info files written by previous versions of SoS'''
+        legacy_files = []
+        for info_file in glob.glob(os.path.join(self.legacy_dir, '*.file_info')):
+            try:
+                with open(info_file) as info:
+                    lines = info.readlines()
+                fields = lines[0].rstrip('\n').split('\t')
+                if len(fields) == 4:
+                    # file_target: fullname, mtime, size, md5 and then attachments
+                    conn.execute('INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?)',
+                                 (os.path.realpath(fields[0]), float(fields[1]), int(fields[2]),
+                                  fields[3], ''.join(lines[1:])))
+                else:
+                    # other targets saved as {class}_{md5}.file_info with name and signature
+                    name, sig = lines[0].rstrip('\n').rsplit('\t', 1)
+                    cls = os.path.basename(info_file)[:-10].rsplit('_', 1)[0]
+                    conn.execute('INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?)',
+                                 (f'{cls}("{name}")', None, None, sig, ''))
+                legacy_files.append(info_file)
+            except Exception as e:
+                env.logger.debug(f'Failed to import legacy signature {info_file}: {e}')
+        for info_file in glob.glob(os.path.join(self.legacy_dir, '*.exe_info')):
+            try:
+                with open(info_file) as info:
+                    conn.execute('INSERT OR REPLACE INTO steps VALUES (?, ?)',
+                                 (os.path.basename(info_file)[:-9], info.read()))
+                legacy_files.append(info_file)
+            except Exception as e:
+                env.logger.debug(f'Failed to import legacy signature {info_file}: {e}')
+        if legacy_files:
+            env.logger.debug(f'{len(legacy_files)} legacy signature files imported to {self.db_file}')
+        for info_file in legacy_files:
+            try:
+                os.remove(info_file)
+            except Exception:
+                pass
+
+    def import_legacy(self):
+        '''Import legacy signature files that appear after the creation of the database,
+        e.g. those extracted from archives created by previous versions of SoS'''
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._import_legacy(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    #
+    # target signatures
+    #
+    def get_target(self, name):
+        '''Return (mtime, size, md5, attachments) of target, or None'''
+        return self.conn.execute(
+            'SELECT mtime, size, md5, attachments FROM targets WHERE name=?', (name,)).fetchone()
+
+    def get_targets(self, names):
+        '''Return a dictionary of name: (mtime, size, md5, attachments) for names with signatures'''
+        return {rec[0]: rec[1:] for rec in self._select_in(
+            'SELECT name, mtime, size, md5, attachments FROM targets WHERE name IN ({})', names)}
+
+    def list_targets(self):
+        return [x[0] for x in self.conn.execute('SELECT name FROM targets')]
+
+    def set_targets(self, records):
+        '''Save a list of (name, mtime, size, md5, attachments) in one transaction'''
+        self.write(targets=records)
+
+    def remove_targets(self, names):
+        self._write([('DELETE FROM targets WHERE name=?', [(x,) for x in names]),
+            ('DELETE FROM dir_entries WHERE dir=?', [(x,) for x in names])])
+
+    def clear_targets(self):
+        '''Remove all target signatures and return the number of removed records'''
+        return self._write([('DELETE FROM targets', [()]), ('DELETE FROM dir_entries', [()])])[0]
+
+    def get_dir_entries(self, dirname):
+        '''Return a dictionary of name: (mtime_ns, size, md5) of files under a directory target'''
+        return {x[0]: x[1:] for x in self.conn.execute(
+            'SELECT name, mtime_ns, size, md5 FROM dir_entries WHERE dir=?', (dirname,))}
+
+    #
+    # step signatures
+    #
+    def get_step(self, sig_id):
+        rec = self.conn.execute('SELECT content FROM steps WHERE sig_id=?', (sig_id,)).fetchone()
+        return None if rec is None else rec[0]
+
+    def get_steps(self, sig_ids):
+        return {rec[0]: rec[1] for rec in self._select_in(
+            'SELECT sig_id, content FROM steps WHERE sig_id IN ({})', sig_ids)}
+
+    def remove_steps(self, sig_ids):
+        self._write([('DELETE FROM steps WHERE sig_id=?', [(x,) for x in sig_ids])])
+
+    def write(self, targets=[], steps=[], dir_entries=[], dirs={}):
+        '''Save target records (name, mtime, size, md5, attachments), step records
+        (sig_id, content), and entries of directories (dir, name, mtime_ns, size, md5)
+        in a single transaction. Saved entries of directories in dirs, a dictionary
+        of dir: [(name, mtime_ns, size, md5)], are replaced.'''
+        self._write([
+            ('DELETE FROM dir_entries WHERE dir=?', [(x,) for x in dirs]),
+            ('INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?)', targets),
+            ('INSERT OR REPLACE INTO steps VALUES (?, ?)', steps),
+            ('INSERT OR REPLACE INTO dir_entries VALUES (?, ?, ?, ?, ?)',
+                dir_entries + [(x, *y) for x, entries in dirs.items() for y in entries])])
+
+    #
+    # durations of steps and tasks
+    #
+    def get_durations(self, tasks=False):
+        '''Return a dictionary of step names and average durations of their recent
+        runs, or of their tasks if tasks is True'''
+        table = 'task_durations' if tasks else 'durations'
+        return {x[0]: x[1] for x in self.conn.execute(f'SELECT step, duration FROM {table}')}
+
+    def add_duration(self, step, duration, tasks=False):
+        '''Update average duration of a step, or of its tasks if tasks is True,
+        with the duration of a new run'''
+        table = 'task_durations' if tasks else 'durations'
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rec = conn.execute(f'SELECT duration, runs FROM {table} WHERE step=?', (step,)).fetchone()
+            if rec is None:
+                rec = (duration, 1)
+            else:
+                runs = min(rec[1] + 1, _DURATION_RUNS)
+                rec = (rec[0] + (duration - rec[0]) / runs, runs)
+            conn.execute(f'INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)', (step, *rec))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    #
+    # exchange of signatures (sos pack and unpack)
+    #
+    def export_to(self, filename, targets=[], steps=[]):
+        '''Copy signatures of specified targets and steps to another database'''
+        dest = SignatureStore(filename)
+        targets = self.get_targets(targets)
+        dest.write(targets=[(x, *y) for x, y in targets.items()],
+                   steps=list(self.get_steps(steps).items()),
+                   dir_entries=[(x, name, *rec) for x in targets for name, rec in self.get_dir_entries(x).items()])
+        dest.close()
+
+    def import_from(self, filename):
+        '''Import all signatures from another database'''
+        src = SignatureStore(filename)
+        self.write(targets=list(src.conn.execute('SELECT * FROM targets')),
+                   steps=list(src.conn.execute('SELECT * FROM steps')),
+                   dir_entries=list(src.conn.execute('SELECT * FROM dir_entries')))
+        src.close()
+
+
+class HashCache(SQLiteDB):
+    '''A cache of file hashes keyed by (device, inode, size, mtime_ns) of files
+    so that unchanged files do not have to be read again.'''
+
+    def _init_db(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS hashes (
+            dev INTEGER,
+            ino INTEGER,
+            strategy TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            md5 TEXT,
+            PRIMARY KEY (dev, ino, strategy)
+        )''')
+
+    def _connect(self):
+        conn = super(HashCache, self)._connect()
+        # losing a few records of a cache after a system crash is harmless
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+    def get(self, st, strategy):
+        '''Return cached hash of a file with stat result st, or None'''
+        rec = self.conn.execute('SELECT md5 FROM hashes WHERE dev=? AND ino=? AND strategy=? AND size=? AND mtime_ns=?',
+            (st.st_dev, st.st_ino, strategy, st.st_size, st.st_mtime_ns)).fetchone()
+        return None if rec is None else rec[0]
+
+    def set(self, st, strategy, md5):
+        self._write([('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+            [(st.st_dev, st.st_ino, strategy, st.st_size, st.st_mtime_ns, md5)])])
+
+
+_stores = {}
+
+
+def signature_store(external=False):
+    '''Return signature database of the current project (.sos/signatures.db under
+    env.exec_dir), or the global one (~/.sos/signatures.db) for external targets.'''
+    if external:
+        db_file = os.path.join(os.path.expanduser('~'), '.sos', 'signatures.db')
+    else:
+        db_file = os.path.abspath(os.path.join(env.exec_dir, '.sos', 'signatures.db'))
+    if db_file not in _stores:
+        _stores[db_file] = SignatureStore(db_file)
+    return _stores[db_file]
+
+
+def hash_cache():
+    '''Return the global cache of file hashes (~/.sos/hashes.db)'''
+    db_file = os.path.join(os.path.expanduser('~'), '.sos', 'hashes.db')
+    if db_file not in _stores:
+        _stores[db_file] = HashCache(db_file)
+    return _stores[db_file]
+
+
+#
+# runtime signatures of workflows
+#
+# Runtime signatures of steps are appended to a journal of the process
+# ({workflow_sig}.{pid}.journal) without locking the workflow signature, and
+# are merged to the workflow signature file when steps or the workflow are
+# completed. A process holds an exclusive flock on its journal as long as it
+# is alive, so journals that are not locked are left by processes that no
+# longer exist (e.g. crashed or terminated workers), even if their pids have
+# been reused.
+#
+try:
+    import fcntl
+except ImportError:
+    # journals of processes that no longer exist are told by pids on Windows
+    fcntl = None
+
+# open and locked journals of the current process
+_journals = {}
+
+
+def _close_journals():
+    # journals of the parent process are closed in forked child processes,
+    # which keeps them locked by the parent process
+    for fd in _journals.values():
+        os.close(fd)
+    _journals.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_close_journals)
+
+
+def workflow_journal(workflow_sig, pid=None):
+    return f'{workflow_sig}.{os.getpid() if pid is None else pid}.journal'
+
+
+def _open_journal(journal):
+    '''Open and lock the journal of the current process'''
+    while True:
+        fd = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return fd
+        # wait for another process that is merging a journal left by a process
+        # with the same pid, and try again if the journal has been removed
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.stat(journal).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def write_workflow_sig(workflow_sig, lines):
+    '''Append lines to the journal of workflow_sig of the current process'''
+    journal = workflow_journal(workflow_sig)
+    if journal not in _journals:
+        _journals[journal] = _open_journal(journal)
+    os.write(_journals[journal], ''.join(lines).encode())
+
+
+def _read_journal(journal):
+    with open(journal) as jnl:
+        content = jnl.read()
+    # the last line can be incomplete if the process was killed while writing it
+    return content[:content.rfind('\n') + 1]
+
+
+def workflow_journals(workflow_sig):
+    '''Return journals of workflow_sig that have not been merged'''
+    return sorted(glob.glob(glob.escape(workflow_sig) + '.*.journal'))
+
+
+def read_workflow_sig(workflow_sig):
+    '''Return lines of workflow_sig, including those in journals that have not
+    been merged. A workflow_sig that does not exist is treated as empty.'''
+    try:
+        with open(workflow_sig) as sig:
+            lines = sig.readlines()
+    except FileNotFoundError:
+        lines = []
+    for journal in workflow_journals(workflow_sig):
+        try:
+            lines.extend(_read_journal(journal).splitlines(True))
+        except FileNotFoundError:
+            # merged by another process
+            pass
+    return lines
+
+
+def _lock_orphan_journal(journal):
+    '''Return an open file descriptor of a journal if it is not locked by its
+    process, which no longer exists, or None otherwise'''
+    if fcntl is None:
+        import psutil
+        try:
+            if psutil.pid_exists(int(journal.rsplit('.', 2)[1])):
+                return None
+        except ValueError:
+            return None
+    try:
+        fd = os.open(journal, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+def merge_workflow_journals(workflow_sig):
+    '''Merge journals written by the current process, and by processes that no
+    longer exist (e.g. crashed or terminated workers), to workflow_sig'''
+    own_journal = workflow_journal(workflow_sig)
+    if own_journal not in _journals and not workflow_journals(workflow_sig):
+        return
+    with TimeoutInterProcessLock(workflow_sig + '_'):
+        for journal in workflow_journals(workflow_sig):
+            if journal == own_journal:
+                fd = _journals.pop(journal, None)
+                if fd is None:
+                    # left by a process with the same pid
+                    fd = _lock_orphan_journal(journal)
+            else:
+                fd = _lock_orphan_journal(journal)
+            if fd is None:
+                continue
+            try:
+                content = _read_journal(journal)
+                # a journal is removed only after its content is safely written so
+                # that a crash can at worst duplicate some lines
+                with open(workflow_sig, 'a') as sig:
+                    sig.write(content)
+                    sig.flush()
+                    os.fsync(sig.fileno())
+                os.remove(journal)
+            except FileNotFoundError:
+                pass
+            finally:
+                os.close(fd)
@@ -35,12 +35,15 @@ from collections.abc import Sequence, Iterable, Mapping
 from itertools import tee, combinations
 
 from .utils import env, StopInputGroup, TerminateExecution, short_repr, stable_repr,\
-    get_traceback, expand_size, format_HHMMSS, SlotManager
+    get_traceback, expand_size, expand_time, format_HHMMSS, SlotManager
 from .pattern import extract_pattern
 from .eval import SoS_eval, SoS_exec, Undetermined, stmtHash
-from .targets import BaseTarget, file_target, dynamic, remote, RuntimeInfo, UnknownTarget, RemovedTarget, UnavailableLock, sos_targets, path, paths
+from .targets import BaseTarget, file_target, dynamic, remote, RuntimeInfo, UnknownTarget, RemovedTarget, UnavailableLock, sos_targets, path, paths, \
+    validate_signatures
 from .syntax import SOS_INPUT_OPTIONS, SOS_DEPENDS_OPTIONS, SOS_OUTPUT_OPTIONS, \
     SOS_RUNTIME_OPTIONS, SOS_TAG
+from .signatures import merge_workflow_journals, signature_store
+from .cache import output_cache, cache_output
 from .tasks import TaskParams, MasterTaskParams
 
 __all__ = []
@@ -256,6 +259,41 @@ def analyze_section(section, default_input=None):
         }
 
 
+# with trunk_size='auto', master tasks are sized to be executed in about
+# _TRUNK_DURATION seconds, or to have _AUTO_TRUNK_SIZE tasks if tasks of the
+# step have not been executed before
+_TRUNK_DURATION = 600
+_AUTO_TRUNK_SIZE = 4
+_MAX_TRUNK_SIZE = 100
+
+
+def auto_trunk_size(step_name, num_tasks, trunk_workers, runtime):
+    '''Number of tasks in a master task, determined from the average duration of
+    tasks of previous runs of the step, the number of tasks, and max_walltime and
+    max_running_jobs of the host that executes the tasks.'''
+    try:
+        duration = signature_store().get_durations(tasks=True).get(step_name, None)
+    except Exception as e:
+        env.logger.debug(f'Failed to read durations of tasks: {e}')
+        duration = None
+    if duration is None:
+        rows = _AUTO_TRUNK_SIZE
+    else:
+        rows = max(int(_TRUNK_DURATION / max(duration, 0.001)), 1)
+    queue = runtime.get('queue', None) or env.config.get('default_queue', None)
+    cfg = env.sos_dict.get('CONFIG', {}).get('hosts', {}).get(queue, {}) if queue else {}
+    # walltime of master tasks, which is walltime of tasks times the number
+    # of rows, should not exceed max_walltime of the host
+    if cfg.get('max_walltime', None) and runtime.get('walltime', None):
+        rows = min(rows, max(expand_time(cfg['max_walltime']) // expand_time(runtime['walltime']), 1))
+    size = min(rows * max(trunk_workers, 1), num_tasks, _MAX_TRUNK_SIZE)
+    # and tasks should still be spread to all running jobs
+    max_running_jobs = env.config.get('max_running_jobs', None) or cfg.get('max_running_jobs', None)
+    if max_running_jobs:
+        size = min(size, (num_tasks + max_running_jobs - 1) // max_running_jobs)
+    return max(size, 1)
+
+
 class TaskManager:
     # manage tasks created by the step
     def __init__(self, trunk_size, trunk_workers):
@@ -264,6 +302,8 @@ class TaskManager:
         self.trunk_workers = trunk_workers
         self._submitted_tasks = []
         self._unsubmitted_tasks = []
+        # blobs of large objects shared by tasks of the step
+        self._blob_cache = {}
         # derived from _unsubmitted_tasks
         self._all_ids = []
         self._all_output = []
@@ -303,7 +343,7 @@ class TaskManager:
         if self.trunk_size == 1 or (all_tasks and len(self._unsubmitted_tasks) == 1):
             for task_id, taskdef, _ in to_be_submitted:
                 job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.def')
-                taskdef.save(job_file)
+                taskdef.save(job_file, blob_cache=self._blob_cache)
                 ids.append(task_id)
         else:
             master = None
@@ -311,7 +351,7 @@ class TaskManager:
                 if master is not None and master.num_tasks() == self.trunk_size:
                     job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', master.ID + '.def')
                     ids.append(master.ID)
-                    master.save(job_file)
+                    master.save(job_file, blob_cache=self._blob_cache)
                     master = None
                 if master is None:
                     master = MasterTaskParams(self.trunk_workers)
@@ -319,7 +359,7 @@ class TaskManager:
             # the last piece
             if master is not None:
                 job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', master.ID + '.def')
-                master.save(job_file)
+                master.save(job_file, blob_cache=self._blob_cache)
                 ids.append(master.ID)
 
         if not ids:
@@ -362,8 +402,8 @@ def concurrent_execute(stmt, proc_vars={}, sig=None, capture_output=False):
                 errmsg = err.getvalue()
         else:
             SoS_exec(stmt, return_result=False)
-        if sig:
-            sig.write()
+        if sig and sig.write():
+            cache_output(sig)
         res = {'ret_code': 0}
         if capture_output:
             res.update({'stdout': outmsg, 'stderr': errmsg})
@@ -429,6 +469,8 @@ class Base_Step_Executor:
     def __init__(self, step):
         self.step = step
         self.task_manager = None
+        # copies of variables shared by tasks of the step
+        self._task_var_copies = {}
 
     def expand_input_files(self, value, *args):
         if self.run_mode == 'dryrun' and any(isinstance(x, dynamic) for x in args):
@@ -510,6 +552,94 @@ class Base_Step_Executor:
         # env.logger.warning(''.join(env_vars) + '\n' + self.step.tokens)
         return ''.join(env_vars) + '\n' + self.step.tokens
 
+    def prevalidate_signatures(self, statements):
+        '''Evaluate depends and output directives of all input groups and validate
+        their signatures in one pass so that saved signatures are read in batch
+        and files shared by input groups are hashed only once. Signatures are not
+        locked because a step can have too many input groups to hold a lock (and
+        an open file) for each of them, so matching signatures have to be validated
+        again under lock before an input group is skipped. Returns a list with, for each input group,
+        the step signature, evaluated directives, signature (RuntimeInfo),
+        validation result, and the saved signature it was validated against, or
+        None if the group is not validated.'''
+        if env.config['sig_mode'] not in ('default', 'assert') or len(self._groups) <= 1 or \
+            'sos_run' in env.sos_dict['__signature_vars__']:
+            return None
+        # only depends and output directives can be evaluated ahead of time
+        directives = []
+        for statement in statements:
+            if statement[0] != ':' or statement[1] not in ('depends', 'output'):
+                return None
+            directives.append(statement[1:])
+            if statement[1] == 'output':
+                break
+        else:
+            return None
+        saved = {x: env.sos_dict[x] for x in ('_input', '_index', '_output', '_depends', 'step_output', 'step_depends')
+            if x in env.sos_dict}
+        saved = copy.deepcopy(saved)
+        results = [None for x in self._groups]
+        signatures = [None for x in self._groups]
+        contexts = [None for x in self._groups]
+        try:
+            for idx, (g, v) in enumerate(zip(self._groups, self._vars)):
+                if isinstance(g, Undetermined):
+                    raise ValueError('undetermined input')
+                env.sos_dict.update(v)
+                env.sos_dict.set('_input', sos_targets(g))
+                env.sos_dict.set('_index', idx)
+                evaluated = []
+                for key, value in directives:
+                    args, kwargs = SoS_eval(f'__null_func__({value})')
+                    if key == 'depends':
+                        files = self.expand_depends_files(*args)
+                        self.process_depends_args(files, **kwargs)
+                    else:
+                        files = self.expand_output_files(value, *args)
+                        self.process_output_args(files, **kwargs)
+                    evaluated.append((key, files, kwargs))
+                sg = self.step_signature(idx)
+                if sg is not None:
+                    signatures[idx] = RuntimeInfo(self.step.md5, sg, env.sos_dict['_input'].targets(),
+                        env.sos_dict['_output'].targets(), env.sos_dict['_depends'].targets(),
+                        env.sos_dict['__signature_vars__'])
+                    results[idx] = [sg, evaluated, signatures[idx], None, None]
+                    contexts[idx] = env.sos_dict.clone_selected_vars(env.sos_dict['__signature_vars__'])
+        except Exception as e:
+            env.logger.debug(f'Failed to validate signatures of input groups in batch: {e}')
+            return None
+        finally:
+            for k, v in saved.items():
+                env.sos_dict.set(k, v)
+        indexes = [idx for idx, x in enumerate(results) if x is not None]
+        saved_sigs = {}
+        for external in (False, True):
+            saved_sigs.update(signature_store(external).get_steps(
+                signatures[x].sig_id for x in indexes if bool(signatures[x].external_output) == external))
+        # matching signatures are recorded when they are validated again under lock
+        for idx, res in zip(indexes, validate_signatures([signatures[x] for x in indexes],
+            [contexts[x] for x in indexes], record=False)):
+            results[idx][3] = res
+            results[idx][4] = saved_sigs.get(signatures[idx].sig_id)
+        skipped = [idx for idx, x in enumerate(results) if x is not None and isinstance(x[3], dict)]
+        if skipped:
+            env.logger.debug(f'Input groups {", ".join(str(x) for x in skipped)} of step ``{self.step.step_name(True)}`` have matching signatures')
+        return results
+
+    def restore_output(self, sig):
+        '''Restore output of an input group from the output cache and return
+        validated signature, or None if the output is not restored.'''
+        cache = output_cache()
+        if cache is None or not cache.restore(sig):
+            return None
+        matched = sig.validate()
+        if isinstance(matched, str):
+            env.logger.debug(f'Output restored from cache does not match signature: {matched}')
+            cache.remove([cache.cache_key(sig)])
+            return None
+        env.logger.info(f'Output of ``{self.step.step_name(True)}`` (index={env.sos_dict["_index"]}) is restored from cache')
+        return matched
+
     # Nested functions to handle different parameters of input directive
     @staticmethod
     def handle_group_by(ifiles, group_by):
@@ -845,6 +975,8 @@ class Base_Step_Executor:
                 v = format_HHMMSS(v)
             elif k == 'mem':
                 v = expand_size(v)
+            elif k == 'priority' and (isinstance(v, bool) or not isinstance(v, (int, float))):
+                raise ValueError(f'A number is expected for runtime option priority, {v} provided')
             env.sos_dict['_runtime'][k] = v
 
     def reevaluate_output(self):
@@ -884,10 +1016,12 @@ class Base_Step_Executor:
         # 'step_depends' and 'CONFIG'
         # because they will be included by env.sos_dict['__signature_vars__'] if they are actually
         # used in the task. (issue #752)
+        # copies of unchanged variables are shared by tasks of the step so that they
+        # are saved as blobs only once
         task_vars = env.sos_dict.clone_selected_vars(env.sos_dict['__signature_vars__'] \
                     | {'_input', '_output', '_depends', '_index', '__args__', 'step_name', '_runtime',
                     '__signature_vars__', '__step_context__'
-                    })
+                    }, copies=self._task_var_copies)
 
         task_tags = [env.sos_dict.get('step_name', ''), os.path.basename(env.sos_dict.get('__workflow_sig__', '')).rsplit('.', 1)[0]]
         if 'tags' in env.sos_dict['_runtime']:
@@ -929,16 +1063,13 @@ class Base_Step_Executor:
         # after task_id is created.
         if '__workflow_sig__' in env.sos_dict and env.sos_dict['__workflow_sig__']:
             task_vars['__workflow_sig__'] = env.sos_dict['__workflow_sig__']
+        # so is the length of the critical path of the step, which is used to
+        # prioritize tasks
+        if env.sos_dict.get('__critical_path__', None):
+            task_vars['__critical_path__'] = env.sos_dict['__critical_path__']
 
 
         if self.task_manager is None:
-            if 'trunk_size' in env.sos_dict['_runtime']:
-                if not isinstance(env.sos_dict['_runtime']['trunk_size'], int):
-                    raise ValueError(
-                        f'An integer value is expected for runtime option trunk, {env.sos_dict["_runtime"]["trunk_size"]} provided')
-                trunk_size = env.sos_dict['_runtime']['trunk_size']
-            else:
-                trunk_size = 1
             if 'trunk_workers' in env.sos_dict['_runtime']:
                 if not isinstance(env.sos_dict['_runtime']['trunk_workers'], int):
                     raise ValueError(
@@ -946,6 +1077,18 @@ class Base_Step_Executor:
                 trunk_workers = env.sos_dict['_runtime']['trunk_workers']
             else:
                 trunk_workers = 0
+            if 'trunk_size' in env.sos_dict['_runtime']:
+                if env.sos_dict['_runtime']['trunk_size'] == 'auto':
+                    trunk_size = auto_trunk_size(self.step.step_name(), env.sos_dict['__num_groups__'],
+                        trunk_workers, env.sos_dict['_runtime'])
+                    env.logger.debug(f'Tasks of step {self.step.step_name()} are executed in trunks of size {trunk_size}')
+                elif not isinstance(env.sos_dict['_runtime']['trunk_size'], int):
+                    raise ValueError(
+                        f'An integer value or "auto" is expected for runtime option trunk, {env.sos_dict["_runtime"]["trunk_size"]} provided')
+                else:
+                    trunk_size = env.sos_dict['_runtime']['trunk_size']
+            else:
+                trunk_size = 1
 
             #if 'queue' in env.sos_dict['_runtime'] and env.sos_dict['_runtime']['queue']:
             #    host = env.sos_dict['_runtime']['queue']
@@ -1008,6 +1151,14 @@ class Base_Step_Executor:
             raise RuntimeError(
                 f'Failed to get results for tasks {", ".join(x for x in self.proc_results if isinstance(x, str))}')
         #
+        # durations of tasks are used to size trunks of tasks of later runs
+        durations = [x['duration'] for x in self.proc_results if 'duration' in x]
+        if durations and self.run_mode == 'run':
+            try:
+                signature_store().add_duration(self.step.step_name(), sum(durations) / len(durations), tasks=True)
+            except Exception as e:
+                env.logger.debug(f'Failed to save durations of tasks of step {self.step.step_name()}: {e}')
+        #
         # now, if the task has shared variable, merge to sos_dict
         shared = {}
         for res in self.proc_results:
@@ -1048,7 +1199,7 @@ class Base_Step_Executor:
             if sig is None:
                 env.sos_dict.set('__step_sig__', None)
             else:
-                env.sos_dict.set('__step_sig__', os.path.basename(sig.proc_info).split('.')[0])
+                env.sos_dict.set('__step_sig__', sig.sig_id)
             self.last_res = SoS_exec(stmt, return_result=self.run_mode == 'interactive')
         except (StopInputGroup, TerminateExecution, UnknownTarget, RemovedTarget, UnavailableLock, PendingTasks):
             raise
@@ -1280,6 +1431,13 @@ class Base_Step_Executor:
                         self.worker_pool = Pool(gotten + 1)
 
         try:
+            pre_statement = []
+            if not any(st[0] == ':' and st[1] == 'output' for st in self.step.statements[input_statement_idx:]) and \
+                '__default_output__' in env.sos_dict:
+                pre_statement = [[':', 'output', '_output']]
+            # validate signatures of all input groups before any of them is executed
+            prevalidated = self.prevalidate_signatures(pre_statement + self.step.statements[input_statement_idx:])
+
             for idx, (g, v) in enumerate(zip(self._groups, self._vars)):
                 # other variables
                 #
@@ -1287,11 +1445,13 @@ class Base_Step_Executor:
                 env.sos_dict.set('_input', sos_targets(g))
                 self.log('_input')
                 env.sos_dict.set('_index', idx)
-                #
-                pre_statement = []
-                if not any(st[0] == ':' and st[1] == 'output' for st in self.step.statements[input_statement_idx:]) and \
-                    '__default_output__' in env.sos_dict:
-                    pre_statement = [[':', 'output', '_output']]
+
+                # reuse directives evaluated by batch validation unless variables of the step
+                # have been changed by previous input groups
+                cached = None
+                if prevalidated and prevalidated[idx] and prevalidated[idx][0] == self.step_signature(idx):
+                    cached = prevalidated[idx]
+                cached_directives = list(cached[1]) if cached else []
 
                 for statement in pre_statement + self.step.statements[input_statement_idx:]:
                     # if input is undertermined, we can only process output:
@@ -1301,13 +1461,17 @@ class Base_Step_Executor:
                         key, value = statement[1:]
                         # output, depends, and process can be processed multiple times
                         try:
-                            args, kwargs = SoS_eval(f'__null_func__({value})')
+                            if cached_directives and key in ('depends', 'output'):
+                                _, files, kwargs = cached_directives.pop(0)
+                            else:
+                                args, kwargs = SoS_eval(f'__null_func__({value})')
+                                files = None
                             # dynamic output or dependent files
                             if key == 'output':
                                 # if output is defined, its default value needs to be cleared
                                 if idx == 0:
                                     env.sos_dict.set('step_output', sos_targets())
-                                ofiles = self.expand_output_files(value, *args)
+                                ofiles = self.expand_output_files(value, *args) if files is None else files
                                 if not isinstance(g, (type(None), Undetermined)) and not isinstance(ofiles, (type(None), Undetermined)):
                                     if any(x in g for x in ofiles):
                                         raise RuntimeError(
@@ -1319,17 +1483,32 @@ class Base_Step_Executor:
                                 # ofiles can be Undetermined
                                 sg = self.step_signature(idx)
                                 if sg is not None and not isinstance(g, Undetermined):
-                                    signatures[idx] = RuntimeInfo(self.step.md5, sg, env.sos_dict['_input'].targets(),
-                                        env.sos_dict['_output'].targets(), env.sos_dict['_depends'].targets(),
-                                        env.sos_dict['__signature_vars__'])
+                                    if cached:
+                                        signatures[idx] = cached[2]
+                                    else:
+                                        signatures[idx] = RuntimeInfo(self.step.md5, sg, env.sos_dict['_input'].targets(),
+                                            env.sos_dict['_output'].targets(), env.sos_dict['_depends'].targets(),
+                                            env.sos_dict['__signature_vars__'])
                                     signatures[idx].lock()
+                                    # A mismatch found by batch validation is reused unless the saved signature
+                                    # has been changed (e.g. by another process) before the lock is acquired.
+                                    # A match is validated again under lock because previous input groups can
+                                    # have changed its targets; unchanged files are not hashed again.
+                                    if cached and isinstance(cached[3], str) and signature_store(
+                                        signatures[idx].external_output).get_step(signatures[idx].sig_id) == cached[4]:
+                                        validate = lambda: cached[3]
+                                    else:
+                                        validate = signatures[idx].validate
                                     if env.config['sig_mode'] == 'default':
                                         # if users use sos_run, the "scope" of the step goes beyong names in this step
                                         # so we cannot save signatures for it.
                                         if 'sos_run' in env.sos_dict['__signature_vars__']:
                                             skip_index = False
                                         else:
-                                            matched = signatures[idx].validate()
+                                            matched = validate()
+                                            if isinstance(matched, str):
+                                                env.logger.debug(f'Signature mismatch: {matched}')
+                                                matched = self.restore_output(signatures[idx])
                                             if isinstance(matched, dict):
                                                 # in this case, an Undetermined output can get real output files
                                                 # from a signature
@@ -1340,10 +1519,8 @@ class Base_Step_Executor:
                                                 env.logger.info(
                                                     f'``{self.step.step_name(True)}`` (index={idx}) is ``ignored`` due to saved signature')
                                                 skip_index = True
-                                            else:
-                                                env.logger.debug(f'Signature mismatch: {matched}')
                                     elif env.config['sig_mode'] == 'assert':
-                                        matched = signatures[idx].validate()
+                                        matched = validate()
                                         if isinstance(matched, str):
                                             raise RuntimeError(f'Signature mismatch: {matched}')
                                         else:
@@ -1370,7 +1547,7 @@ class Base_Step_Executor:
                                     break
                             elif key == 'depends':
                                 try:
-                                    dfiles = self.expand_depends_files(*args)
+                                    dfiles = self.expand_depends_files(*args) if files is None else files
                                     # dfiles can be Undetermined
                                     self.process_depends_args(dfiles, **kwargs)
                                     self.log('_depends')
@@ -1401,7 +1578,7 @@ class Base_Step_Executor:
                                 if signatures[idx] is None:
                                     proc_vars['__step_sig__'] = None
                                 else:
-                                    proc_vars['__step_sig__'] = os.path.basename(signatures[idx].proc_info).split('.')[0]
+                                    proc_vars['__step_sig__'] = signatures[idx].sig_id
                                     # we need to release the signature otherwise there can be too many opened
                                     # signatures for concurrent jobs
                                     signatures[idx].release()
@@ -1441,8 +1618,8 @@ class Base_Step_Executor:
 
                 if not self.step.task:
                     if signatures[idx] is not None:
-                        if 'sos_run' not in env.sos_dict['__signature_vars__']:
-                            signatures[idx].write()
+                        if 'sos_run' not in env.sos_dict['__signature_vars__'] and signatures[idx].write():
+                            cache_output(signatures[idx])
                         signatures[idx] = None
                     continue
 
@@ -1486,8 +1663,8 @@ class Base_Step_Executor:
             self.wait_for_results()
             for idx,res in enumerate(self.proc_results):
                 if signatures[idx] is not None:
-                    if res['ret_code'] == 0:
-                        signatures[idx].write()
+                    if res['ret_code'] == 0 and signatures[idx].write():
+                        cache_output(signatures[idx])
                     signatures[idx] = None
             # check results
             for proc_result in [x for x in self.proc_results if x['ret_code'] == 0]:
@@ -1675,7 +1852,12 @@ class Step_Executor(Base_Step_Executor):
 
     def run(self):
         try:
-            res = Base_Step_Executor.run(self)
+            try:
+                res = Base_Step_Executor.run(self)
+            finally:
+                # merge runtime signatures written by this step to the workflow signature
+                if env.sos_dict.get('__workflow_sig__', None) and os.path.isfile(env.sos_dict['__workflow_sig__']):
+                    merge_workflow_journals(env.sos_dict['__workflow_sig__'])
             if self.pipe is not None:
                 env.logger.debug(f'Step {self.step.step_name()} sends result {short_repr(res)}')
                 self.pipe.send(res)
@@ -28,7 +28,7 @@ SOS_OUTPUT_OPTIONS = ['group_by']
 SOS_DEPENDS_OPTIONS = []
 SOS_RUNTIME_OPTIONS = ['workdir', 'concurrent', 'active', 'walltime', 'nodes',
         'cores', 'mem', 'shared', 'env', 'prepend_path', 'queue', 'to_host',
-        'from_host', 'map_vars', 'name', 'trunk_size', 'trunk_workers', 'tags']
+        'from_host', 'map_vars', 'name', 'trunk_size', 'trunk_workers', 'tags', 'priority']
 SOS_ACTION_OPTIONS = ['workdir', 'docker_image', 'docker_file', 'active', 'input', 'output',
         'allow_error', 'tracked', 'stdout', 'stderr']
 
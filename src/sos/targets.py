@@ -21,20 +21,27 @@
 #
 import os
 import sys
+import time
+import mmap
+import threading
 import xxhash
 import shlex
 import shutil
 import fasteners
 from copy import deepcopy
-import pkg_resources
+from concurrent.futures import ThreadPoolExecutor
 from shlex import quote
 import subprocess
 from pathlib import Path
+from io import StringIO
+from functools import partial
 
 from collections.abc import Sequence, Iterable
 
-from .utils import env, Error, short_repr, stable_repr, save_var, load_var, isPrimitive, TimeoutInterProcessLock
+from .utils import env, Error, short_repr, stable_repr, save_var, load_var, isPrimitive
 from .eval import Undetermined
+from .signatures import signature_store, hash_cache, write_workflow_sig
+from .plugins import load_entry_point
 
 __all__ = ['dynamic', 'executable', 'env_variable', 'sos_variable']
 
@@ -72,46 +79,175 @@ def textMD5(text):
         m.update(text)
     return m.hexdigest()
 
-def fileMD5(filename, partial=True):
+# files smaller than this are hashed directly because it is cheaper than
+# looking up and updating the hash cache
+HASH_CACHE_MIN_SIZE = 2**20
+
+def paranoid_hash():
+    '''In paranoid mode (option sos_paranoid_hash in sos configuration) files
+    are always rehashed, ignoring the hash cache.'''
+    return 'CONFIG' in env.sos_dict and bool(env.sos_dict['CONFIG'].get('sos_paranoid_hash', False))
+
+def _hash_partial(filename, filesize):
+    # 2**24 = 16M
+    if filesize < 2**24:
+        return _hash_full(filename, filesize)
+    md5 = xxhash.xxh64()
+    block_size = 2**20  # buffer of 1M
+    count = 16
+    # otherwise, use the first and last 32M
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            count -= 1
+            if count == 8:
+                # 2**23 = 8M
+                f.seek(-2**23, 2)
+            if not data or count == 0:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+def _hash_full(filename, filesize):
+    md5 = xxhash.xxh64()
+    block_size = 2**20  # buffer of 1M
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+def _hash_mmap(filename, filesize):
+    # hash the entire file without copying it through python buffers
+    if filesize == 0:
+        return xxhash.xxh64().hexdigest()
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return xxhash.xxh64(m).hexdigest()
+
+def _hash_sample(filename, filesize, samples):
+    # hash N evenly spaced blocks of the file, including the first and the last one
+    block_size = 2**20
+    if filesize <= samples * block_size:
+        return _hash_full(filename, filesize)
+    md5 = xxhash.xxh64()
+    md5.update(str(filesize).encode())
+    with open(filename, 'rb') as f:
+        for i in range(samples):
+            f.seek(i * (filesize - block_size) // (samples - 1))
+            md5.update(f.read(block_size))
+    return md5.hexdigest()
+
+def get_hash_strategy(strategy=None):
+    '''Return name of hashing strategy and its tag. Strategies can be "partial"
+    (first and last 8M of files larger than 16M, the default), "full" (entire
+    file), "mmap" (entire file through memory mapping), and "sample" (N evenly
+    spaced 1M blocks, "sampleN" for a specific N). Strategies that produce
+    the same hash share the same tag. The default strategy and the number of
+    samples can be set by options sos_hash_strategy and sos_hash_samples in
+    sos configuration.'''
+    config = env.sos_dict['CONFIG'] if 'CONFIG' in env.sos_dict else {}
+    if strategy is None:
+        strategy = config.get('sos_hash_strategy', 'partial')
+    if strategy in ('partial', 'full'):
+        return strategy, strategy
+    elif strategy == 'mmap':
+        return strategy, 'full'
+    elif strategy == 'sample':
+        return strategy, f'sample{int(config.get("sos_hash_samples", 16))}'
+    elif strategy.startswith('sample') and strategy[6:].isdigit() and int(strategy[6:]) > 1:
+        return 'sample', strategy
+    else:
+        raise ValueError(f'Unrecognized hashing strategy {strategy}')
+
+def fileMD5(filename, partial=True, strategy=None):
     '''Calculate partial MD5, basically the first and last 8M
     of the file for large files. This should signicicantly reduce
     the time spent on the creation and comparison of file signature
-    when dealing with large bioinformat ics datasets. '''
-    filesize = os.path.getsize(filename)
-    # calculate md5 for specified file
-    md5 = xxhash.xxh64()
-    block_size = 2**20  # buffer of 1M
+    when dealing with large bioinformat ics datasets. Other hashing
+    strategies can be specified with parameter strategy (see function
+    hash_strategy for details). Hashes of large files are cached by their
+    (device, inode, size, mtime_ns) and are not recalculated unless the
+    files are changed. '''
+    name, tag = get_hash_strategy(strategy if strategy else ('partial' if partial else 'full'))
+    st = os.stat(filename)
+    # files that have just been modified are not cached because they could be
+    # modified again without changing mtime on file systems with coarse timestamps
+    use_cache = st.st_size >= HASH_CACHE_MIN_SIZE and time.time() - st.st_mtime > 2 \
+        and not paranoid_hash()
+    if use_cache:
+        md5 = hash_cache().get(st, tag)
+        if md5 is not None:
+            return md5
     try:
-        # 2**24 = 16M
-        if (not partial) or filesize < 2**24:
-            with open(filename, 'rb') as f:
-                while True:
-                    data = f.read(block_size)
-                    if not data:
-                        break
-                    md5.update(data)
+        if name == 'sample':
+            md5 = _hash_sample(filename, st.st_size, int(tag[6:]))
         else:
-            count = 16
-            # otherwise, use the first and last 32M
-            with open(filename, 'rb') as f:
-                while True:
-                    data = f.read(block_size)
-                    count -= 1
-                    if count == 8:
-                        # 2**23 = 8M
-                        f.seek(-2**23, 2)
-                    if not data or count == 0:
-                        break
-                    md5.update(data)
+            md5 = {'partial': _hash_partial, 'full': _hash_full, 'mmap': _hash_mmap}[name](filename, st.st_size)
     except IOError as e:
         sys.exit(f'Failed to read {filename}: {e}')
-    return md5.hexdigest()
+    if use_cache:
+        hash_cache().set(st, tag, md5)
+    return md5
+
+def file_signature(filename, strategy=None):
+    '''Signature of file, which is its hash prefixed by the tag of hashing strategy
+    (e.g. sample16:xxxx) unless the default partial strategy is used, so that
+    signatures calculated with different strategies never match.'''
+    name, tag = get_hash_strategy(strategy)
+    md5 = fileMD5(filename, strategy=tag if name == 'sample' else name)
+    return md5 if tag == 'partial' else f'{tag}:{md5}'
+
+def signature_strategy(signature):
+    '''Return hashing strategy used to calculate signature, or None (default
+    strategy) for signatures of directories'''
+    tag = signature.split(':', 1)[0] if ':' in signature else 'partial'
+    if tag == 'dir':
+        return None
+    return 'mmap' if tag == 'full' else tag
+
+def merkle_root(entries):
+    '''Return root hash of a Merkle tree built from a dictionary of relative
+    filenames (separated by /) and their signatures. The hash of a directory
+    is the hash of names and hashes of its files and subdirectories.'''
+    tree = {}
+    for name, md5 in entries.items():
+        node = tree
+        parts = name.split('/')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = md5
+    def node_hash(node):
+        return textMD5(''.join(f'{k}\t{node_hash(v) if isinstance(v, dict) else v}\n'
+            for k, v in sorted(node.items())))
+    return node_hash(tree)
+
+_hash_pool = None
+
+def hash_map(func, items):
+    '''Apply func, which usually calculates signatures of files, to items with a
+    pool of threads (option sos_hash_threads in sos configuration, default to 4)
+    and return results in the order of items. xxhash releases the GIL so files
+    are read and hashed concurrently.'''
+    global _hash_pool
+    items = list(items)
+    n_threads = env.sos_dict['CONFIG'].get('sos_hash_threads', 4) if 'CONFIG' in env.sos_dict else 4
+    # func can call hash_map (e.g. for files under a directory), which should not
+    # wait for the pool from one of its own threads
+    if n_threads <= 1 or len(items) <= 1 or threading.current_thread().name.startswith('sos_hash'):
+        return [func(x) for x in items]
+    # threads of the pool do not survive fork
+    if _hash_pool is None or _hash_pool[0] != os.getpid() or _hash_pool[1] != n_threads:
+        _hash_pool = (os.getpid(), n_threads, ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix='sos_hash'))
+    return list(_hash_pool[2].map(func, items))
 
 
 class BaseTarget:
     '''A base class for all targets (e.g. a file)'''
     def __init__(self, *args):
-        self._sigfile = None
+        pass
 
     def target_exists(self, mode='any'):
         # mode should be 'any', 'target', or 'signature'
@@ -133,21 +269,36 @@ class BaseTarget:
     # -----------------------------------------------------
     # derived functions that do not need to be redefined
     #
-    def sig_file(self):
-        if self._sigfile is None:
-            self._sigfile = os.path.join(env.exec_dir, '.sos', '.runtime',
-                                         f'{self.__class__.__name__}_{textMD5(self.target_name())}.file_info')
-        return self._sigfile
+    def sig_store(self):
+        '''Signature database in which the signature of the target is saved'''
+        return signature_store()
+
+    def sig_key(self):
+        '''Key of the target in signature database'''
+        return f'{self.__class__.__name__}("{self.target_name()}")'
+
+    def sig_record(self):
+        '''Record (key, mtime, size, md5, attachments) to be saved to signature
+        database, or None if the signature of the target should not be saved.'''
+        return (self.sig_key(), None, None, self.target_signature(), '')
+
+    def sig_entries(self):
+        '''Entries (name, mtime_ns, size, md5) of files under a directory target,
+        which are saved with its record, or None if the target is not a directory.'''
+        return None
+
+    def has_sig(self):
+        return self.sig_store().get_target(self.sig_key()) is not None
 
     def remove_sig(self):
-        if self.sig_file() and os.path.isfile(self.sig_file()):
-            os.remove(self.sig_file())
+        self.sig_store().remove_targets([self.sig_key()])
 
     def write_sig(self):
-        '''Write .sig file with signature'''
-        # path to file
-        with open(self.sig_file(), 'w') as sig:
-            sig.write(f'{self.target_name()}\t{self.target_signature()}\n')
+        '''Save signature of target to signature database'''
+        rec = self.sig_record()
+        if rec is not None:
+            entries = self.sig_entries()
+            self.sig_store().write(targets=[rec], dirs={} if entries is None else {rec[0]: entries})
 
     def __repr__(self):
         return f'{self.__class__.__name__}("{self.target_name()}")'
@@ -233,8 +384,8 @@ class sos_step(BaseTarget):
     def target_signature(self, mode='any'):
         return textMD5(f'sos_step({self._step_name})')
 
-    def write_sig(self):
-        pass
+    def sig_record(self):
+        return None
 
     def __eq__(self, other):
         return isinstance(other, sos_step) and self._step_name == other._step_name
@@ -372,7 +523,7 @@ class executable(BaseTarget):
                 return False
             else:
                 return True
-        if mode in ('any', 'signature') and os.path.isfile(self.sig_file()):
+        if mode in ('any', 'signature') and self.has_sig():
             return True
         return False
 
@@ -469,15 +620,23 @@ class path(type(Path())):
 class file_target(path, BaseTarget):
     '''A regular target for files.
     '''
-    def __init__(self, *args):
+    def __init__(self, *args, hash_strategy=None):
         # this is path segments 
         super(file_target, self).__init__(*args)
-        if len(args) == 1 and isinstance(args[0], file_target):
+        if len(args) == 1 and isinstance(args[0], file_target) and hash_strategy is None:
             self._md5 = args[0]._md5
             self._attachments = args[0]._attachments
+            self._hash_strategy = args[0]._hash_strategy
         else:
             self._md5 = None
             self._attachments = []
+            # hashing strategy of the target, default to project default
+            if hash_strategy is not None:
+                get_hash_strategy(hash_strategy)
+            self._hash_strategy = hash_strategy
+
+    def __reduce__(self):
+        return (self.__class__, tuple(self._parts), {'_hash_strategy': self._hash_strategy})
 
     def target_exists(self, mode='any'):
         try:
@@ -485,7 +644,7 @@ class file_target(path, BaseTarget):
                 return True
             elif mode == 'any' and Path(str(self.expanduser()) + '.zapped').exists():
                 return True
-            elif mode == 'signature' and Path(self.sig_file()).exists():
+            elif mode == 'signature' and self.has_sig():
                 return True
             return False
         except Exception as e:
@@ -498,42 +657,54 @@ class file_target(path, BaseTarget):
     def __fspath__(self):
         return super(file_target, self).__fspath__()
 
-    def sig_file(self):
-        if self._sigfile is not None:
-            return self._sigfile
+    def sig_store(self):
         # If the output path is outside of the current working directory
-        fullname = str(self.expanduser().resolve())
-        name_md5 = textMD5(fullname)
+        return signature_store(self.is_external())
 
-        if self.is_external():
-            self._sigfile = os.path.join(os.path.expanduser('~'), '.sos', '.runtime', name_md5 + '.file_info')
-        else:
-            self._sigfile = os.path.join(env.exec_dir, '.sos', '.runtime', name_md5 + '.file_info')
-        return self._sigfile
+    def sig_key(self):
+        return str(self.expanduser().resolve())
+
+    def _zapped_sig(self):
+        if os.path.isfile(self.fullname() + '.zapped'):
+            with open(self.fullname() + '.zapped') as md5:
+                try:
+                    _, t, s, m = md5.readline().rsplit('\t', 3)
+                    return (float(t), int(s), m.strip(), '')
+                except Exception:
+                    pass
+        return None
+
+    def _as_dir(self):
+        # a file_target that turns out to be a directory (e.g. output of a step)
+        # is handled as a dir_target
+        if not os.path.isdir(self.fullname()):
+            return None
+        if getattr(self, '_dir', None) is None:
+            self._dir = dir_target(self)
+        return self._dir
 
     def target_signature(self, mode='any'):
         '''Return file signature'''
+        d = self._as_dir()
+        if d is not None:
+            return d.target_signature(mode)
         if mode == 'target':
-            self._md5 = fileMD5(self.fullname())
+            self._md5 = file_signature(self.fullname(), self._hash_strategy)
         if self._md5 is not None:
             return self._md5
-        if os.path.isfile(self.sig_file()) and (not os.path.isfile(self.fullname()) or os.path.getmtime(self.sig_file()) > os.path.getmtime(self.fullname())):
-            with open(self.sig_file()) as md5:
-                try:
-                    line = md5.readline()
-                    _, _, _, m = line.rsplit('\t', 3)
-                    return m.strip()
-                except Exception:
-                    pass
-        elif os.path.isfile(self.fullname() + '.zapped'):
-            with open(self.fullname() + '.zapped') as md5:
-                try:
-                    line = md5.readline()
-                    _, _, _, m = line.rsplit('\t', 3)
-                    return m.strip()
-                except Exception:
-                    pass
-        self._md5 = fileMD5(self.fullname())
+        sig = self.sig_store().get_target(self.sig_key())
+        if sig is not None:
+            # use saved signature if the file has not been changed since, and if
+            # the signature was calculated with the same hashing strategy
+            if not os.path.isfile(self.fullname()) or (not paranoid_hash() and
+                    sig[0] == os.path.getmtime(self.fullname()) and sig[1] == os.path.getsize(self.fullname()) and
+                    get_hash_strategy(signature_strategy(sig[2]))[1] == get_hash_strategy(self._hash_strategy)[1]):
+                return sig[2]
+        elif not os.path.isfile(self.fullname()):
+            sig = self._zapped_sig()
+            if sig is not None:
+                return sig[2]
+        self._md5 = file_signature(self.fullname(), self._hash_strategy)
         return self._md5
     #
     # file_target - specific functions. Not required by other targets
@@ -545,68 +716,172 @@ class file_target(path, BaseTarget):
     def remove(self, mode='both'):
         if mode in ('both', 'target') and os.path.isfile(self.fullname()):
             os.remove(self.fullname())
-        if mode in ('both', 'signature') and os.path.isfile(self.sig_file()):
-            os.remove(self.sig_file())
+        if mode in ('both', 'signature'):
+            self.remove_sig()
+
+    def zap(self):
+        '''Replace file with a .zapped file that contains its signature'''
+        self.write_sig()
+        _, mtime, size, md5, attachments = self.sig_record()
+        with open(self.fullname() + '.zapped', 'w') as zapped:
+            zapped.write(f'{self.fullname()}\t{mtime}\t{size}\t{md5}\n')
+            zapped.write(attachments)
+        os.remove(self.fullname())
 
     def size(self):
+        d = self._as_dir()
+        if d is not None:
+            return d.size()
         if self.exists():
             return os.path.getsize(self.fullname())
-        elif os.path.isfile(self.sig_file()):
-            with open(self.sig_file()) as md5:
-                line = md5.readline()
-                _, _, s, _ = line.rsplit('\t', 3)
-                return int(s.strip())
-        elif os.path.isfile(self.fullname() + '.zapped'):
-            with open(self.fullname() + '.zapped') as md5:
-                line = md5.readline()
-                _, _, s, _ = line.rsplit('\t', 3)
-                return int(s.strip())
-        else:
+        sig = self.sig_store().get_target(self.sig_key()) or self._zapped_sig()
+        if sig is None:
             raise RuntimeError(f'{self} or its signature does not exist.')
+        return sig[1]
 
     def mtime(self):
         if self.exists():
             return os.path.getmtime(self.fullname())
-        elif os.path.isfile(self.sig_file()):
-            with open(self.sig_file()) as md5:
-                line = md5.readline()
-                _, t, _, _ = line.rsplit('\t', 3)
-                return t.strip()
-        elif os.path.isfile(self.fullname() + '.zapped'):
-            with open(self.fullname() + '.zapped') as md5:
-                line = md5.readline()
-                _, t, _, _ = line.rsplit('\t', 3)
-                return t.strip()
-        else:
+        sig = self.sig_store().get_target(self.sig_key()) or self._zapped_sig()
+        if sig is None:
             raise RuntimeError(f'{self} or its signature does not exist.')
+        return sig[0]
 
-    def write_sig(self):
-        '''Write .file_info file with signature'''
-        # path to file
-        with open(self.sig_file(), 'w') as md5:
-            md5.write(
-                f'{self.fullname()}\t{os.path.getmtime(self.fullname())}\t{os.path.getsize(self.fullname())}\t{self.target_signature()}\n')
-            for f in self._attachments:
-                md5.write(f'{f}\t{os.path.getmtime(f)}\t{os.path.getsize(f)}\t{fileMD5(f)}\n')
+    def sig_record(self):
+        d = self._as_dir()
+        if d is not None:
+            return d.sig_record()
+        attachments = ''.join(f'{f}\t{os.path.getmtime(f)}\t{os.path.getsize(f)}\t{file_signature(f, self._hash_strategy)}\n'
+            for f in self._attachments)
+        return (self.sig_key(), os.path.getmtime(self.fullname()), os.path.getsize(self.fullname()),
+            self.target_signature(), attachments)
+
+    def sig_entries(self):
+        d = self._as_dir()
+        return None if d is None else d.sig_entries()
 
     def validate(self):
         '''Check if file matches its signature'''
-        if not os.path.isfile(self.sig_file()):
+        d = self._as_dir()
+        if d is not None:
+            return d.validate()
+        sig = self.sig_store().get_target(self.sig_key())
+        if sig is None:
             return False
-        with open(self.sig_file()) as md5:
-            for line in md5:
-                f, _, _, m = line.rsplit('\t', 3)
-                if not os.path.isfile(f):
-                    return False
-                if fileMD5(f) != m.strip():
-                    env.logger.debug(f'MD5 mismatch {f}')
-                    return False
+        files = [(self.fullname(), sig[2])]
+        for line in sig[3].splitlines():
+            f, _, _, m = line.rsplit('\t', 3)
+            files.append((f, m))
+        for f, m in files:
+            if not os.path.isfile(f):
+                return False
+            if file_signature(f, signature_strategy(m.strip())) != m.strip():
+                env.logger.debug(f'MD5 mismatch {f}')
+                return False
         return True
 
     def __hash__(self):
         return hash(repr(self))
 
 
+class dir_target(file_target):
+    '''A target for a directory, with a signature that is the root of a Merkle
+    tree of the signatures of all files under the directory. Signatures of files
+    are saved with their stat information so that only new or changed files are
+    hashed when the signature of the directory is recalculated.'''
+    def __init__(self, *args, hash_strategy=None):
+        super(dir_target, self).__init__(*args, hash_strategy=hash_strategy)
+        # name: (mtime_ns, size, md5) of files from the last scan
+        self._entries = None
+
+    def _as_dir(self):
+        return None
+
+    def _scan(self):
+        '''Return (mtime_ns, size, md5) of all files under the directory, hashing
+        only files that are not in, or have changed since, the saved tree'''
+        root = self.fullname()
+        saved = {} if paranoid_hash() else self.sig_store().get_dir_entries(self.sig_key())
+        entries = {}
+        changed = []
+        for dirname, _, filelist in os.walk(root):
+            for f in filelist:
+                filename = os.path.join(dirname, f)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    # broken symbolic link etc
+                    continue
+                name = os.path.relpath(filename, root).replace(os.sep, '/')
+                rec = saved.get(name, None)
+                if rec is not None and rec[0] == st.st_mtime_ns and rec[1] == st.st_size:
+                    entries[name] = rec
+                else:
+                    entries[name] = (st.st_mtime_ns, st.st_size, None)
+                    changed.append(name)
+        if changed:
+            env.logger.trace(f'Hashing {len(changed)} of {len(entries)} files under {self}')
+        for name, md5 in zip(changed, hash_map(lambda x: file_signature(os.path.join(root, x), self._hash_strategy), changed)):
+            entries[name] = entries[name][:2] + (md5,)
+        return entries
+
+    def target_signature(self, mode='any'):
+        '''Return signature of directory'''
+        if mode != 'target' and self._md5 is not None:
+            return self._md5
+        if not os.path.isdir(self.fullname()):
+            sig = self.sig_store().get_target(self.sig_key())
+            if sig is None:
+                raise ValueError(f'Directory {self} or its signature does not exist')
+            return sig[2]
+        self._entries = self._scan()
+        self._md5 = 'dir:' + merkle_root({x: y[2] for x, y in self._entries.items()})
+        return self._md5
+
+    def sig_record(self):
+        if self._entries is None:
+            self.target_signature('target')
+        return (self.sig_key(), os.path.getmtime(self.fullname()),
+            sum(x[1] for x in self._entries.values()), self._md5, '')
+
+    def sig_entries(self):
+        if self._entries is None:
+            self.target_signature('target')
+        # files that have just been modified are rehashed next time because they
+        # could be modified again without changing mtime
+        now = time.time()
+        return [(x, *y) for x, y in self._entries.items() if now - y[0] / 1e9 > 2]
+
+    def size(self):
+        if os.path.isdir(self.fullname()):
+            if self._entries is None:
+                self.target_signature('target')
+            return sum(x[1] for x in self._entries.values())
+        sig = self.sig_store().get_target(self.sig_key())
+        if sig is None:
+            raise RuntimeError(f'{self} or its signature does not exist.')
+        return sig[1]
+
+    def remove(self, mode='both'):
+        if mode in ('both', 'target') and os.path.isdir(self.fullname()):
+            shutil.rmtree(self.fullname())
+        if mode in ('both', 'signature'):
+            self.remove_sig()
+
+    def zap(self):
+        raise RuntimeError(f'Directory target {self} cannot be zapped')
+
+    def validate(self):
+        '''Check if directory matches its signature'''
+        sig = self.sig_store().get_target(self.sig_key())
+        if sig is None or not os.path.isdir(self.fullname()):
+            return False
+        return self.target_signature('target') == sig[2]
+
+    def __hash__(self):
+        return hash(repr(self))
+
+
 class paths(Sequence, os.PathLike):
     '''A collection of targets'''
     def __init__(self, *args):
@@ -787,11 +1062,29 @@ class sos_targets(BaseTarget, Sequence, os.PathLike):
     def __eq__(self, other):
         return self._targets == other._targets if isinstance(other, sos_targets) else other
 
-    def sig_file(self):
+    def sig_store(self):
+        if len(self._targets) == 1:
+            return self._targets[0].sig_store()
+        else:
+            raise ValueError(f'Cannot get signature of group of targets {self}')
+
+    def sig_key(self):
+        if len(self._targets) == 1:
+            return self._targets[0].sig_key()
+        else:
+            raise ValueError(f'Cannot get signature of group of targets {self}')
+
+    def sig_record(self):
         if len(self._targets) == 1:
-            return self._targets[0].sig_file()
+            return self._targets[0].sig_record()
         else:
-            raise ValueError(f'Cannot get sig_file for group of targets {self}')
+            raise ValueError(f'Cannot get signature of group of targets {self}')
+
+    def sig_entries(self):
+        if len(self._targets) == 1:
+            return self._targets[0].sig_entries()
+        else:
+            raise ValueError(f'Cannot get signature of group of targets {self}')
 
     def __add__(self, part):
         if len(self._targets) == 1:
@@ -815,9 +1108,33 @@ class sos_targets(BaseTarget, Sequence, os.PathLike):
     def __str__(self):
         return self.__format__('')
 
+def _signature_to_write(target, rebuild=False):
+    '''Return signature record (None if no record should be saved), entries of
+    files if target is a directory, and signature of target, or (None, None, None)
+    if neither target nor its signature exists'''
+    if target.target_exists('target'):
+        # this calculates file MD5
+        rec = target.sig_record()
+        return rec, None if rec is None else target.sig_entries(), target.target_signature()
+    elif not rebuild and target.target_exists('signature'):
+        return None, None, target.target_signature()
+    return None, None, None
+
+def _signature_to_validate(target):
+    '''Return current signature of target, None if target does not exist, or
+    the exception raised during the calculation of signature'''
+    try:
+        if target.target_exists('target'):
+            return target.target_signature('target')
+        elif target.target_exists('signature'):
+            return target.target_signature()
+        return None
+    except Exception as e:
+        return e
+
 class RuntimeInfo:
-    '''Record run time information related to a number of output files. Right now only the
-    .exe_info files are used.
+    '''Record run time information related to a number of output files. The information
+    is saved to the signature database of the project.
     '''
     def __init__(self, step_md5, script, input_files=None, output_files=None, dependent_files = None,
         signature_vars = None, sdict=None):
@@ -866,11 +1183,14 @@ class RuntimeInfo:
         self.sig_id = textMD5('{} {} {} {} {}'.format(self.script, self.input_files, output_files, self.dependent_files,
             '\n'.join(f'{x}:{stable_repr(sdict[x])}' for x in sig_vars)))
 
+        self._set_lock_file()
+
+    def _set_lock_file(self):
+        # signatures are saved to the global signature database for external output
         if self.external_output:
-            # global signature
-            self.proc_info = os.path.join(os.path.expanduser('~'), '.sos', '.runtime', f'{self.sig_id}.exe_info')
+            self.lock_file = os.path.join(os.path.expanduser('~'), '.sos', '.runtime', f'{self.sig_id}.lck')
         else:
-            self.proc_info = os.path.join(env.exec_dir, '.sos', '.runtime', f'{self.sig_id}.exe_info')
+            self.lock_file = os.path.join(env.exec_dir, '.sos', '.runtime', f'{self.sig_id}.lck')
 
     def __getstate__(self):
         return {'step_md5': self.step_md5,
@@ -893,19 +1213,16 @@ class RuntimeInfo:
         self.external_output = sdict['external']
         #
         # the signature might be on a remote machine and has changed location
-        if self.external_output:
-            self.proc_info = os.path.join(os.path.expanduser('~'), '.sos', '.runtime', f'{self.sig_id}.exe_info')
-        else:
-            self.proc_info = os.path.join(env.exec_dir, '.sos', '.runtime', f'{self.sig_id}.exe_info')
+        self._set_lock_file()
 
 
     def lock(self):
         # we will need to lock on a file that we do not really write to
         # otherwise the lock will be broken when we write to it.
-        self._lock = fasteners.InterProcessLock(self.proc_info + '_')
+        self._lock = fasteners.InterProcessLock(self.lock_file)
         if not self._lock.acquire(blocking=False):
             self._lock = None
-            raise UnavailableLock((self.input_files, self.output_files, self.proc_info))
+            raise UnavailableLock((self.input_files, self.output_files, self.lock_file))
         else:
             env.logger.trace(f'Lock acquired for output files {short_repr(self.output_files)}')
 
@@ -938,94 +1255,84 @@ class RuntimeInfo:
         if isinstance(self.output_files, Undetermined) or isinstance(self.dependent_files, Undetermined):
             env.logger.trace('Write signature failed due to undetermined files')
             return False
-        env.logger.trace(f'Write signature {self.proc_info}')
-        with open(self.proc_info, 'w') as md5:
-            md5.write(f'{textMD5(self.script)}\n')
-            md5.write('# input\n')
-            for f in self.input_files:
-                if f.target_exists('target'):
-                    # this calculates file MD5
-                    f.write_sig()
-                    md5.write(f'{f}\t{f.target_signature()}\n')
-                elif not rebuild and f.target_exists('signature'):
-                    md5.write(f'{f}\t{f.target_signature()}\n')
-                else:
-                    env.logger.warning(f'Failed to create signature: input target {f} does not exist')
+        env.logger.trace(f'Write signature {self.sig_id}')
+        md5 = [f'{textMD5(self.script)}\n']
+        file_groups = [('input', self.input_files), ('output', self.output_files),
+            ('dependent', self.dependent_files)]
+        # calculate signatures of all targets concurrently
+        sigs = iter(hash_map(partial(_signature_to_write, rebuild=rebuild),
+            [f for _, files in file_groups for f in files]))
+        # signatures of targets, and entries of files under directories, grouped
+        # by signature database
+        target_sigs = {}
+        dir_entries = {}
+        for file_type, files in file_groups:
+            md5.append(f'# {file_type}\n')
+            for f in files:
+                rec, entries, sig = next(sigs)
+                if sig is None:
+                    env.logger.warning(f'Failed to create signature: {file_type} target {f} does not exist')
                     return False
-            md5.write('# output\n')
-            for f in self.output_files:
-                if f.target_exists('target'):
-                    # this calculates file MD5
-                    f.write_sig()
-                    md5.write(f'{f}\t{f.target_signature()}\n')
-                elif not rebuild and f.target_exists('signature'):
-                    md5.write(f'{f}\t{f.target_signature()}\n')
-                else:
-                    env.logger.warning(f'Failed to create signature: output target {f} does not exist')
-                    return False
-            md5.write('# dependent\n')
-            for f in self.dependent_files:
-                if f.target_exists('target'):
-                    # this calculates file MD5
-                    f.write_sig()
-                    md5.write(f'{f}\t{f.target_signature()}\n')
-                elif not rebuild and f.target_exists('signature'):
-                    md5.write(f'{f}\t{f.target_signature()}\n')
-                else:
-                    env.logger.warning(f'Failed to create signature: dependent target {f} does not exist')
-                    return False
-            # context that will be needed for validation
-            md5.write('# init context\n')
-            for var in sorted(self.signature_vars.keys()):
-                # var can be local and not passed as outside environment
-                value = self.signature_vars[var]
-                if not isinstance(value, Undetermined):
-                    try:
-                        var_expr = save_var(var, value)
-                        if var_expr:
-                            md5.write(var_expr)
-                    except Exception:
-                        env.logger.debug(f'Variable {var} of value {short_repr(value)} is ignored from step signature')
-            # context used to return context
-            md5.write('# end context\n')
-            for var in sorted(self.signature_vars.keys()):
-                # var can be local and not passed as outside environment
-                if var in env.sos_dict:
-                    value = env.sos_dict[var]
-                    try:
-                        md5.write(save_var(var, value))
-                    except Exception:
-                        env.logger.debug(f'Variable {var} of value {short_repr(value)} is ignored from step signature')
-            md5.write('# step process\n')
-            md5.write(self.script)
-            md5.write('# step process\n')
-            md5.write(self.script)
+                if rec is not None:
+                    target_sigs.setdefault(f.sig_store(), []).append(rec)
+                    if entries is not None:
+                        dir_entries.setdefault(f.sig_store(), {})[rec[0]] = entries
+                md5.append(f'{f}\t{sig}\n')
+        # context that will be needed for validation
+        md5.append('# init context\n')
+        for var in sorted(self.signature_vars.keys()):
+            # var can be local and not passed as outside environment
+            value = self.signature_vars[var]
+            if not isinstance(value, Undetermined):
+                try:
+                    var_expr = save_var(var, value)
+                    if var_expr:
+                        md5.append(var_expr)
+                except Exception:
+                    env.logger.debug(f'Variable {var} of value {short_repr(value)} is ignored from step signature')
+        # context used to return context
+        md5.append('# end context\n')
+        for var in sorted(self.signature_vars.keys()):
+            # var can be local and not passed as outside environment
+            if var in env.sos_dict:
+                value = env.sos_dict[var]
+                try:
+                    md5.append(save_var(var, value))
+                except Exception:
+                    env.logger.debug(f'Variable {var} of value {short_repr(value)} is ignored from step signature')
+        md5.append('# step process\n')
+        md5.append(self.script)
+        # write signatures of targets and the step in as few transactions as possible
+        step_store = signature_store(self.external_output)
+        target_sigs.setdefault(step_store, [])
+        for store, recs in target_sigs.items():
+            store.write(targets=recs, dirs=dir_entries.get(store, {}),
+                steps=[(self.sig_id, ''.join(md5))] if store is step_store else [])
         # successfully write signature, write in workflow runtime info
         if '__workflow_sig__' in env.sos_dict and os.path.isfile(env.sos_dict['__workflow_sig__']):
-            workflow_sig = env.sos_dict['__workflow_sig__']
-            with TimeoutInterProcessLock(workflow_sig + '_'):
-                with open(workflow_sig, 'a') as wf:
-                    wf.write(
-                        f'EXE_SIG\tstep={self.step_md5}\tsession={os.path.basename(self.proc_info).split(".")[0]}\n')
-                    for f in self.input_files:
-                        if isinstance(f, file_target):
-                            wf.write(
-                                f'IN_FILE\tfilename={f}\tsession={self.step_md5}\tsize={f.size()}\tmd5={f.target_signature()}\n')
-                    for f in self.dependent_files:
-                        if isinstance(f, file_target):
-                            wf.write(
-                                f'IN_FILE\tfilename={f}\tsession={self.step_md5}\tsize={f.size()}\tmd5={f.target_signature()}\n')
-                    for f in self.output_files:
-                        if isinstance(f, file_target):
-                            wf.write(
-                                f'OUT_FILE\tfilename={f}\tsession={self.step_md5}\tsize={f.size()}\tmd5={f.target_signature()}\n')
+            lines = [f'EXE_SIG\tstep={self.step_md5}\tsession={self.sig_id}\n']
+            for file_type, files in (('IN_FILE', self.input_files), ('IN_FILE', self.dependent_files),
+                ('OUT_FILE', self.output_files)):
+                for f in files:
+                    if isinstance(f, file_target):
+                        lines.append(
+                            f'{file_type}\tfilename={f}\tsession={self.step_md5}\tsize={f.size()}\tmd5={f.target_signature()}\n')
+            write_workflow_sig(env.sos_dict['__workflow_sig__'], lines)
         return True
 
     def validate(self):
         '''Check if ofiles and ifiles match signatures recorded in md5file'''
-        if not self.proc_info or not os.path.isfile(self.proc_info):
-            return f'Missing signature file {self.proc_info}'
-        env.logger.trace(f'Validating {self.proc_info}')
+        return validate_signatures([self])[0]
+
+    def _parse(self, content, context=None):
+        '''Parse saved signature and return a mismatch message, or targets with their
+        saved signatures, partial result, and names of targets to be checked. Saved
+        context variables are compared with context (default to env.sos_dict).'''
+        if context is None:
+            context = env.sos_dict
+        if content is None:
+            return f'Missing signature {self.sig_id}'
+        env.logger.trace(f'Validating {self.sig_id}')
         #
         # file not exist?
         if isinstance(self.output_files, Undetermined):
@@ -1037,8 +1344,10 @@ class RuntimeInfo:
         #
         files_checked = {x.target_name():False for x in sig_files if not isinstance(x, Undetermined)}
         res = {'input': [], 'output': [], 'depends': [], 'vars': {}}
+        # targets with their recorded signatures
+        targets = []
         cur_type = 'input'
-        with open(self.proc_info) as md5:
+        with StringIO(content) as md5:
             cmdMD5 = md5.readline().strip()   # command
             if textMD5(self.script) != cmdMD5:
                 return "Changed command"
@@ -1064,12 +1373,12 @@ class RuntimeInfo:
                 # for validation
                 if cur_type == 'init context':
                     key, value = load_var(line)
-                    if key not in env.sos_dict:
+                    if key not in context:
                         return f'Variable {key} not in running environment'
                     try:
                         try:
-                            if env.sos_dict[key] != value:
-                                return f'Context variable {key} value mismatch: {short_repr(value)} saved, {short_repr(env.sos_dict[key])} current'
+                            if context[key] != value:
+                                return f'Context variable {key} value mismatch: {short_repr(value)} saved, {short_repr(context[key])} current'
                         except Exception as e:
                             env.logger.debug(f"Variable {key} of type {type(value).__name__} cannot be compared: {e}")
                     except Exception as e:
@@ -1093,38 +1402,81 @@ class RuntimeInfo:
                             target_class = eval(target_type)
                         else:
                             # check registry
-                            for entrypoint in pkg_resources.iter_entry_points(group='sos_targets'):
-                                if entrypoint.name.strip() == target_type:
-                                    target_class = entrypoint.load()
-                                    break
+                            target_class = load_entry_point('sos_targets', target_type)
                         if target_class is None:
                             raise ValueError(f'Failed to identify target class {target_type}')
                         # parameter of class?
                         freal = eval(f, {target_type: target_class})
                     else:
-                        freal = file_target(f)
-                    if freal.target_exists('target'):
-                        fmd5 = freal.target_signature('target')
-                    elif freal.target_exists('signature'):
-                        fmd5 = freal.target_signature()
-                    else:
-                        return f'File {f} not exist'
-                    res[cur_type].append(freal.target_name() if isinstance(freal, file_target) else freal)
-                    if fmd5 != m.strip():
-                        return f'File has changed {f}'
-                    files_checked[freal.target_name()] = True
+                        # validate with the hashing strategy used to create the signature
+                        freal = file_target(f, hash_strategy=signature_strategy(m.strip()))
+                    targets.append((cur_type, line, f, m.strip(), freal))
                 except Exception as e:
-                    env.logger.debug(f'Wrong md5 line {line} in {self.proc_info}: {e}')
+                    env.logger.debug(f'Wrong md5 line {line} in signature {self.sig_id}: {e}')
                     continue
+        return targets, res, files_checked
+
+    def _check(self, targets, res, files_checked, signatures):
+        '''Compare saved signatures of targets with their current signatures'''
+        for cur_type, line, f, m, freal in targets:
+            fmd5 = signatures[_target_key(freal)]
+            if isinstance(fmd5, Exception):
+                env.logger.debug(f'Wrong md5 line {line} in signature {self.sig_id}: {fmd5}')
+                continue
+            if fmd5 is None:
+                return f'File {f} not exist'
+            res[cur_type].append(freal.target_name() if isinstance(freal, file_target) else freal)
+            if fmd5 != m:
+                return f'File has changed {f}'
+            files_checked[freal.target_name()] = True
         #
         if not all(files_checked.values()):
             return f'No MD5 signature for {", ".join(x for x,y in files_checked.items() if not y)}'
         env.logger.trace(f'Signature matches and returns {res}')
-        # validation success, record signature used
-        if '__workflow_sig__' in env.sos_dict and os.path.isfile(env.sos_dict['__workflow_sig__']):
-            workflow_sig = env.sos_dict['__workflow_sig__']
-            with TimeoutInterProcessLock(workflow_sig + '_'):
-                with open(workflow_sig, 'a') as wf:
-                    wf.write(self.proc_info + '\n')
         return res
 
+
+def _target_key(target):
+    # targets with the same key have the same signature
+    try:
+        return (target.__class__.__name__, target.sig_key(), getattr(target, '_hash_strategy', None))
+    except Exception:
+        return id(target)
+
+
+def validate_signatures(signatures, contexts=None, record=True):
+    '''Validate a list of RuntimeInfo objects (e.g. of all input groups of a step) in
+    one pass. Saved signatures are read in batch, and targets shared by several
+    signatures are hashed only once. Returns a list with a dictionary of input,
+    output, depends, and vars for each matching signature, or a message
+    explaining the mismatch. Saved context variables are compared with contexts,
+    one for each signature, which default to env.sos_dict. Matching signatures
+    are recorded to the workflow signature unless record is False.'''
+    results = [None] * len(signatures)
+    contents = {}
+    for external in (False, True):
+        sig_ids = [x.sig_id for x in signatures if bool(x.external_output) == external]
+        if sig_ids:
+            contents.update(signature_store(external).get_steps(sig_ids))
+    parsed = []
+    for idx, sig in enumerate(signatures):
+        res = sig._parse(contents.get(sig.sig_id), None if contexts is None else contexts[idx])
+        if isinstance(res, str):
+            results[idx] = res
+        else:
+            parsed.append((idx, res))
+    # calculate signatures of distinct targets concurrently
+    targets = {}
+    for _, (entries, _, _) in parsed:
+        for entry in entries:
+            targets.setdefault(_target_key(entry[-1]), entry[-1])
+    current = dict(zip(targets.keys(), hash_map(_signature_to_validate, targets.values())))
+    for idx, (entries, res, files_checked) in parsed:
+        results[idx] = signatures[idx]._check(entries, res, files_checked, current)
+    # validation success, record signatures used
+    matched = [x for x, res in zip(signatures, results) if isinstance(res, dict)]
+    if record and matched and '__workflow_sig__' in env.sos_dict and os.path.isfile(env.sos_dict['__workflow_sig__']):
+        write_workflow_sig(env.sos_dict['__workflow_sig__'],
+            [f'EXE_SIG\tstep={x.step_md5}\tsession={x.sig_id}\n' for x in matched])
+    return results
+
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+#
+# This file is part of Script of Scripts (SoS), a workflow system
+# for the execution of commands and scripts in different languages.
+# Please visit https://github.com/vatlab/SOS for more information.
+#
+# Copyright (C) 2016 Bo Peng (bpeng@mdanderson.org)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import sys
+import stat
+import time
+import struct
+import pickle
+from array import array
+
+from .utils import env
+from .signatures import SQLiteDB
+
+__all__ = ['TaskStore', 'TaskWatcher', 'task_store', 'task_dir', 'task_files']
+
+# files of a task under ~/.sos/tasks, and under ~/.sos/tasks/{alias} for tasks
+# prepared for specific hosts
+_task_file_exts = ('.def', '.task', '.res', '.pulse', '.status', '.out', '.err', '.sh')
+
+# columns of a task record
+_fields = ('id', 'status', 'tags', 'task_mtime', 'created', 'started', 'completed',
+    'ret_code', 'peak_cpu', 'peak_mem', 'pid', 'hostname', 'step')
+
+# columns of a resource sample, which are the fields of a line in pulse files
+_sample_fields = ('time', 'proc_cpu', 'proc_mem', 'children', 'children_cpu', 'children_mem')
+
+
+def task_dir():
+    return os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+
+
+def task_files(task_id, subdirs=[]):
+    '''Existing files of a task under ~/.sos/tasks and specified subdirectories'''
+    files = []
+    for dirname in [task_dir()] + [os.path.join(task_dir(), x) for x in subdirs]:
+        for ext in _task_file_exts:
+            filename = os.path.join(dirname, task_id + ext)
+            if os.path.exists(filename):
+                files.append(filename)
+    return files
+
+
+def _read_tags(task_file):
+    '''Read tags from the header of a task file without loading the task'''
+    try:
+        with open(task_file, 'rb') as task:
+            if not task.readline().decode().startswith('SOSTASK'):
+                return ''
+            return task.readline().decode().strip()
+    except Exception:
+        return ''
+
+
+class TaskStore(SQLiteDB):
+    '''An indexed table of tasks under ~/.sos/tasks, with status, tags,
+    timestamps and resource summaries of the tasks, so that tasks can be
+    listed and their status be checked without scanning the task directory
+    and stating files of each task. Definitions, results, outputs and pulses
+    of tasks are still saved in files named after task IDs.
+
+    A record is only valid for the task file (.task) with the recorded
+    modification time. Records with status None, which are imported from
+    existing task files or are created for task files written by other
+    versions of sos (e.g. copied from another host), have their status
+    determined from task files.
+    '''
+
+    def __init__(self, db_file=None):
+        super(TaskStore, self).__init__(db_file if db_file else os.path.join(task_dir(), 'tasks.db'))
+
+    def _init_db(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            status TEXT,
+            tags TEXT,
+            task_mtime REAL,
+            created REAL,
+            started REAL,
+            completed REAL,
+            ret_code INTEGER,
+            peak_cpu REAL,
+            peak_mem INTEGER,
+            pid INTEGER,
+            hostname TEXT,
+            step TEXT
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS tasks_mtime ON tasks (task_mtime)')
+        # results of completed subtasks of master tasks, which are saved as soon as
+        # the subtasks are completed so that they are not lost if the master tasks
+        # are killed, and are not executed again if the master tasks are resubmitted
+        conn.execute('''CREATE TABLE IF NOT EXISTS subtasks (
+            id TEXT PRIMARY KEY,
+            master TEXT,
+            result BLOB
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS subtasks_master ON subtasks (master)')
+        # resource usage sampled by the monitors of tasks, saved in chunks of samples
+        # of a task (subtask '') or of a subtask of a master task, one for each flush
+        # of a monitor. A chunk is a packed array of doubles with the values of each
+        # of the _sample_fields stored contiguously.
+        conn.execute('''CREATE TABLE IF NOT EXISTS samples (
+            task TEXT,
+            subtask TEXT,
+            chunk INTEGER,
+            data BLOB,
+            PRIMARY KEY (task, subtask, chunk)
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )''')
+        if not conn.execute('SELECT value FROM meta WHERE key=?', ('tasks_imported',)).fetchone():
+            self._import_tasks(conn)
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('tasks_imported', '1'))
+
+    def _import_tasks(self, conn):
+        '''Index tasks that are created before the creation of the database'''
+        dirname = os.path.dirname(self.db_file)
+        if not os.path.isdir(dirname):
+            return
+        records = []
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.task') or not entry.is_file():
+                    continue
+                records.append((entry.name[:-5], _read_tags(entry.path), entry.stat().st_mtime))
+        conn.executemany('INSERT OR IGNORE INTO tasks (id, tags, task_mtime) VALUES (?, ?, ?)', records)
+        if records:
+            env.logger.debug(f'{len(records)} existing tasks are added to {self.db_file}')
+
+    def add(self, task_id, tags=None, task_mtime=None):
+        '''Add a new task, or reset the record of a task that is resubmitted. Tags
+        and modification time are read from the task file if unspecified.'''
+        task_file = os.path.join(os.path.dirname(self.db_file), task_id + '.task')
+        if tags is None:
+            tags = _read_tags(task_file)
+        if task_mtime is None:
+            task_mtime = os.path.getmtime(task_file)
+        self._write([('INSERT OR REPLACE INTO tasks (id, status, tags, task_mtime, created) VALUES (?, ?, ?, ?, ?)',
+            [(task_id, 'pending', tags, task_mtime, time.time())])])
+
+    def update(self, task_id, **kwargs):
+        '''Update fields (status, task_mtime, started, completed, ret_code, peak_cpu,
+        peak_mem, pid, hostname etc) of the record of a task, which is created if
+        needed. Executing tasks publish their status transitions this way.'''
+        for k in kwargs:
+            if k not in _fields or k == 'id':
+                raise ValueError(f'Unrecognized field of task record: {k}')
+        keys = list(kwargs.keys())
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cur = conn.execute(f'UPDATE tasks SET {", ".join(x + "=?" for x in keys)} WHERE id=?',
+                [kwargs[x] for x in keys] + [task_id])
+            if cur.rowcount == 0:
+                if 'tags' not in kwargs:
+                    keys.append('tags')
+                    kwargs['tags'] = _read_tags(os.path.join(os.path.dirname(self.db_file), task_id + '.task'))
+                conn.execute(f'INSERT INTO tasks (id, {", ".join(keys)}) VALUES (?{", ?" * len(keys)})',
+                    [task_id] + [kwargs[x] for x in keys])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, task_id):
+        '''Return record of a task as a dictionary, or None if the task is unknown'''
+        rec = self.conn.execute(f'SELECT {", ".join(_fields)} FROM tasks WHERE id=?', (task_id,)).fetchone()
+        return None if rec is None else dict(zip(_fields, rec))
+
+    def get_tasks(self, task_ids):
+        '''Return a dictionary of records of tasks with specified IDs'''
+        return {rec[0]: dict(zip(_fields, rec)) for rec in self._select_in(
+            f'SELECT {", ".join(_fields)} FROM tasks WHERE id IN ({{}})', task_ids)}
+
+    def match(self, prefixes=None):
+        '''Return (id, task_mtime, tags) of all tasks, or of tasks with IDs starting
+        with any of the prefixes'''
+        if not prefixes:
+            return self.conn.execute('SELECT id, task_mtime, tags FROM tasks').fetchall()
+        res = []
+        for prefix in prefixes:
+            # a range query on the primary key, which uses the index
+            res.extend(self.conn.execute('SELECT id, task_mtime, tags FROM tasks WHERE id >= ? AND id < ?',
+                (prefix, prefix + '\U0010ffff')).fetchall())
+        return res
+
+    def remove(self, task_ids):
+        task_ids = list(task_ids)
+        self._write([('DELETE FROM tasks WHERE id=?', [(x,) for x in task_ids]),
+            ('DELETE FROM subtasks WHERE master=?', [(x,) for x in task_ids]),
+            ('DELETE FROM samples WHERE task=?', [(x,) for x in task_ids])])
+
+    def clear(self):
+        self._write([('DELETE FROM tasks', [()]), ('DELETE FROM subtasks', [()]),
+            ('DELETE FROM samples', [()])])
+
+    def add_subtask_result(self, master_id, result):
+        '''Save the result of a completed subtask of a master task'''
+        self._write([('INSERT OR REPLACE INTO subtasks VALUES (?, ?, ?)',
+            [(result['task'], master_id, pickle.dumps(result))])])
+
+    def get_subtask_results(self, task_ids):
+        '''Return a dictionary of results of completed subtasks with specified IDs'''
+        return {rec[0]: pickle.loads(rec[1]) for rec in self._select_in(
+            'SELECT id, result FROM subtasks WHERE id IN ({})', task_ids)}
+
+    def remove_subtask_results(self, task_ids):
+        '''Remove results of subtasks with specified IDs'''
+        self._write([('DELETE FROM subtasks WHERE id=?', [(x,) for x in task_ids])])
+
+    def add_samples(self, task_id, samples):
+        '''Save resource samples of a task, which are (subtask, time, proc_cpu,
+        proc_mem, children, children_cpu, children_mem) with subtask '' for the
+        task itself, as a new chunk of the task and of each subtask'''
+        data = {}
+        for sample in samples:
+            data.setdefault(sample[0], []).append(sample[1:])
+        self._write([('''INSERT INTO samples VALUES (?, ?, (SELECT COALESCE(MAX(chunk) + 1, 0)
+            FROM samples WHERE task=? AND subtask=?), ?)''',
+            [(task_id, subtask, task_id, subtask, array('d', [x for col in zip(*rows) for x in col]).tobytes())
+                for subtask, rows in data.items()])])
+
+    def remove_samples(self, task_id):
+        '''Remove resource samples of a task and its subtasks'''
+        self._write([('DELETE FROM samples WHERE task=?', [(task_id,)])])
+
+    def get_samples(self, task_id, subtask=''):
+        '''Return resource samples of a task, or of a subtask of a master task, as
+        a dictionary of columns (time, proc_cpu, proc_mem, children, children_cpu,
+        children_mem) in the order of sampling time'''
+        n = len(_sample_fields)
+        columns = [array('d') for x in _sample_fields]
+        for rec in self.conn.execute('SELECT data FROM samples WHERE task=? AND subtask=? ORDER BY chunk',
+                (task_id, subtask)):
+            data = array('d')
+            data.frombytes(rec[0])
+            size = len(data) // n
+            for i, col in enumerate(columns):
+                col.extend(data[i * size:(i + 1) * size])
+        return {name: col.tolist() if name in ('time', 'proc_cpu', 'children_cpu') else
+            [int(x) for x in col] for name, col in zip(_sample_fields, columns)}
+
+    def summarize_samples(self, task_id, subtask=''):
+        '''Return a dictionary of start, end, number of samples, peak and average
+        cpu and memory usage (of the processes and their children) of a task or
+        of a subtask, or None if no sample has been saved'''
+        samples = self.get_samples(task_id, subtask)
+        if not samples['time']:
+            return None
+        cpu = [x + y for x, y in zip(samples['proc_cpu'], samples['children_cpu'])]
+        mem = [x + y for x, y in zip(samples['proc_mem'], samples['children_mem'])]
+        return {'start': samples['time'][0], 'end': samples['time'][-1], 'samples': len(cpu),
+            'nproc': max(samples['children']), 'peak_cpu': max(cpu), 'avg_cpu': sum(cpu) / len(cpu),
+            'peak_mem': max(mem), 'avg_mem': sum(mem) / len(mem)}
+
+    def data_version(self):
+        '''A number that changes when the database is changed by another connection'''
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+class TaskWatcher(object):
+    '''Watch for status changes of tasks so that task engines do not have to
+    poll the status of running tasks. Changes to task files (results written,
+    pulse files created or made read-only by kill) are reported by inotify
+    where it is available (Linux). Otherwise changes to the task database,
+    to which executing tasks publish their status transitions, are checked at
+    most once every poll_interval seconds.'''
+
+    # from sys/inotify.h
+    _IN_ATTRIB = 0x00000004
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_NONBLOCK = 0o4000
+    _event_header = struct.Struct('iIII')
+
+    def __init__(self, store=None, poll_interval=1):
+        self.store = task_store() if store is None else store
+        self.poll_interval = poll_interval
+        self._dirname = os.path.dirname(self.store.db_file)
+        self._fd = None
+        try:
+            self._fd = self._inotify()
+        except Exception as e:
+            env.logger.debug(f'Failed to watch {self._dirname} with inotify: {e}')
+        # tasks, or in the absence of inotify whether any task, changed but have
+        # not been reported by changed()
+        self._pending = set()
+        # tasks that have been reported since the last change of unknown tasks
+        self._reported = set()
+        if self._fd is None:
+            self._version = self.store.data_version()
+            self._last_poll = time.time()
+
+    def _inotify(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            return None
+        fd = libc.inotify_init1(self._IN_NONBLOCK)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        os.makedirs(self._dirname, exist_ok=True)
+        if libc.inotify_add_watch(fd, os.fsencode(self._dirname),
+                self._IN_ATTRIB | self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_CREATE) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+        return fd
+
+    def _changed_tasks(self):
+        changed = set()
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(buf):
+                _, mask, _, length = self._event_header.unpack_from(buf, pos)
+                pos += self._event_header.size
+                name = buf[pos:pos + length].rstrip(b'\0').decode(errors='ignore')
+                pos += length
+                if mask & self._IN_Q_OVERFLOW:
+                    # events are lost so any task might have changed
+                    changed.add(None)
+                elif name.endswith('.res'):
+                    if mask & (self._IN_CLOSE_WRITE | self._IN_MOVED_TO):
+                        changed.add(name[:-4])
+                elif name.endswith('.pulse'):
+                    # pulse files are created when tasks start, and are made read-only
+                    # when tasks are killed, but they are also touched regularly
+                    if mask & self._IN_CREATE or (mask & self._IN_ATTRIB and self._readonly(name)):
+                        changed.add(name[:-6])
+
+    def _readonly(self, name):
+        try:
+            return not os.stat(os.path.join(self._dirname, name)).st_mode & stat.S_IWUSR
+        except OSError:
+            return False
+
+    def _poll(self):
+        self._last_poll = time.time()
+        version = self.store.data_version()
+        if version != self._version:
+            self._version = version
+            self._pending.add(None)
+            self._reported.clear()
+        return bool(self._pending)
+
+    def changed(self, tasks=None):
+        '''Return True if the status of any or any of the specified tasks might
+        have changed since the last call. Changes of other tasks are reported
+        by later calls. This function does not block.'''
+        if self._fd is None:
+            if time.time() - self._last_poll >= self.poll_interval:
+                self._poll()
+        else:
+            changed = self._changed_tasks()
+            if None in changed:
+                self._reported.clear()
+            self._pending |= changed
+        if tasks is None:
+            changed = bool(self._pending)
+            self._pending.clear()
+            self._reported.clear()
+            return changed
+        tasks = set(tasks)
+        changed = bool(self._pending & tasks)
+        self._pending -= tasks
+        # None stands for changes of unknown tasks, which are reported by the
+        # task database or by an overflow of the inotify queue, and is kept
+        # until all tasks are checked so that each task is reported once
+        if None in self._pending and not tasks <= self._reported:
+            self._reported |= tasks
+            changed = True
+        return changed
+
+    def wait(self, timeout=None):
+        '''Block until there might be status changes, or until timeout. Return
+        False if nothing has changed.'''
+        if self._fd is not None:
+            import select
+            return bool(select.select([self._fd], [], [], timeout)[0])
+        time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+        return self._poll()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+_stores = {}
+
+
+def task_store():
+    '''Return the task database (~/.sos/tasks/tasks.db)'''
+    db_file = os.path.join(task_dir(), 'tasks.db')
+    if db_file not in _stores:
+        _stores[db_file] = TaskStore(db_file)
+    return _stores[db_file]
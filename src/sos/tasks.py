@@ -21,13 +21,16 @@
 #
 import os
 import sys
+import stat
+import json
 import pickle
 import time
 import copy
+import heapq
+import itertools
 import threading
 import lzma
-import random
-from io import StringIO
+from io import StringIO, BytesIO
 from tokenize import generate_tokens
 from collections.abc import Sequence, Mapping
 import concurrent.futures
@@ -39,7 +42,7 @@ from .eval import SoS_exec, SoS_eval, stmtHash, cfg_interpolate
 
 from .targets import textMD5, RuntimeInfo, Undetermined, file_target, UnknownTarget, remote, sos_step, sos_targets
 from .eval import interpolate
-from .monitor import ProcessMonitor
+from .task_store import task_store, task_files
 
 from collections import OrderedDict
 import subprocess
@@ -48,6 +51,93 @@ import subprocess
 monitor_interval = 5
 resource_monitor_interval = 60
 
+# pickled tasks smaller than _COMPRESS_SIZE are saved without compression, and
+# those larger than _LZMA_SIZE are compressed with lzma instead of zlib
+_COMPRESS_SIZE = 4096
+_LZMA_SIZE = 1024 * 1024
+
+# global definitions, scripts and variables of tasks that are larger than
+# _BLOB_SIZE after pickling are saved once under ~/.sos/tasks/blobs, named by
+# their hashes, and are referenced by task files
+_BLOB_SIZE = 4096
+
+def blob_dir():
+    return os.path.join(os.path.expanduser('~'), '.sos', 'tasks', 'blobs')
+
+def _select_compressor(size):
+    return 'none' if size < _COMPRESS_SIZE else ('zlib' if size < _LZMA_SIZE else 'lzma')
+
+def _compress(data, compressor):
+    if compressor == 'none':
+        return data
+    elif compressor == 'zlib':
+        import zlib
+        return zlib.compress(data)
+    elif compressor == 'lzma':
+        return lzma.compress(data)
+    raise ValueError(f'Unsupported compressor for task files: {compressor} (none, zlib, or lzma expected)')
+
+def _decompress(data, compressor):
+    if compressor == 'none':
+        return data
+    elif compressor == 'zlib':
+        import zlib
+        return zlib.decompress(data)
+    elif compressor == 'lzma':
+        return lzma.decompress(data)
+    raise ValueError(f'Unsupported compressor for task files: {compressor}')
+
+def _save_blob(data):
+    '''Save pickled data to a blob named by its hash if the blob does not exist,
+    and return a reference (hash, compressor) to the blob'''
+    import xxhash
+    compressor = _select_compressor(len(data))
+    blob = xxhash.xxh64(data).hexdigest()
+    blob_file = os.path.join(blob_dir(), blob)
+    if os.path.isfile(blob_file):
+        # mark the blob as used so that it is not purged
+        os.utime(blob_file, None)
+    else:
+        os.makedirs(blob_dir(), exist_ok=True)
+        # blobs could be saved by several processes at the same time
+        tmp_file = f'{blob_file}.{os.getpid()}'
+        with open(tmp_file, 'wb') as bf:
+            bf.write(_compress(data, compressor))
+        os.replace(tmp_file, blob_file)
+    return (blob, compressor)
+
+class _TaskPickler(pickle.Pickler):
+    '''Pickle tasks with large objects saved as blobs'''
+    def __init__(self, file, blobs):
+        super(_TaskPickler, self).__init__(file)
+        # id of objects: reference to blobs
+        self._blobs = blobs
+        self.used_blobs = set()
+
+    def persistent_id(self, obj):
+        ref = self._blobs.get(id(obj), None)
+        if ref is not None:
+            self.used_blobs.add(ref[0])
+        return ref
+
+class _TaskUnpickler(pickle.Unpickler):
+    '''Load tasks with large objects read from blobs'''
+    def __init__(self, file):
+        super(_TaskUnpickler, self).__init__(file)
+        # content of blobs, which are loaded as different objects if they are
+        # referenced multiple times (e.g. by subtasks of master tasks)
+        self._data = {}
+
+    def persistent_load(self, ref):
+        blob, compressor = ref
+        if blob not in self._data:
+            try:
+                with open(os.path.join(blob_dir(), blob), 'rb') as bf:
+                    self._data[blob] = _decompress(bf.read(), compressor)
+            except FileNotFoundError:
+                raise ValueError(f'Blob {blob} of task is not found under {blob_dir()}')
+        return pickle.loads(self._data[blob])
+
 class TaskParams(object):
     '''A parameter object that encaptulates parameters sending to
     task executors. This would makes the output of workers, especially
@@ -59,17 +149,62 @@ class TaskParams(object):
         self.sos_dict = sos_dict
         self.tags = sorted(list(set(tags)))
 
-    def save(self, job_file):
+    def header(self):
+        '''Step name, runtime options and length of critical path of the task,
+        which are saved in the header of task files'''
+        return {'step_name': self.sos_dict.get('step_name', ''), 'runtime': self.sos_dict.get('_runtime', {}),
+            'critical_path': self.sos_dict.get('__critical_path__', None)}
+
+    def _large_objects(self):
+        '''Global definition, script and variables of the task that could be saved
+        as blobs'''
+        return [self.global_def, self.task] + list(self.sos_dict.values())
+
+    def save(self, job_file, compressor=None, blob_cache=None):
+        '''Save the task in format SOSTASK1.3, namely a line of tags and a header
+        in json before the pickled task, which is saved without compression or
+        compressed with zlib or lzma. The compressor is selected by the size of
+        the pickled task unless it is specified by parameter compressor or by
+        configuration task_compressor. Large objects of the task are saved as
+        blobs, which are listed in the header. If a dictionary blob_cache is
+        specified, blobs of objects are saved to it by the id of the objects
+        (along with the objects so that their ids are not reused) so that objects
+        shared by tasks (e.g. of a step) are pickled only once.'''
+        # remove __builtins__ from sos_dict #835
+        if 'CONFIG' in self.sos_dict and '__builtins__' in self.sos_dict['CONFIG']:
+            self.sos_dict['CONFIG'].pop('__builtins__')
+        try:
+            blobs = {}
+            for obj in self._large_objects():
+                if id(obj) in blobs or obj is None or (isinstance(obj, str) and len(obj) < _BLOB_SIZE // 4):
+                    continue
+                if blob_cache is not None and id(obj) in blob_cache:
+                    blobs[id(obj)] = blob_cache[id(obj)][1]
+                    continue
+                data = pickle.dumps(obj)
+                if len(data) >= _BLOB_SIZE:
+                    blobs[id(obj)] = _save_blob(data)
+                    if blob_cache is not None:
+                        blob_cache[id(obj)] = (obj, blobs[id(obj)])
+            buf = BytesIO()
+            pickler = _TaskPickler(buf, blobs)
+            pickler.dump(self)
+            payload = buf.getvalue()
+        except Exception as e:
+            env.logger.warning(e)
+            raise
+        if compressor is None:
+            compressor = env.config.get('task_compressor', None)
+        if compressor in (None, 'auto'):
+            compressor = _select_compressor(len(payload))
+        payload = _compress(payload, compressor)
+        header = self.header()
+        header['compressor'] = compressor
+        header['blobs'] = sorted(pickler.used_blobs)
         with open(job_file, 'wb') as jf:
-            jf.write(f'SOSTASK1.2\n{" ".join(self.tags)}\n'.encode())
-            # remove __builtins__ from sos_dict #835
-            if 'CONFIG' in self.sos_dict and '__builtins__' in self.sos_dict['CONFIG']:
-                self.sos_dict['CONFIG'].pop('__builtins__')
-            try:
-                jf.write(lzma.compress(pickle.dumps(self)))
-            except Exception as e:
-                env.logger.warning(e)
-                raise
+            # objects such as paths are saved as strings in the header
+            jf.write(f'SOSTASK1.3\n{" ".join(self.tags)}\n{json.dumps(header, default=str)}\n'.encode())
+            jf.write(payload)
 
     def __repr__(self):
         return self.name
@@ -92,6 +227,10 @@ class MasterTaskParams(TaskParams):
     def num_tasks(self):
         return len(self.task_stack)
 
+    def _large_objects(self):
+        # objects shared by subtasks are saved once
+        return list(self.sos_dict.values()) + [y for x in self.task_stack for y in x[1]._large_objects()]
+
     def push(self, task_id, params):
         # update walltime, cores, and mem
         # right now we require all tasks to have same resource requirment, which is
@@ -102,10 +241,12 @@ class MasterTaskParams(TaskParams):
         # walltime
         if not self.task_stack:
             for key in ('walltime', 'max_walltime', 'cores', 'max_cores', 'mem', 'max_mem', 'map_vars',
-                        'name', 'cur_dir', 'home_dir', 'verbosity', 'sig_mode', 'run_mode'):
+                        'name', 'cur_dir', 'home_dir', 'verbosity', 'sig_mode', 'run_mode', 'priority'):
                 if key in params.sos_dict['_runtime'] and params.sos_dict['_runtime'][key] is not None:
                     self.sos_dict['_runtime'][key] = params.sos_dict['_runtime'][key]
             self.sos_dict['step_name'] = params.sos_dict['step_name']
+            if '__critical_path__' in params.sos_dict:
+                self.sos_dict['__critical_path__'] = params.sos_dict['__critical_path__']
             self.tags = params.tags
         else:
             for key in ('walltime', 'max_walltime', 'cores', 'max_cores', 'mem', 'max_mem',
@@ -154,9 +295,15 @@ class MasterTaskParams(TaskParams):
 def loadTask(filename):
     try:
         with open(filename, 'rb') as task:
+            header = ''
             try:
                 header = task.readline().decode()
-                if header.startswith('SOSTASK1.1'):
+                if header.startswith('SOSTASK1.3'):
+                    # ignore the tags
+                    task.readline()
+                    compressor = json.loads(task.readline().decode())['compressor']
+                    return _TaskUnpickler(BytesIO(_decompress(task.read(), compressor))).load()
+                elif header.startswith('SOSTASK1.1'):
                     # ignore the tags
                     task.readline()
                     return pickle.load(task)
@@ -171,6 +318,8 @@ def loadTask(filename):
                 else:
                     raise ValueError('Try old format')
             except:
+                if header.startswith('SOSTASK1.3'):
+                    raise
                 # old format
                 task.seek(0)
                 param = pickle.load(task)
@@ -182,6 +331,22 @@ def loadTask(filename):
             f'Failed to load task {os.path.basename(filename)}, which is likely caused by incompatible python modules between local and remote hosts: {e}')
 
 
+def loadTaskHeader(filename):
+    '''Return tags, step name, runtime options and length of critical path of a
+    task, which are read without loading the task from task files of format
+    SOSTASK1.3'''
+    with open(filename, 'rb') as task:
+        if task.readline().decode().startswith('SOSTASK1.3'):
+            tags = task.readline().decode().split()
+            header = json.loads(task.readline().decode())
+            header['tags'] = tags
+            return header
+    params = loadTask(filename)
+    header = params.header()
+    header['tags'] = params.tags
+    return header
+
+
 def addTags(filename, new_tags):
     with open(filename, 'rb') as task:
         header = task.readline()
@@ -213,6 +378,9 @@ def taskDuration(task):
 
 
 def taskTags(task):
+    rec = task_store().get(task)
+    if rec is not None and rec['tags'] is not None:
+        return rec['tags']
     filename = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', f'{task}.task')
     atime = os.path.getatime(filename)
     try:
@@ -295,8 +463,9 @@ def collect_task_result(task_id, sos_dict):
             'shared': {env.sos_dict['_index']: shared} }
 
 def execute_task(task_id, verbosity=None, runmode='run', sigmode=None, monitor_interval=5,
-    resource_monitor_interval=60):
-    res = _execute_task(task_id, verbosity, runmode, sigmode, monitor_interval, resource_monitor_interval)
+    resource_monitor_interval=60, monitors=None):
+    res = _execute_task(task_id, verbosity, runmode, sigmode, monitor_interval, resource_monitor_interval,
+        monitors)
     # write result file
     res_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.res')
     with open(res_file, 'wb') as res_file:
@@ -304,14 +473,54 @@ def execute_task(task_id, verbosity=None, runmode='run', sigmode=None, monitor_i
     if res['ret_code'] != 0 and 'exception' in res:
         with open(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.err'), 'a') as err:
             err.write(f'Task {task_id} exits with code {res["ret_code"]}')
+    from .monitor import summarizeResources
+    resources = summarizeResources(task_id)
+    task_store().update(task_id, status='completed' if res['ret_code'] == 0 else 'failed',
+        task_mtime=os.path.getmtime(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.task')),
+        completed=time.time(), ret_code=res['ret_code'],
+        peak_cpu=resources['peak_cpu'] if resources else None,
+        peak_mem=resources['peak_mem'] if resources else None)
     return res['ret_code']
 
+# a queue through which workers of master tasks report subtasks they execute
+# to the monitor of the master task
+_subtask_queue = None
+
+
+def _init_subtask_worker(queue):
+    global _subtask_queue
+    _subtask_queue = queue
+
+
+def _subtask_limits(params):
+    '''max_walltime, max_mem and max_procs of a subtask'''
+    runtime = params.sos_dict.get('_runtime', None) or {}
+    return {x: runtime.get(x, None) for x in ('max_walltime', 'max_mem', 'max_procs')}
+
+
+def _execute_subtask(args):
+    '''Execute a subtask of a master task in a worker process'''
+    _subtask_queue.put((os.getpid(), args[0][0], _subtask_limits(args[0][1]), time.time()))
+    try:
+        return _execute_task(*args)
+    finally:
+        _subtask_queue.put((os.getpid(), None))
+
+def _publish_running(task_id, task_file, step_name=None):
+    '''Record that a task is being executed by the current process'''
+    import socket
+    task_store().update(task_id, status='running', task_mtime=os.path.getmtime(task_file),
+        started=time.time(), pid=os.getpid(), hostname=socket.gethostname(), step=step_name)
+
 def _execute_task(task_id, verbosity=None, runmode='run', sigmode=None, monitor_interval=5,
-    resource_monitor_interval=60):
+    resource_monitor_interval=60, monitors=None):
     '''A function that execute specified task within a local dictionary
     (from SoS env.sos_dict). This function should be self-contained in that
     it can be handled by a task manager, be executed locally in a separate
-    process or remotely on a different machine.'''
+    process or remotely on a different machine. If a list monitors is
+    specified, the task is executed by a worker of a process pool, and the
+    monitor of the task, which kills only child processes of the worker, is
+    appended to it so that it can be stopped after the task is completed.'''
     # start a monitoring file, which would be killed after the job
     # is done (killed etc)
     if isinstance(task_id, str):
@@ -325,14 +534,34 @@ def _execute_task(task_id, verbosity=None, runmode='run', sigmode=None, monitor_
         env.logger.trace(f'Executing subtask {task_id}')
 
     if hasattr(params, 'task_stack'):
-        # pulse thread
+        _publish_running(task_id, task_file, params.sos_dict.get('step_name', None))
+        from .monitor import ProcessMonitor
+        # pulse thread, which also monitors subtasks executed by this process
+        # and its child processes, with samples of all subtasks written to the
+        # pulse file of the master task
         m = ProcessMonitor(task_id, monitor_interval=monitor_interval,
             resource_monitor_interval=resource_monitor_interval,
             max_walltime=params.sos_dict['_runtime'].get('max_walltime', None),
             max_mem=params.sos_dict['_runtime'].get('max_mem', None),
-            max_procs=params.sos_dict['_runtime'].get('max_procs', None))
+            max_procs=params.sos_dict['_runtime'].get('max_procs', None),
+            pooled=monitors is not None)
+        if monitors is not None:
+            monitors.append(m)
         m.start()
 
+        # subtasks completed by previous executions of the master task (e.g. one
+        # that was killed for exceeding walltime) are not executed again
+        store = task_store()
+        subtask_ids = [x[0] for x in params.task_stack]
+        if (sigmode or env.config.get('sig_mode', 'default')) == 'force':
+            store.remove_subtask_results(subtask_ids)
+            completed = {}
+        else:
+            completed = store.get_subtask_results(subtask_ids)
+            if completed:
+                env.logger.info(f'{task_id} skips {len(completed)} completed subtask{"s" if len(completed) > 1 else ""}')
+        pending = [x for x in params.task_stack if x[0] not in completed]
+
         master_out = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.out')
         master_err = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.err')
         # if this is a master task, calling each sub task
@@ -353,37 +582,44 @@ def _execute_task(task_id, verbosity=None, runmode='run', sigmode=None, monitor_
                     with open(sub_err, 'rb') as serr:
                         err.write(serr.read())
 
-            if params.num_workers > 1:
+            def save_result(result):
+                # results are saved as soon as subtasks are completed
+                copy_out_and_err(result)
+                if result['ret_code'] == 0:
+                    store.add_subtask_result(task_id, result)
+                results[result['task']] = result
+
+            results = {}
+            for res in completed.values():
+                copy_out_and_err(res)
+                results[res['task']] = res
+            if params.num_workers > 1 and len(pending) > 1:
                 from multiprocessing.pool import Pool
-                p = Pool(params.num_workers)
-                results = []
-                for t in params.task_stack:
-                    results.append(p.apply_async(_execute_task, (t, verbosity, runmode,
-                        sigmode, monitor_interval, resource_monitor_interval), callback=copy_out_and_err))
-                for idx,r in enumerate(results):
-                    results[idx] = r.get()
-                p.close()
-                p.join()
-                # we wait for all results to be ready to return or raise
-                # but we only raise exception for one of the subtasks
-                for res in results:
-                    if 'exception' in res:
-                        failed = [x.get("task", "") for x in results if "exception" in x]
-                        env.logger.error(f'{task_id} ``failed`` due to failure of subtask{"s" if len(failed) > 1 else ""} {", ".join(failed)}')
-                        return {'ret_code': 1, 'exception': res['exception'], 'task': task_id }
+                # workers take the next subtask when they complete one
+                p = Pool(min(params.num_workers, len(pending)), initializer=_init_subtask_worker,
+                    initargs=(m.subtask_queue(),))
+                try:
+                    for res in p.imap_unordered(_execute_subtask, [(t, verbosity, runmode,
+                            sigmode, monitor_interval, resource_monitor_interval) for t in pending]):
+                        save_result(res)
+                finally:
+                    p.close()
+                    p.join()
             else:
-                results = []
-                for tid, tdef in params.task_stack:
-                    res = _execute_task((tid, tdef), verbosity=verbosity, runmode=runmode,
+                for tid, tdef in pending:
+                    m.register_subtask(os.getpid(), tid, _subtask_limits(tdef))
+                    save_result(_execute_task((tid, tdef), verbosity=verbosity, runmode=runmode,
                         sigmode=sigmode, monitor_interval=monitor_interval,
-                        resource_monitor_interval=resource_monitor_interval)
-                    copy_out_and_err(res)
-                    results.append(res)
-                for res in results:
-                    if 'exception' in res:
-                        failed = [x.get("task", "") for x in results if "exception" in x]
-                        env.logger.error(f'{task_id} ``failed`` due to failure of subtask{"s" if len(failed) > 1 else ""} {", ".join(failed)}')
-                        return {'ret_code': 1, 'exception': res['exception'], 'task': task_id}
+                        resource_monitor_interval=resource_monitor_interval))
+                m.register_subtask(os.getpid(), None)
+            results = [results[x] for x in subtask_ids]
+            # we wait for all results to be ready to return or raise
+            # but we only raise exception for one of the subtasks
+            for res in results:
+                if 'exception' in res:
+                    failed = [x.get("task", "") for x in results if "exception" in x]
+                    env.logger.error(f'{task_id} ``failed`` due to failure of subtask{"s" if len(failed) > 1 else ""} {", ".join(failed)}')
+                    return {'ret_code': 1, 'exception': res['exception'], 'task': task_id}
         #
         # now we collect result
         all_res = {'ret_code': 0, 'output': {}, 'subtasks': {}, 'shared': {}}
@@ -392,6 +628,8 @@ def _execute_task(task_id, verbosity=None, runmode='run', sigmode=None, monitor_
             all_res['output'].update(x['output'])
             all_res['subtasks'][tid[0]] = x
             all_res['shared'].update(x['shared'])
+        # results of subtasks are now saved with the result of the master task
+        store.remove_subtask_results(subtask_ids)
         return all_res
 
     global_def, task, sos_dict = params.global_def, params.task, params.sos_dict
@@ -427,14 +665,19 @@ del sos_handle_parameter_
     if '_runtime' not in sos_dict:
         sos_dict['_runtime'] = {}
 
-    # pulse thread
-    m = ProcessMonitor(task_id, monitor_interval=monitor_interval,
-        resource_monitor_interval=resource_monitor_interval,
-        max_walltime=sos_dict['_runtime'].get('max_walltime', None),
-        max_mem=sos_dict['_runtime'].get('max_mem', None),
-        max_procs=sos_dict['_runtime'].get('max_procs', None))
-
-    m.start()
+    # pulse thread. Subtasks are monitored, and limited to their max_walltime,
+    # max_mem, and max_procs, by their master tasks.
+    if not subtask:
+        from .monitor import ProcessMonitor
+        m = ProcessMonitor(task_id, monitor_interval=monitor_interval,
+            resource_monitor_interval=resource_monitor_interval,
+            max_walltime=sos_dict['_runtime'].get('max_walltime', None),
+            max_mem=sos_dict['_runtime'].get('max_mem', None),
+            max_procs=sos_dict['_runtime'].get('max_procs', None),
+            pooled=monitors is not None)
+        if monitors is not None:
+            monitors.append(m)
+        m.start()
     if sigmode is not None:
         env.config['sig_mode'] = sigmode
     env.config['run_mode'] = runmode
@@ -518,7 +761,9 @@ del sos_handle_parameter_
     # execution duration.
     if not subtask:
         os.utime(task_file, None)
+        _publish_running(task_id, task_file, sos_dict.get('step_name', None))
 
+    start_time = time.time()
     try:
         # go to 'cur_dir'
         if '_runtime' in sos_dict and 'cur_dir' in sos_dict['_runtime']:
@@ -659,16 +904,76 @@ del sos_handle_parameter_
 
     # the final result should be relative to cur_dir, not workdir
     # because output is defined outside of task
-    return collect_task_result(task_id, sos_dict)
+    res = collect_task_result(task_id, sos_dict)
+    # durations of tasks are used to size trunks of tasks of the step
+    res['duration'] = time.time() - start_time
+    return res
 
-def check_task(task):
+def check_task(task, rec=False):
     #
     # status of the job, please refer to https://github.com/vatlab/SOS/issues/529
     # for details.
     #
+    # Status of tasks is answered from the task database if the task has a record,
+    # except for completed tasks, which are checked for signatures of their input,
+    # output, and dependent files (status signature-mismatch).
+    #
     task_file =  os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task + '.task')
-    if not os.path.isfile(task_file):
+    try:
+        task_mtime = os.path.getmtime(task_file)
+    except OSError:
         return 'missing'
+    # the record is only valid for the current task file (not resubmitted or
+    # copied from elsewhere). Records can be passed if they have been retrieved
+    # in batch.
+    if rec is False:
+        rec = task_store().get(task)
+    alive = None
+    if rec is not None and rec['status'] is not None and rec['task_mtime'] == task_mtime:
+        if rec['status'] in ('pending', 'submitted', 'failed', 'aborted'):
+            return rec['status']
+        if rec['status'] == 'running':
+            alive = _is_alive(rec)
+            if alive:
+                return 'running'
+    status = _check_task_files(task, task_file)
+    if status in ('pending', 'submitted', 'running') and alive is False:
+        # the process died, or was killed, without writing a result file,
+        # possibly before its pulse file was updated
+        status = 'aborted'
+    if status in ('completed', 'failed', 'aborted') and (rec is None or rec['status'] != status
+        or rec['task_mtime'] != task_mtime):
+        task_store().update(task, status=status, task_mtime=task_mtime)
+    return status
+
+def _is_alive(rec):
+    '''Check if a running task is still being executed, by the process that
+    published its status. Return False if the process has died or is being
+    killed, and None if this cannot be determined from the current host.'''
+    import socket
+    if not rec['pid'] or rec['hostname'] != socket.gethostname():
+        return None
+    try:
+        os.kill(rec['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # a killed task has its pulse file set to read-only, and a task could be
+    # stuck if its pulse file is not updated
+    pulse_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', rec['id'] + '.pulse')
+    try:
+        st = os.stat(pulse_file)
+    except OSError:
+        return None
+    if not st.st_mode & stat.S_IWUSR:
+        return False
+    if time.time() - st.st_mtime > 2 * monitor_interval:
+        return None
+    return True
+
+def _check_task_files(task, task_file):
+    '''Determine status of a task from modification times of its files'''
     pulse_file =  os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task + '.pulse')
     if not os.path.isfile(pulse_file):
         pulse_file =  os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task + '.status')
@@ -686,77 +991,90 @@ def check_task(task):
     def has_job():
         return os.path.isfile(job_file) and os.stat(job_file).st_mtime >= os.stat(task_file).st_mtime
 
-    if has_res():
+    def res_status():
+        # status from the result file, or None if the result file does not exist
+        # or is being written
+        if not has_res():
+            return None
         try:
-            from .targets import file_target
             with open(res_file, 'rb') as result:
                 res = pickle.load(result)
-            if ('ret_code' in res and res['ret_code'] == 0) or ('succ' in res and res['succ'] == 0):
-                for var in ('input', 'output', 'depends'):
-                    if var not in res or not isinstance(res[var], dict):
-                        continue
-                    for x,y in res[var].items():
-                        if not file_target(x).target_exists() or file_target(x).target_signature() != y:
-                            env.logger.debug(f'{x} not found or signature mismatch')
-                            return 'signature-mismatch'
-                return 'completed'
-            else:
-                return 'failed'
         except Exception as e:
-            # sometimes the resfile is changed while we are reading it
-            # so we wait a bit and try again.
-            env.logger.warning(e)
-            time.sleep(.5)
-            return check_task(task)
+            env.logger.debug(f'Failed to read result of task {task}: {e}')
+            return None
+        if ('ret_code' in res and res['ret_code'] == 0) or ('succ' in res and res['succ'] == 0):
+            from .targets import file_target
+            for var in ('input', 'output', 'depends'):
+                if var not in res or not isinstance(res[var], dict):
+                    continue
+                for x,y in res[var].items():
+                    if not file_target(x).target_exists() or file_target(x).target_signature() != y:
+                        env.logger.debug(f'{x} not found or signature mismatch')
+                        return 'signature-mismatch'
+            return 'completed'
+        else:
+            return 'failed'
+
+    status = res_status()
+    if status is not None:
+        return status
     #
     if has_pulse():
         # dead?
         # if the status file is readonly
-        if not os.access(pulse_file, os.W_OK):
+        if not os.stat(pulse_file).st_mode & stat.S_IWUSR:
             return 'aborted'
         start_stamp = os.stat(pulse_file).st_mtime
         elapsed = time.time() - start_stamp
         if elapsed < 0:
             env.logger.warning(f'{pulse_file} is created in the future. Your system time might be problematic')
-        # if the file is within 5 seconds
-        if elapsed < monitor_interval:
+        # the pulse file is updated every monitor_interval seconds, and we allow
+        # one missing update (e.g. a slow file system) before considering the
+        # task dead, instead of waiting for the next update
+        if elapsed <= 2 * monitor_interval:
             return 'running'
-        elif elapsed > 2 * monitor_interval:
-            if has_res():
-                # result file appears during sos tatus run
-                return check_task(task)
-            else:
-                return 'aborted'
-        # otherwise, let us be patient ... perhaps there is some problem with the filesystem etc
-        time.sleep(2 * monitor_interval)
-        end_stamp = os.stat(pulse_file).st_mtime
-        # the process is still alive
-        if has_res():
-            return check_task(task)
-        elif start_stamp != end_stamp:
-            return 'running'
-        else:
-            return 'aborted'
+        # result file appears during sos tatus run
+        status = res_status()
+        return 'aborted' if status is None else status
     # if there is no status file
     if has_job():
         return 'submitted'
     else:
         return 'pending'
 
-def check_tasks(tasks, verbosity=1, html=False, start_time=False, age=None, tags=None, status=None):
-    # verbose is ignored for now
-    import glob
+def match_tasks(tasks=None):
+    '''Return (ID, modification time of task file) of all tasks, or tasks with
+    IDs starting with any of the specified IDs, from the task database. Task
+    files that are not in the database (e.g. copied from other hosts) are
+    looked up and indexed if no indexed task matches an ID.'''
+    store = task_store()
+    if not tasks:
+        return [(x[0], x[1]) for x in store.match()]
+    all_tasks = []
+    for t in tasks:
+        matched = [(x[0], x[1]) for x in store.match([t])]
+        if not matched:
+            import glob
+            matched = [(os.path.basename(x)[:-5], os.path.getmtime(x)) for x in
+                glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', f'{glob.escape(t)}*.task'))]
+            for task_id, task_mtime in matched:
+                store.update(task_id, status=None, task_mtime=task_mtime)
+        all_tasks.extend(matched)
+    return all_tasks
+
+def query_task_status(tasks=None, age=None, tags=None, status=None):
+    '''Return a list of (ID, modification time of task file, status) of all or
+    specified tasks, sorted by modification time. Specified tasks that do not
+    exist are returned with time None and status missing.'''
     from multiprocessing.pool import ThreadPool as Pool
     if not tasks:
-        tasks = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', '*.task'))
-        all_tasks = [(os.path.basename(x)[:-5], os.path.getmtime(x)) for x in tasks]
+        all_tasks = match_tasks()
         if not all_tasks:
-            return
+            return []
     else:
         all_tasks = []
         for t in tasks:
-            matched = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', f'{t}*.task'))
-            matched = [(os.path.basename(x)[:-5], os.path.getmtime(x)) for x in matched]
+            matched = match_tasks([t])
             if not matched:
                 all_tasks.append((t, None))
             else:
@@ -774,14 +1092,115 @@ def check_tasks(tasks, verbosity=1, html=False, start_time=False, age=None, tags
         all_tasks = [x for x in all_tasks if any(x in tags for x in taskTags(x[0]).split(' '))]
 
     if not all_tasks:
-        env.logger.info('No matching tasks')
+        return []
+    records = task_store().get_tasks([x[0] for x in all_tasks])
+    if len(all_tasks) == 1:
+        obtained_status = [check_task(all_tasks[0][0], records.get(all_tasks[0][0], None))]
+    else:
+        # at most 20 threads
+        with Pool(min(20, len(all_tasks))) as p:
+            obtained_status = p.starmap(check_task, [(x[0], records.get(x[0], None)) for x in all_tasks])
+    if not tasks:
+        # indexed tasks with task files removed
+        missing = [x[0] for x, s in zip(all_tasks, obtained_status) if s == 'missing']
+        if missing:
+            task_store().remove(missing)
+    return [(t, d, s) for (t, d), s in zip(all_tasks, obtained_status)
+        if (tasks or s != 'missing') and (not status or s in status)]
+
+def _percentile(values, q):
+    '''The q-th percentile of sorted values, with linear interpolation'''
+    k = (len(values) - 1) * q / 100.
+    f = int(k)
+    if f + 1 >= len(values):
+        return values[-1]
+    return values[f] + (values[f + 1] - values[f]) * (k - f)
+
+def summarize_tasks(task_status):
+    '''Print percentiles (50%, 90% and max) of run time, peak memory and peak
+    cpu use of completed and failed tasks, grouped by steps and by tags. The
+    summaries are calculated from records of the task database so that no
+    task or pulse file is read.'''
+    records = task_store().get_tasks(t for t, d, s in task_status if s in ('completed', 'failed'))
+    groups = OrderedDict()
+    for rec in sorted(records.values(), key=lambda x: x['started'] or 0):
+        if rec['started'] is None or rec['completed'] is None:
+            # tasks that are not executed or are executed by other versions of sos
+            continue
+        keys = [('step', rec['step'])] if rec['step'] else []
+        keys.extend(('tag', x) for x in (rec['tags'] or '').split())
+        for key in keys:
+            groups.setdefault(key, []).append(rec)
+    if not groups:
+        env.logger.info('No resource usage is recorded for matching tasks')
         return
-    # at most 20 threads
-    p = Pool(min(20, len(all_tasks)))
-    obtained_status = p.map(check_task, [x[0] for x in all_tasks])
-    if status:
-        all_tasks = [x for x, s in zip(all_tasks, obtained_status) if s in status]
-        obtained_status = [x for x in obtained_status if x in status]
+
+    def percentiles(values, fmt):
+        values = sorted(x for x in values if x is not None)
+        if not values:
+            return ['-'] * 3
+        return [fmt(_percentile(values, q)) for q in (50, 90, 100)]
+
+    print('\t'.join(['group', 'name', 'tasks', 'time_50%', 'time_90%', 'time_max',
+        'mem_50%', 'mem_90%', 'mem_max', 'cpu_50%', 'cpu_90%', 'cpu_max']))
+    for (group, name), recs in sorted(groups.items(), key=lambda x: x[0]):
+        print('\t'.join([group, name, str(len(recs))] +
+            percentiles([x['completed'] - x['started'] for x in recs], lambda v: format_HHMMSS(int(v))) +
+            percentiles([x['peak_mem'] for x in recs], lambda v: f'{v/1024/1024:.1f}Mb') +
+            percentiles([x['peak_cpu'] for x in recs], lambda v: f'{v:.1f}')))
+
+def _resource_samples(task):
+    '''Return time, cpu and memory (M) use of a task from samples in the task
+    database, or from its pulse file if no sample is saved there'''
+    # A sample of 400 point should be enough to show the change of resources
+    samples = task_store().get_samples(task)
+    if samples['time']:
+        step = max(len(samples['time']) // 400, 1)
+        return samples['time'][::step], \
+            [x + y for x, y in zip(samples['proc_cpu'][::step], samples['children_cpu'][::step])], \
+            [x / 1e6 + y / 1e6 for x, y in zip(samples['proc_mem'][::step], samples['children_mem'][::step])]
+    pulse_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task + '.pulse')
+    if not os.path.isfile(pulse_file):
+        return [], [], []
+    lines = sample_of_file(pulse_file, 400).splitlines()
+    # read the pulse file and plot it
+    #time   proc_cpu        proc_mem        children        children_cpu    children_mem
+    etime = []
+    cpu = []
+    mem = []
+    try:
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.split()
+            if len(fields) > 6:
+                # sample of a subtask
+                continue
+            etime.append(float(fields[0]))
+            cpu.append(float(fields[1]) + float(fields[4]))
+            mem.append(float(fields[2]) / 1e6 + float(fields[5]) / 1e6)
+    except Exception:
+        return [], [], []
+    return etime, cpu, mem
+
+def check_tasks(tasks, verbosity=1, html=False, start_time=False, age=None, tags=None, status=None,
+    json=False, stats=False):
+    # verbose is ignored for now
+    task_status = query_task_status(tasks, age=age, tags=tags, status=status)
+    if not task_status:
+        if tasks or age is not None or tags or status:
+            env.logger.info('No matching tasks')
+        return
+    if json:
+        import json as jsonlib
+        print(jsonlib.dumps([{'id': t, 'status': s, 'time': d, 'tags': taskTags(t) if d is not None else ''}
+            for t, d, s in task_status]))
+        return
+    if stats:
+        summarize_tasks(task_status)
+        return
+    all_tasks = [(t, d) for t, d, s in task_status]
+    obtained_status = [s for t, d, s in task_status]
     #
     # automatically remove non-running tasks that are more than 30 days old
     to_be_removed = []
@@ -850,9 +1269,16 @@ def check_tasks(tasks, verbosity=1, html=False, start_time=False, age=None, tags
             print()
             print('EXECUTION STATS:\n================')
             print(summarizeExecution(t, status=s))
+            if verbosity == 4 and hasattr(params, 'task_stack'):
+                # resources used by subtasks are recorded by the master task
+                for tid, _ in params.task_stack:
+                    summary = summarizeExecution(t, status=s, subtask=tid)
+                    if summary:
+                        print()
+                        print(summary)
             if verbosity == 4:
                 # if there are other files such as job file, print them.
-                files = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', t + '.*'))
+                files = task_files(t)
                 for f in sorted([x for x in files if os.path.splitext(x)[-1] not in ('.res',
                     '.task', '.pulse', '.status', '.def')]):
                     print(f'{os.path.basename(f)}:\n{"="*(len(os.path.basename(f))+1)}')
@@ -922,7 +1348,7 @@ def check_tasks(tasks, verbosity=1, html=False, start_time=False, age=None, tags
                 # this is a placeholder for the frontend to draw figure
                 row(td=f'<div id="res_{t}"></div>')
             #
-            files = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', t + '.*'))
+            files = task_files(t)
             for f in sorted([x for x in files if os.path.splitext(x)[-1] not in ('.def', '.res', '.task', '.pulse', '.status')]):
                 numLines = linecount_of_file(f)
                 row(os.path.splitext(f)[-1], '(empty)' if numLines == 0 else f'{numLines} lines{"" if numLines < 200 else " (showing last 200)"}')
@@ -933,30 +1359,8 @@ def check_tasks(tasks, verbosity=1, html=False, start_time=False, age=None, tags
             print('</table>')
             #
             # supplement run time information
-            pulse_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', t + '.pulse')
-            if not os.path.isfile(pulse_file):
-                return
-            else:
-                # A sample of 400 point should be enough to show the change of resources
-                lines = sample_of_file(pulse_file, 400).splitlines()
-                if len(lines) <= 2:
-                    return
-            # read the pulse file and plot it
-            #time   proc_cpu        proc_mem        children        children_cpu    children_mem
-            try:
-                etime = []
-                cpu = []
-                mem = []
-                for line in lines:
-                    if line.startswith('#') or not line.strip():
-                        continue
-                    fields = line.split()
-                    etime.append(float(fields[0]))
-                    cpu.append(float(fields[1]) + float(fields[4]))
-                    mem.append(float(fields[2]) / 1e6 + float(fields[5]) / 1e6)
-                if not etime:
-                    return
-            except Exception:
+            etime, cpu, mem = _resource_samples(t)
+            if not etime:
                 return
             #
             print('''
@@ -1054,16 +1458,13 @@ showResourceFigure_''' + t + '''()
 
 def kill_tasks(tasks, tags=None):
     #
-    import glob
     from multiprocessing.pool import ThreadPool as Pool
     if not tasks:
-        tasks = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', '*.task'))
-        all_tasks = [os.path.basename(x)[:-5] for x in tasks]
+        all_tasks = [x[0] for x in match_tasks()]
     else:
         all_tasks = []
         for t in tasks:
-            matched = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', f'{t}*.task'))
-            matched = [os.path.basename(x)[:-5] for x in matched]
+            matched = [x[0] for x in match_tasks([t])]
             if not matched:
                 env.logger.warning(f'{t} does not match any existing task')
             else:
@@ -1089,6 +1490,8 @@ def kill_task(task):
     if os.path.isfile(job_file):
         try:
             os.remove(job_file)
+            if status == 'submitted':
+                task_store().update(task, status='pending')
         except Exception:
             pass
     if status != 'running':
@@ -1100,18 +1503,42 @@ def kill_task(task):
     return 'killed'
 
 
+def _purge_blobs(subdirs, verbosity=2):
+    '''Remove blobs that are not referenced by any task file, except for those
+    that are recently saved or used, which could be referenced by tasks that
+    are being saved'''
+    if not os.path.isdir(blob_dir()):
+        return
+    import glob
+    referenced = set()
+    for dirname in [os.path.join(os.path.expanduser('~'), '.sos', 'tasks')] + \
+        [os.path.join(os.path.expanduser('~'), '.sos', 'tasks', x) for x in subdirs]:
+        for task_file in glob.glob(os.path.join(dirname, '*.def')) + glob.glob(os.path.join(dirname, '*.task')):
+            try:
+                with open(task_file, 'rb') as task:
+                    if not task.readline().decode().startswith('SOSTASK1.3'):
+                        continue
+                    task.readline()
+                    referenced |= set(json.loads(task.readline().decode()).get('blobs', []))
+            except Exception as e:
+                env.logger.debug(f'Failed to read blobs of {task_file}: {e}')
+    count = 0
+    for entry in os.scandir(blob_dir()):
+        if entry.name in referenced or time.time() - entry.stat().st_mtime < 600:
+            continue
+        try:
+            os.remove(entry.path)
+            count += 1
+        except Exception as e:
+            if verbosity > 0:
+                env.logger.warning(f'Failed to remove blob {entry.name}: {e}')
+    if count > 0 and verbosity > 1:
+        env.logger.info(f'{count} unused blob{"s are" if count > 1 else " is"} removed.')
+
 def purge_tasks(tasks, purge_all=False, age=None, status=None, tags=None, verbosity=2):
     # verbose is ignored for now
     import glob
-    if tasks:
-        all_tasks = []
-        for t in tasks:
-            matched = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', f'{t}*.task'))
-            matched = [(os.path.basename(x)[:-5], os.path.getmtime(x)) for x in matched]
-            all_tasks.extend(matched)
-    else:
-        tasks = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', '*.task'))
-        all_tasks = [(os.path.basename(x)[:-5], os.path.getmtime(x)) for x in tasks]
+    all_tasks = match_tasks(tasks)
     #
     if age is not None:
         age = expand_time(age, default_unit='d')
@@ -1134,18 +1561,12 @@ def purge_tasks(tasks, purge_all=False, age=None, status=None, tags=None, verbos
     all_tasks = set([x[0] for x in all_tasks])
     if all_tasks:
         #
-        # find all related files, including those in nested directories
-        from collections import defaultdict
-        to_be_removed = defaultdict(list)
-        for dirname, _, filelist in os.walk(os.path.join(os.path.expanduser('~'), '.sos', 'tasks')):
-            for f in filelist:
-                ID = os.path.basename(f).split('.', 1)[0]
-                if ID in all_tasks:
-                    to_be_removed[ID].append(os.path.join(dirname, f))
+        # find all related files, including those in directories of hosts
+        subdirs = [x.name for x in os.scandir(os.path.join(os.path.expanduser('~'), '.sos', 'tasks')) if x.is_dir()]
         #
         for task in all_tasks:
             removed = True
-            for f in to_be_removed[task]:
+            for f in task_files(task, subdirs):
                 try:
                     if verbosity > 3:
                         env.logger.trace(f'Remove {f}')
@@ -1156,12 +1577,17 @@ def purge_tasks(tasks, purge_all=False, age=None, status=None, tags=None, verbos
                         env.logger.warning(f'Failed to purge task {task[0]}')
             if removed and verbosity > 1:
                 env.logger.info(f'Task ``{task}`` removed.')
+        task_store().remove(all_tasks)
+        _purge_blobs(subdirs, verbosity)
     elif verbosity > 1:
         env.logger.info('No matching tasks')
     if purge_all:
         matched = glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', '*'))
         count = 0
+        task_store().clear()
         for f in matched:
+            if os.path.basename(f).startswith('tasks.db'):
+                continue
             if os.path.isdir(f):
                 import shutil
                 try:
@@ -1198,9 +1624,20 @@ class TaskEngine(threading.Thread):
         self.alias = self.config['alias']
 
         self.engine_ready = threading.Event()
+        # all states of the engine are protected by a lock, and the engine
+        # thread waits on a condition that is notified when tasks are submitted,
+        # killed, resumed, and when submissions and status checks complete
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
 
         self.running_tasks = []
-        self.pending_tasks = []
+        # pending tasks with the order in which they are submitted, and a heap
+        # of (negated priority and length of critical path, order, task) from
+        # which they are dispatched. Entries of tasks that are no longer pending,
+        # or are pending again with another order, are skipped.
+        self.pending_tasks = {}
+        self._pending_queue = []
+        self._pending_order = itertools.count()
         self.submitting_tasks = {}
         self.canceled_tasks = []
         self.resuming_tasks = set()
@@ -1223,14 +1660,24 @@ class TaskEngine(threading.Thread):
             # default
             self.max_running_jobs = max(os.cpu_count() // 2, 1)
         #
-        # multiple thread job submission does not work because the threads share the
-        # same namespace with variables such as sos_dict. Variables changed by
-        # one thread can be changed again by another thread, which makes it unsafe
-        # to submit jobs this way. Multi-processing is possible but that can be done
-        # later.
+        # batches of tasks are prepared (e.g. copied to remote hosts) and submitted
+        # concurrently by up to max_submitting_jobs threads. Submissions do not
+        # change the shared sos_dict, and read the runtime options of tasks from
+        # their definitions.
         #
-        self._thread_workers = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        if 'max_submitting_jobs' in self.config:
+            self.max_submitting_jobs = max(int(self.config['max_submitting_jobs']), 1)
+        else:
+            self.max_submitting_jobs = min(self.max_running_jobs, 4)
+        self._thread_workers = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_submitting_jobs)
+        # status checks do not wait for submissions
+        self._status_worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         self._status_checker = None
+        # status changes of tasks executed on this host are watched so that
+        # they can be checked without waiting for status_check_interval
+        self._status_changed = False
+        self._woken = False
+        self._stopped = False
         #
         if env.config['wait_for_task'] is not None:
             self.wait_for_task = env.config['wait_for_task']
@@ -1244,6 +1691,19 @@ class TaskEngine(threading.Thread):
         # allows stacking of up to 1000 tasks, but PBS queue does not
         # allow stacking.
         self.batch_size = 1
+        #
+        # engines that know the cores and memory of the host (max_cores
+        # and max_mem) admit tasks according to the resources they request
+        self.max_cores = None
+        self.max_mem = None
+        self._resources = {}
+        # pending tasks are submitted in the order of their priorities and
+        # lengths of critical paths of their steps
+        self._priorities = {}
+        # the first pending task that does not fit, and tasks that have been
+        # backfilled while it waits
+        self._blocked_task = None
+        self._backfilled = set()
 
     def notify(self, msg):
         # GUI ...
@@ -1258,17 +1718,17 @@ class TaskEngine(threading.Thread):
         '''Start monitoring specified or all tasks'''
         self.engine_ready.wait()
 
-        if not tasks:
-            tasks = self.task_status.keys()
-        else:
-            tasks = [x for x in tasks if x in self.task_status]
-
         # we only monitor running tasks
-        with threading.Lock():
+        with self._lock:
+            if not tasks:
+                tasks = list(self.task_status.keys())
+            else:
+                tasks = [x for x in tasks if x in self.task_status]
             for task in tasks:
                 if self.task_status[task] in ('submitted', 'running') and not task in self.running_tasks:
                     # these tasks will be actively monitored
                     self.running_tasks.append(task)
+            self._cond.notify_all()
         #
         if age is not None:
             age = expand_time(age, default_unit='d')
@@ -1279,118 +1739,286 @@ class TaskEngine(threading.Thread):
                 key=lambda x: -x[2])
 
     def get_tasks(self):
-        with threading.Lock():
-            pending = copy.deepcopy(self.pending_tasks + list(self.submitting_tasks.keys()))
+        with self._lock:
+            pending = copy.deepcopy(list(self.pending_tasks) + list(self.submitting_tasks.keys()))
             running = copy.deepcopy(self.running_tasks)
         return pending, running
 
+    def _wakeup(self, *args):
+        # callbacks of futures that are already done are called by the engine
+        # thread itself, before it waits on the condition
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def _watch_status(self):
+        # watch status changes of tasks in a separate thread because the engine
+        # thread can only wait on its condition
+        try:
+            from .task_store import TaskWatcher
+            watcher = TaskWatcher()
+        except Exception as e:
+            env.logger.debug(f'Failed to watch status of tasks: {e}')
+            return
+        while not self._stopped:
+            if not watcher.wait(self.status_check_interval):
+                continue
+            with self._cond:
+                if watcher.changed(self.running_tasks) and self.running_tasks:
+                    self._status_changed = True
+                    self._cond.notify_all()
+        watcher.close()
+
+    def _check_status(self):
+        '''Collect the result of status check, and start a new one if needed'''
+        if self._status_checker is not None:
+            if not self._status_checker.done():
+                return
+            try:
+                task_status, task_info = self._status_checker.result()
+            except Exception as e:
+                env.logger.warning(f'Failed to check status of tasks on {self.alias}: {e}')
+                task_status, task_info = [], {}
+            self._status_checker = None
+            for tid, info in task_info.items():
+                if tid in self.running_tasks:
+                    self._load_task_info(tid, info)
+            for tid, _, tst in task_status:
+                if tid not in self.running_tasks:
+                    env.logger.trace(f'Task {tid} removed since status check.')
+                    continue
+                self.update_task_status(tid, tst)
+            self.summarize_status()
+            self._last_status_check = time.time()
+        if self.running_tasks and (self._status_changed or
+            time.time() - self._last_status_check >= self.status_check_interval):
+            self._status_changed = False
+            # resources of running tasks that are not submitted by the engine
+            # (e.g. monitored or found running) are read with their status
+            self._status_checker = self._status_worker.submit(self._query_running,
+                list(self.running_tasks), [] if self.max_cores is None else
+                [x for x in self.running_tasks if x not in self._resources])
+            self._status_checker.add_done_callback(self._wakeup)
+
+    def _query_running(self, tasks, unknown):
+        '''Query status of running tasks, and read resources and priorities of
+        unknown tasks, without holding the lock'''
+        return self.query_task_status(tasks), {x: self._read_task_info(x) for x in unknown}
+
+    def _collect_submitted(self):
+        '''Move tasks that have been submitted to running tasks'''
+        submitted = [k for k, v in self.submitting_tasks.items() if v.done()]
+        for k in submitted:
+            try:
+                succ = self.submitting_tasks.pop(k).result()
+            except Exception as e:
+                env.logger.warning(f'Failed to submit task {", ".join(k)}: {e}')
+                succ = False
+            if succ:
+                for tid in k:
+                    if tid in self.canceled_tasks:
+                        # task is canceled while being prepared
+                        self.notify(['change-status', self.agent.alias, tid, 'aborted'])
+                        self._forget_task(tid)
+                    else:
+                        self.running_tasks.append(tid)
+                        self.notify(['change-status', self.agent.alias, tid, 'submitted'])
+            else:
+                for tid in k:
+                    self.notify(['change-status', self.agent.alias, tid, 'failed'])
+                    self.task_status[tid] = 'failed'
+                    self._forget_task(tid)
+
+    def _add_pending(self, tid):
+        '''Add tid to pending tasks, after its priority is loaded'''
+        if tid in self.pending_tasks:
+            return
+        order = next(self._pending_order)
+        self.pending_tasks[tid] = order
+        heapq.heappush(self._pending_queue, (tuple(-x for x in self._task_priority(tid)), order, tid))
+
+    def _pop_pending(self):
+        '''Remove the entry of the pending task with the highest priority from
+        the queue and return it, or None if there is no pending task. Tasks are
+        still pending until they are taken by _take_pending, and entries of tasks
+        that are not taken should be pushed back to the queue.'''
+        while self._pending_queue:
+            entry = heapq.heappop(self._pending_queue)
+            if self.pending_tasks.get(entry[2]) == entry[1]:
+                return entry
+        return None
+
+    def _take_pending(self, tid):
+        '''Remove tid from pending tasks, and return True if it should be submitted'''
+        del self.pending_tasks[tid]
+        if self.task_status[tid] == 'running':
+            self.notify(f'{tid} ``runnng``')
+            if tid not in self.running_tasks:
+                self.running_tasks.append(tid)
+            return False
+        elif tid in self.canceled_tasks:
+            # the job is canceled while being prepared to run
+            self.notify(f'{tid} ``canceled``')
+            self._forget_task(tid)
+            return False
+        return True
+
+    def _read_task_info(self, task_id):
+        '''Read resources and priority of a task from its definition. This function
+        reads the task file and should be called without holding the lock.'''
+        try:
+            header = loadTaskHeader(os.path.join(os.path.expanduser('~'), '.sos', 'tasks',
+                task_id + '.def'))
+        except Exception:
+            # a resumed task might not have a definition file
+            header = {}
+        runtime = header.get('runtime', {})
+        # resources are limited to those of the host so that large tasks
+        # can still be executed alone
+        resources = None if self.max_cores is None else (min(runtime.get('cores', None) or 1, self.max_cores),
+            min(runtime.get('mem', None) or 0, self.max_mem))
+        return resources, (runtime.get('priority', None) or 0, header.get('critical_path', None) or 0)
+
+    def _load_task_info(self, task_id, info):
+        '''Save resources and priority of a task, returned by _read_task_info'''
+        resources, priority = info
+        if resources is not None:
+            self._resources.setdefault(task_id, resources)
+        self._priorities.setdefault(task_id, priority)
+
+    def _forget_task(self, task_id):
+        '''Remove resources and priority of a task that is no longer pending or active'''
+        self._resources.pop(task_id, None)
+        self._priorities.pop(task_id, None)
+        self._backfilled.discard(task_id)
+
+    def _task_resources(self, task_id):
+        '''Cores and memory requested by a task, or a core if the definition
+        of the task has not been read'''
+        return self._resources.get(task_id, (1, 0))
+
+    def _task_priority(self, task_id):
+        '''Priority of a task and length of the critical path of its step'''
+        return self._priorities.get(task_id, (0, 0))
+
+    def _pack_pending(self, num_active_tasks):
+        '''Select pending tasks that fit in the free cores and memory of the host,
+        in the order of their priorities. If a task does not fit, later tasks are
+        backfilled into resources that it does not need, so that it can start
+        after the tasks running when it is blocked are completed.'''
+        active = self.running_tasks + [x for slot in self.submitting_tasks for x in slot]
+        free_cores = self.max_cores - sum(self._task_resources(x)[0] for x in active)
+        free_mem = self.max_mem - sum(self._task_resources(x)[1] for x in active)
+        blocked = None
+        selected = []
+        skipped = []
+        while num_active_tasks + len(selected) < self.max_running_jobs:
+            entry = self._pop_pending()
+            if entry is None:
+                break
+            tid = entry[2]
+            cores, mem = self._task_resources(tid)
+            if cores > free_cores or mem > free_mem:
+                if blocked is None:
+                    blocked = tid
+                    if blocked != self._blocked_task:
+                        self._blocked_task = blocked
+                        self._backfilled = set()
+                skipped.append(entry)
+                continue
+            if blocked is not None:
+                bf = [self._task_resources(x) for x in self._backfilled if x in active or x in selected]
+                if sum(x[0] for x in bf) + cores > self.max_cores - self._task_resources(blocked)[0] or \
+                    sum(x[1] for x in bf) + mem > self.max_mem - self._task_resources(blocked)[1]:
+                    skipped.append(entry)
+                    continue
+                self._backfilled.add(tid)
+            if self._take_pending(tid):
+                selected.append(tid)
+                free_cores -= cores
+                free_mem -= mem
+        for entry in skipped:
+            heapq.heappush(self._pending_queue, entry)
+        if blocked is None:
+            self._blocked_task = None
+            self._backfilled = set()
+        # each task is submitted separately because tasks in a batch are
+        # executed one by one and would hold the resources of the largest task
+        return [[x] for x in selected]
+
+    def _dispatch_pending(self):
+        '''Submit pending tasks if there are free slots'''
+        if not self.pending_tasks:
+            self._pending_queue = []
+            return
+        num_active_tasks = len(self.submitting_tasks) + len(self.running_tasks)
+        if num_active_tasks >= self.max_running_jobs:
+            return
+
+        if self.max_cores is not None:
+            slots = self._pack_pending(num_active_tasks)
+        else:
+            # assign tasks to self.max_running_jobs workers so that tasks with
+            # the highest priorities are executed first by all workers
+            slots = [[] for i in range(self.max_running_jobs)]
+            for i in range(self.batch_size * self.max_running_jobs):
+                entry = self._pop_pending()
+                if entry is None:
+                    break
+                if self._take_pending(entry[2]):
+                    slots[i % self.max_running_jobs].append(entry[2])
+        for slot in slots:
+            if not slot:
+                continue
+            for tid in slot:
+                env.logger.trace(f'Start submitting {tid} (status: {self.task_status.get(tid, "unknown")})')
+            self.submitting_tasks[tuple(slot)] = self._thread_workers.submit(self.execute_tasks, slot)
+            self.submitting_tasks[tuple(slot)].add_done_callback(self._wakeup)
+
+    def _next_wakeup(self):
+        '''Time to wait before the next status check, or None if the engine
+        only needs to wake up on events'''
+        if self.running_tasks and self._status_checker is None:
+            return max(0, self._last_status_check + self.status_check_interval - time.time())
+        return None
+
     def run(self):
         # get all system tasks that might have been running ...
         # this will be run only once when the task engine starts
-        status_output = self.query_tasks([], verbosity=2, start_time=True)
-        with threading.Lock():
-            for line in status_output.split('\n'):
-                if not line.strip():
-                    continue
-                try:
-                    tid, _, ttm, tst = line.split('\t')
-                    self.task_status[tid] = tst
-                    self.task_date[tid] = float(ttm)
-                except Exception as e:
-                    env.logger.warning(f'Unrecognized response "{line}" ({e.__class__.__name__}): {e}')
+        with self._lock:
+            for tid, ttm, tst in self.query_task_status([]):
+                self.task_status[tid] = tst
+                self.task_date[tid] = time.time() if ttm is None else ttm
         self._last_status_check = time.time()
+        if getattr(self.agent, 'address', None) == 'localhost':
+            threading.Thread(target=self._watch_status, daemon=True).start()
         self.engine_ready.set()
-        while True:
-            # if no new task, does not do anything.
-            if self.running_tasks and time.time() - self._last_status_check > self.status_check_interval:
-                if self._status_checker is None:
-                    self._status_checker = self._thread_workers.submit(self.query_tasks, self.running_tasks, 1)
-                    continue
-                elif self._status_checker.running():
-                    time.sleep(0.01)
-                    continue
-                else:
-                    status_output = self._status_checker.result()
-                    self._status_checker = None
-                #
-                for line in status_output.splitlines():
-                    if not line.strip():
-                        continue
-                    try:
-                        tid, tst = line.split('\t')
-                        if tid not in self.running_tasks:
-                            env.logger.trace(f'Task {tid} removed since status check.')
-                            continue
-                        self.update_task_status(tid, tst)
-                    except Exception as e:
-                        env.logger.warning(f'Unrecognized response "{line}" ({e.__class__.__name__}): {e}')
-                self.summarize_status()
-                self._last_status_check = time.time()
-            else:
-                # if nothing to do, sleep to avoid empty loop. This will reduce CPU usage from 100% to 0.3%
-                # sleeping longer will slightly reduce CPU usage but decrease responsiveness by a bit
-                time.sleep(0.01)
-
-            if self.submitting_tasks:
-                with threading.Lock():
-                    submitted = []
-                    for k in self.submitting_tasks:
-                        if not self.submitting_tasks[k].running():
-                            submitted.append(k)
-                            if self.submitting_tasks[k].result():
-                                for tid in k:
-                                    if tid in self.canceled_tasks:
-                                        # task is canceled while being prepared
-                                        self.notify(['change-status', self.agent.alias, tid, 'aborted'])
-                                    else:
-                                        self.running_tasks.append(tid)
-                                        self.notify(['change-status', self.agent.alias, tid, 'submitted'])
-                            else:
-                                for tid in k:
-                                    self.notify(['change-status', self.agent.alias, tid, 'failed'])
-                                    self.task_status[tid] = 'failed'
-                        #else:
-                        #    env.logger.trace('{} is still being submitted.'.format(k))
-                    for k in submitted:
-                        self.submitting_tasks.pop(k)
-
-            if self.pending_tasks:
-                # check status
-                num_active_tasks = len(self.submitting_tasks) + len(self.running_tasks)
-                if num_active_tasks >= self.max_running_jobs:
-                    continue
-
-                # assign tasks to self.max_running_jobs workers
-                slots = [[] for i in range(self.max_running_jobs)]
-                sample_slots = list(range(self.max_running_jobs))
-                random.shuffle(sample_slots)
-                for i,tid in enumerate(self.pending_tasks[:self.batch_size * self.max_running_jobs]):
-                    if self.task_status[tid] == 'running':
-                        self.notify(f'{tid} ``runnng``')
-                    elif tid in self.canceled_tasks:
-                        # the job is canceled while being prepared to run
-                        self.notify(f'{tid} ``canceled``')
-                    else:
-                        # randomly spread to tasks, but at most one.
-                        slots[sample_slots[i % self.max_running_jobs]].append(tid)
-                for slot in slots:
-                    if not slot:
-                        continue
-                    for tid in slot:
-                        env.logger.trace(f'Start submitting {tid} (status: {self.task_status.get(tid, "unknown")})')
-                    self.submitting_tasks[tuple(slot)] = self._thread_workers.submit(self.execute_tasks, slot)
-                #
-                with threading.Lock():
-                    for slot in slots:
-                        for tid in slot:
-                            self.pending_tasks.remove(tid)
+        with self._cond:
+            while not self._stopped:
+                self._check_status()
+                self._collect_submitted()
+                self._dispatch_pending()
+                # sleep until the next status check, or until the engine is
+                # notified of new events
+                if not self._woken:
+                    self._cond.wait(self._next_wakeup())
+                self._woken = False
+
+    def stop(self):
+        '''Stop the engine thread and the threads that submit and check tasks'''
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread_workers.shutdown(wait=False)
+        self._status_worker.shutdown(wait=False)
 
     def submit_task(self, task_id):
         # we wait for the engine to start
         self.engine_ready.wait()
+        info = self._read_task_info(task_id)
 
         # submit tasks simply add task_id to pending task list
-        with threading.Lock():
+        with self._lock:
             # if already in
             #if task_id in self.running_tasks or task_id in self.pending_tasks:
             #    self.notify('{} ``{}``'.format(task_id, self.task_status[task_id]))
@@ -1400,6 +2028,7 @@ class TaskEngine(threading.Thread):
             if task_id in self.task_status and self.task_status[task_id]:
                 if self.task_status[task_id] == 'running':
                     self.running_tasks.append(task_id)
+                    self._load_task_info(task_id, info)
                     self.notify(f'{task_id} ``already runnng``')
                     self.notify(['new-status', self.agent.alias, task_id, 'running',
                             self.task_date.get(task_id, time.time())])
@@ -1426,12 +2055,14 @@ class TaskEngine(threading.Thread):
                     self.notify(f'{task_id} ``restart`` from status ``{self.task_status[task_id]}``')
 
             #self.notify('{} ``queued``'.format(task_id))
-            self.pending_tasks.append(task_id)
+            self._load_task_info(task_id, info)
+            self._add_pending(task_id)
             if task_id in self.canceled_tasks:
                 self.canceled_tasks.remove(task_id)
             self.task_status[task_id] = 'pending'
             self.notify(['new-status', self.agent.alias, task_id, 'pending',
                     self.task_date.get(task_id, time.time())])
+            self._cond.notify_all()
             return 'pending'
 
     def summarize_status(self):
@@ -1444,7 +2075,7 @@ class TaskEngine(threading.Thread):
         # we wait for the engine to start
         self.engine_ready.wait()
         try:
-            with threading.Lock():
+            with self._lock:
                 return self.task_status[task_id]
         except Exception:
             # job not yet submitted
@@ -1454,7 +2085,7 @@ class TaskEngine(threading.Thread):
         #
         env.logger.trace(f'STATUS {task_id}\t{status}\n')
         #
-        with threading.Lock():
+        with self._lock:
             if task_id in self.canceled_tasks and status != 'aborted':
                 env.logger.debug(f'Task {task_id} is still not killed (status {status})')
                 status = 'aborted'
@@ -1465,15 +2096,17 @@ class TaskEngine(threading.Thread):
                     self.notify(['change-status', self.agent.alias, task_id, status])
             self.task_status[task_id] = status
             if status == 'pening' and task_id not in self.pending_tasks:
-                self.pending_tasks.append(task_id)
+                self._add_pending(task_id)
             if status == 'running' and task_id not in self.running_tasks:
                 self.running_tasks.append(task_id)
             # terminal states, remove tasks from task list
-            if status in ('completed', 'failed', 'aborted', 'signature-mismatch') and task_id in self.running_tasks:
-                self.running_tasks.remove(task_id)
+            if status in ('completed', 'failed', 'aborted', 'signature-mismatch'):
+                if task_id in self.running_tasks:
+                    self.running_tasks.remove(task_id)
+                self._forget_task(task_id)
 
     def remove_tasks(self, tasks):
-        with threading.Lock():
+        with self._lock:
             for task in tasks:
                 self.notify(['remove-task', self.agent.alias, task])
                 #if task in self.task_status:
@@ -1481,11 +2114,35 @@ class TaskEngine(threading.Thread):
                 #if task in self.running_tasks:
                 #    self.running_tasks.remove(task)
 
-    def query_tasks(self, tasks=None, verbosity=1, html=False, start_time=False, age=None, tags=None, status=None):
+    def query_task_status(self, tasks=None, age=None, tags=None, status=None):
+        '''Return a list of (ID, modification time of task file, status) of all or
+        specified tasks. Tasks on localhost are checked directly, and tasks on remote
+        hosts are checked with command "sos status --json" on the host.'''
+        if getattr(self.agent, 'address', None) == 'localhost':
+            return query_task_status(tasks, age=age, tags=tags, status=status)
+        try:
+            output = self.agent.check_output("sos status {} --json {} {} {}".format(
+                '' if tasks is None else ' '.join(tasks),
+                f'--age {age}' if age else '',
+                f'--tags {" ".join(tags)}' if tags else '',
+                f'--status {" ".join(status)}' if status else '',
+                ))
+        except subprocess.CalledProcessError as e:
+            env.logger.warning(f'Failed to query status of tasks on {self.alias}')
+            return []
+        try:
+            return [(x['id'], x['time'], x['status']) for x in json.loads(output)] if output.strip() else []
+        except Exception as e:
+            env.logger.warning(f'Unrecognized response "{short_repr(output)}" from {self.alias} ({e.__class__.__name__}): {e}')
+            return []
+
+    def query_tasks(self, tasks=None, verbosity=1, html=False, start_time=False, age=None, tags=None, status=None,
+        stats=False):
         try:
-            return self.agent.check_output("sos status {} -v {} {} {} {} {} {}".format(
+            return self.agent.check_output("sos status {} -v {} {} {} {} {} {} {}".format(
                 '' if tasks is None else ' '.join(tasks), verbosity,
                 '--html' if html else '',
+                '--stats' if stats else '',
                 '--start-time' if start_time else '',
                 f'--age {age}' if age else '',
                 f'--tags {" ".join(tags)}' if tags else '',
@@ -1499,13 +2156,12 @@ class TaskEngine(threading.Thread):
         # we wait for the engine to start
         self.engine_ready.wait()
 
-        for task in tasks:
-            with threading.Lock():
+        with self._lock:
+            for task in tasks:
                 self.task_status[task] = 'aborted'
-        for task in tasks:
-            with threading.Lock():
+            for task in tasks:
                 if task in self.pending_tasks:
-                    self.pending_tasks.remove(task)
+                    del self.pending_tasks[task]
                     env.logger.debug(f'Cancel pending task {task}')
                 elif task in self.submitting_tasks:
                     # this is more troublesome because the task is being
@@ -1517,8 +2173,8 @@ class TaskEngine(threading.Thread):
                     # it is not in the system, so we need to know what the
                     # status of the task before we do anything...
                     pass
-
-        self.canceled_tasks.extend(tasks)
+            self.canceled_tasks.extend(tasks)
+            self._cond.notify_all()
         #
         cmd = "sos kill {} {} {}".format(' '.join(tasks),
                 f'--tags {" ".join(tags)}' if tags else '',
@@ -1535,7 +2191,8 @@ class TaskEngine(threading.Thread):
     def resume_task(self, task):
         # we wait for the engine to start
         self.engine_ready.wait()
-        with threading.Lock():
+        info = self._read_task_info(task)
+        with self._lock:
             # it is possible that a task is aborted from an opened notebook with aborted status
             if task not in self.task_status or \
                     self.task_status[task] not in ('completed', 'failed', 'signature-mismatch', 'aborted'):
@@ -1544,11 +2201,12 @@ class TaskEngine(threading.Thread):
             # the function might have been used multiple times (frontend multiple clicks)
             if task in self.canceled_tasks:
                 self.canceled_tasks.remove(task)
-            if task not in self.pending_tasks:
-                self.pending_tasks.append(task)
+            self._load_task_info(task, info)
+            self._add_pending(task)
             # tells the engine that preparation of task can fail
             self.resuming_tasks.add(task)
             self.task_status[task] = 'pending'
+            self._cond.notify_all()
 
     def execute_tasks(self, task_ids):
         # we wait for the engine to start
@@ -1559,8 +2217,10 @@ class TaskEngine(threading.Thread):
         # the preparation process can fail (e.g. no def file), but this
         # does not really matter. #587
         for task_id in task_ids:
-            if task_id in self.resuming_tasks:
-                self.resuming_tasks.remove(task_id)
+            with self._lock:
+                resuming = task_id in self.resuming_tasks
+                self.resuming_tasks.discard(task_id)
+            if resuming:
                 try:
                     self.agent.prepare_task(task_id)
                 except Exception:
@@ -1581,6 +2241,10 @@ class TaskEngine(threading.Thread):
         except subprocess.CalledProcessError:
             env.logger.error(f'Failed to purge tasks {tasks}')
             return ''
+        finally:
+            # blobs sent to the host could have been purged
+            if hasattr(self.agent, 'forget_sent_blobs'):
+                self.agent.forget_sent_blobs()
 
 
 class BackgroundProcess_TaskEngine(TaskEngine):
@@ -1596,6 +2260,15 @@ class BackgroundProcess_TaskEngine(TaskEngine):
         else:
             # default allow stacking of up to 1000 jobs
             self.batch_size = 1000
+        #
+        # tasks executed on localhost are limited by cores and memory of the
+        # machine, or max_cores and max_mem of the host. Tasks that are not
+        # waited for are submitted all at once so that sos can exit.
+        if getattr(self.agent, 'address', None) == 'localhost' and not self.job_template \
+            and self.wait_for_task:
+            import psutil
+            self.max_cores = self.config.get('max_cores', None) or os.cpu_count()
+            self.max_mem = self.config.get('max_mem', None) or psutil.virtual_memory().total
 
     def execute_tasks(self, task_ids):
         if not super(BackgroundProcess_TaskEngine, self).execute_tasks(task_ids):
@@ -1618,23 +2291,28 @@ class BackgroundProcess_TaskEngine(TaskEngine):
 
     def _submit_task_with_template(self, task_ids):
         '''Submit tasks by interpolating a shell script defined in job_template'''
-        runtime = self.config
-        runtime.update({
-            'cur_dir': os.getcwd(),
-            'verbosity': env.verbosity,
-            'sig_mode': env.config.get('sig_mode', 'default'),
-            'run_mode': env.config.get('run_mode', 'run'),
-            'home_dir': os.path.expanduser('~')})
-        if '_runtime' in env.sos_dict:
-            runtime.update({x:env.sos_dict['_runtime'][x] for x in ('nodes', 'cores', 'mem', 'walltime') if x in env.sos_dict['_runtime']})
-        if 'nodes' not in runtime:
-            runtime['nodes'] = 1
-        if 'cores' not in runtime:
-            runtime['cores'] = 1
-
-        # let us first prepare a task file
+        # tasks can be submitted concurrently so each job has its own copy of
+        # runtime options, with resources requested by the tasks
         job_text = ''
         for task_id in task_ids:
+            runtime = copy.deepcopy(self.config)
+            runtime.update({
+                'cur_dir': os.getcwd(),
+                'verbosity': env.verbosity,
+                'sig_mode': env.config.get('sig_mode', 'default'),
+                'run_mode': env.config.get('run_mode', 'run'),
+                'home_dir': os.path.expanduser('~')})
+            try:
+                task_runtime = loadTaskHeader(os.path.join(os.path.expanduser('~'), '.sos', 'tasks',
+                    task_id + '.def'))['runtime']
+            except Exception:
+                # a resumed task might not have a definition file
+                task_runtime = {}
+            runtime.update({x:task_runtime[x] for x in ('nodes', 'cores', 'mem', 'walltime') if x in task_runtime})
+            if 'nodes' not in runtime:
+                runtime['nodes'] = 1
+            if 'cores' not in runtime:
+                runtime['cores'] = 1
             runtime['task'] = task_id
             try:
                 job_text += cfg_interpolate(self.job_template, runtime)
@@ -1659,3 +2337,177 @@ class BackgroundProcess_TaskEngine(TaskEngine):
         except Exception as e:
             raise RuntimeError(f'Failed to submit task {task_ids}: {e}')
         return True
+
+
+def _pool_worker(conn, verbosity):
+    '''Execute tasks received from conn in a worker process of a
+    ProcessPool_TaskEngine, and report their status back through conn'''
+    # modules used by tasks are loaded once for all tasks
+    import sos.runtime
+    env.verbosity = verbosity
+    cur_dir = os.getcwd()
+    environ = dict(os.environ)
+    sys_path = list(sys.path)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        task_id, verbosity, sig_mode, run_mode = item
+        res_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.res')
+        monitors = []
+        try:
+            status = check_task(task_id)
+            if status == 'running':
+                # the task is executed by another process and its status
+                # will be checked by the engine
+                status = None
+            elif status == 'completed' and sig_mode != 'force':
+                os.utime(res_file, None)
+                env.logger.info(f'{task_id} ``already completed``')
+            else:
+                if os.path.isfile(res_file):
+                    os.remove(res_file)
+                ret = execute_task(task_id, verbosity=verbosity, runmode=run_mode, sigmode=sig_mode,
+                    monitor_interval=monitor_interval, resource_monitor_interval=resource_monitor_interval,
+                    monitors=monitors)
+                status = 'completed' if ret == 0 else 'failed'
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            # SystemExit (e.g. from sys.exit() in a task or fileMD5) fails the
+            # task instead of terminating the worker
+            env.logger.error(f'Failed to execute task {task_id}: {e}')
+            status = 'failed'
+        finally:
+            # stop the monitor of the task, and restore the states that could have
+            # been changed by the task so that the next task starts afresh
+            for m in monitors:
+                m.stop()
+                m.join()
+            os.chdir(cur_dir)
+            os.environ.clear()
+            os.environ.update(environ)
+            sys.path[:] = sys_path
+            env.reset()
+            env.verbosity = verbosity
+        conn.send((task_id, status))
+
+
+class ProcessPool_TaskEngine(BackgroundProcess_TaskEngine):
+    '''A task engine that executes tasks on localhost with a pool of up to
+    max_running_jobs worker processes. Workers are started once with
+    sos.runtime loaded and execute tasks without starting a "sos execute"
+    process for each batch of tasks. Tasks that are not waited for are still
+    executed in background processes because they should outlive sos.'''
+
+    def __init__(self, agent):
+        super(ProcessPool_TaskEngine, self).__init__(agent)
+        if getattr(self.agent, 'address', None) != 'localhost':
+            raise ValueError(f'Task engine "pool" can only be used on localhost, {self.alias} specified.')
+        # worker process -> {'conn': connection, 'task': task being executed}
+        self._workers = {}
+        self._queue = []
+        self._mp_context = None
+        self._stopping = False
+
+    def _submit_task(self, task_ids):
+        if not self.wait_for_task:
+            return super(ProcessPool_TaskEngine, self)._submit_task(task_ids)
+        with self._lock:
+            self._start_workers()
+            self._queue.extend((task_id, env.verbosity, env.config['sig_mode'], env.config['run_mode'])
+                for task_id in task_ids)
+            self._assign_tasks()
+        return True
+
+    def _start_workers(self):
+        if self._mp_context is not None:
+            return
+        import atexit
+        import multiprocessing as mp
+        # spawned workers do not inherit locks held by other threads of sos
+        self._mp_context = mp.get_context('spawn')
+        # wakes up the thread collecting results when workers are added
+        self._new_workers, self._add_worker = self._mp_context.Pipe(duplex=False)
+        threading.Thread(target=self._collect_results, daemon=True).start()
+        atexit.register(self._stop_workers)
+
+    def _start_worker(self):
+        conn, worker_conn = self._mp_context.Pipe()
+        # workers are not daemonic because master tasks can execute subtasks
+        # with a pool of processes
+        proc = self._mp_context.Process(target=_pool_worker, args=(worker_conn, env.verbosity))
+        proc.start()
+        worker_conn.close()
+        self._workers[proc] = {'conn': conn, 'task': None}
+        self._add_worker.send(None)
+        return self._workers[proc]
+
+    def _assign_tasks(self):
+        '''Send queued tasks to idle workers, and start new workers if all
+        workers are busy'''
+        while self._queue:
+            idle = [x for x in self._workers.values() if x['task'] is None]
+            if idle:
+                worker = idle[0]
+            elif len(self._workers) < self.max_running_jobs:
+                worker = self._start_worker()
+            else:
+                return
+            item = self._queue.pop(0)
+            if item[0] in self.canceled_tasks:
+                env.logger.debug(f'Task {item[0]} is canceled before execution')
+                continue
+            worker['task'] = item[0]
+            worker['conn'].send(item)
+
+    def _collect_results(self):
+        '''Update status of tasks reported by workers, and replace workers that
+        exit with their tasks, e.g. killed by "sos kill" or for exceeding resource
+        limits of tasks'''
+        from multiprocessing.connection import wait
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                objs = {self._new_workers: None}
+                for proc, worker in self._workers.items():
+                    objs[worker['conn']] = proc
+                    objs[proc.sentinel] = proc
+            ready = wait(list(objs.keys()))
+            if self._new_workers in ready:
+                while self._new_workers.poll():
+                    self._new_workers.recv()
+            for proc in set(objs[x] for x in ready if x is not self._new_workers):
+                with self._lock:
+                    if self._stopping:
+                        return
+                    worker = self._workers[proc]
+                    try:
+                        while worker['conn'].poll():
+                            task_id, status = worker['conn'].recv()
+                            worker['task'] = None
+                            if status is not None:
+                                self.update_task_status(task_id, status)
+                    except EOFError:
+                        proc.join()
+                    if not proc.is_alive():
+                        self._workers.pop(proc)
+                        if worker['task'] is not None:
+                            env.logger.debug(f'Worker executing task {worker["task"]} exits with code {proc.exitcode}')
+                            self.update_task_status(worker['task'], 'aborted')
+                    self._assign_tasks()
+                    self._cond.notify_all()
+
+    def _stop_workers(self):
+        '''Terminate workers, aborting tasks that are being executed'''
+        with self._lock:
+            self._stopping = True
+            workers = list(self._workers.keys())
+        for proc in workers:
+            proc.terminate()
+        for proc in workers:
+            proc.join()
@@ -33,16 +33,13 @@ import traceback
 import threading
 import base64
 import pickle
-import yaml
 import urllib
 import urllib.parse
-import urllib.request
 import argparse
-from tqdm import tqdm as ProgressBar
 from collections.abc import Sequence
 from io import StringIO, FileIO
-
 from html.parser import HTMLParser
+
 import fasteners
 
 __all__ = ['logger', 'get_output']
@@ -263,8 +260,24 @@ class WorkflowDict(object):
         if key.startswith('_') and not key.startswith('__') and key not in ('_input', '_output', '_step', '_index', '_depends', '_runtime'):
             env.logger.warning(f'{key}: Variables with leading underscore is reserved for SoS temporary variables.')
 
-    def clone_selected_vars(self, selected=None):
-        return {x:copy.deepcopy(y) for x,y in self._dict.items() if (not selected or x in selected) and pickleable(y, x)}
+    def clone_selected_vars(self, selected=None, copies=None):
+        '''Return deep copies of selected (default to all) pickleable variables.
+        If a dictionary copies is specified, copies of user-defined variables are
+        saved to it and are reused by later calls if the variables are unchanged.'''
+        if copies is None:
+            return {x:copy.deepcopy(y) for x,y in self._dict.items() if (not selected or x in selected) and pickleable(y, x)}
+        res = {}
+        for x, y in self._dict.items():
+            if selected and x not in selected:
+                continue
+            if x in copies and copies[x][0] is y and _unchanged(y, copies[x][1]):
+                res[x] = copies[x][1]
+            elif pickleable(y, x):
+                res[x] = copy.deepcopy(y)
+                # variables of sos (e.g. _runtime) could be changed after they are copied
+                if not x.startswith('_'):
+                    copies[x] = (y, res[x])
+        return res
 
 #
 # Runtime environment
@@ -541,6 +554,13 @@ def get_traceback():
     #print "*** tb_lineno:", exc_traceback.tb_lineno
 
 
+def _unchanged(obj, obj_copy):
+    '''Check if obj is equal to a copy of it, which is False if they cannot be compared'''
+    try:
+        return bool(obj == obj_copy)
+    except Exception:
+        return False
+
 def pickleable(obj, name):
     if isinstance(obj, (str, bool, int, float, complex, bytes)):
         return True
@@ -607,7 +627,8 @@ def locate_script(filename, start=''):
     # if no scheme or netloc, the URL is not acceptable
     if all([getattr(token, qualifying_attr) for qualifying_attr in  ('scheme', 'netloc')]):
         try:
-            local_filename, _ = urllib.request.urlretrieve(filename)
+            from urllib.request import urlretrieve
+            local_filename, _ = urlretrieve(filename)
             with open(local_filename) as script:
                 content = script.read()
             #
@@ -620,6 +641,7 @@ def locate_script(filename, start=''):
     pathes = [start]
     sos_config_file = os.path.join(os.path.expanduser('~'), '.sos', 'config.yml')
     if os.path.isfile(sos_config_file):
+        import yaml
         try:
             with open(sos_config_file) as config:
                 cfg = yaml.safe_load(config)
@@ -640,7 +662,8 @@ def locate_script(filename, start=''):
         if all([getattr(token, qualifying_attr) for qualifying_attr in  ('scheme', 'netloc')]):
             url = path + ('' if path.endswith('/') else '/') + filename
             try:
-                local_filename, _ = urllib.request.urlretrieve(url)
+                from urllib.request import urlretrieve
+                local_filename, _ = urlretrieve(url)
                 with open(local_filename) as script:
                     content = script.read()
                 return content, url
@@ -768,6 +791,7 @@ class ActivityNotifier(threading.Thread):
                     prog.close()
                 break
             if not prog:
+                from tqdm import tqdm as ProgressBar
                 print(self.msg)
                 prog = ProgressBar(desc='', position=0, bar_format='{desc}', total=100000000)
             second_elapsed = time.time() - self.start_time
@@ -1002,6 +1026,7 @@ class TimeoutInterProcessLock(fasteners.InterProcessLock):
                     msg = True
 
 def load_config_files(filename=None):
+    import yaml
     cfg = {}
     config_lock = os.path.join(os.path.expanduser('~'), '.sos', '.runtime', 'sos_config.lck')
     # site configuration file
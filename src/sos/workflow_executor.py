@@ -38,6 +38,7 @@ from .dag import SoS_DAG
 from .targets import BaseTarget, file_target, UnknownTarget, RemovedTarget, UnavailableLock, sos_variable, textMD5, sos_step, Undetermined
 from .pattern import extract_pattern
 from .hosts import Host
+from .signatures import merge_workflow_journals, signature_store
 
 __all__ = []
 
@@ -784,6 +785,7 @@ class Base_Executor:
         sos clean.
         '''
         if '__workflow_sig__' in env.sos_dict:
+            merge_workflow_journals(env.sos_dict['__workflow_sig__'])
             with open(env.sos_dict['__workflow_sig__'], 'a') as sigfile:
                 sigfile.write(f'# end time: {time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())}\n')
                 sigfile.write('# input and dependent files\n')
@@ -814,6 +816,8 @@ class Base_Executor:
             env.verbosity = self.config['verbosity']
 
         self.reset_dict()
+        # signatures could have been removed (e.g. rm -rf .sos) since the last run
+        signature_store().validate()
         env.config['run_mode'] = mode
         # passing run_mode to SoS dict so that users can execute blocks of
         # python statements in different run modes.
@@ -1012,6 +1016,13 @@ class Base_Executor:
                             env.sos_dict['__step_output__'].targets(),
                             env.sos_dict['__step_depends__'].targets())
                         runnable._status = 'completed'
+                        # durations of steps are used to prioritize steps of later runs
+                        if env.config['run_mode'] == 'run' and hasattr(runnable, '_start_time'):
+                            try:
+                                signature_store().add_duration(runnable._node_id.split(' ')[0],
+                                    time.time() - runnable._start_time)
+                            except Exception as e:
+                                env.logger.debug(f'Failed to save duration of step {runnable._node_id}: {e}')
                         prog.update(1)
                     elif '__workflow_id__' in res:
                         # result from a workflow
@@ -1103,6 +1114,7 @@ class Base_Executor:
                     section = self.workflow.section_by_id(runnable._step_uuid)
                     # execute section with specified input
                     runnable._status = 'running'
+                    runnable._start_time = time.time()
 
                     # workflow shared variables
                     shared = {x: env.sos_dict[x] for x in self.shared.keys() if x in env.sos_dict and pickleable(env.sos_dict[x], x)}
@@ -1127,6 +1139,8 @@ class Base_Executor:
 
                     if '__workflow_sig__' in env.sos_dict:
                         runnable._context['__workflow_sig__'] = env.sos_dict['__workflow_sig__']
+                    # tasks of steps on the critical path of the DAG are executed first
+                    runnable._context['__critical_path__'] = dag.critical_path_lengths().get(runnable, 0)
 
                     if not nested:
                         env.logger.debug(f'{i_am()} execute {section.md5} from DAG')
@@ -22,6 +22,8 @@
 
 
 import os
+import sys
+import time
 import unittest
 from io import StringIO
 
@@ -1108,5 +1110,74 @@ run: expand=True
         Base_Executor(wf).run()
         self.assertTrue(file_target('a.txt.bak').target_exists())
 
+    def testCriticalPathPriority(self):
+        '''Test executing steps on the critical path of DAG first'''
+        from sos.dag import SoS_DAG
+        dag = SoS_DAG()
+        for name in ('A_1', 'B_1', 'C_1', 'D_1', 'E_1'):
+            dag.add_step(name, name, None, [], [], [])
+        nodes = {x._node_id: x for x in dag.nodes()}
+        # A -> B -> C, and D -> E
+        dag.add_edge(nodes['A_1'], nodes['B_1'])
+        dag.add_edge(nodes['B_1'], nodes['C_1'])
+        dag.add_edge(nodes['D_1'], nodes['E_1'])
+        # without durations, the longer chain is executed first
+        dag._durations = {}
+        self.assertEqual(dag.find_executable()._node_id, 'A_1')
+        # but E takes a long time to complete, and other steps are expected
+        # to take the average time of steps
+        dag._durations = {'E_1': 10, 'A_1': 1}
+        dag._path_lengths = None
+        self.assertEqual(dag.critical_path_lengths()[nodes['A_1']], 12)
+        self.assertEqual(dag.critical_path_lengths()[nodes['D_1']], 15.5)
+        self.assertEqual(dag.find_executable()._node_id, 'D_1')
+        nodes['D_1']._status = 'completed'
+        self.assertEqual(dag.find_executable()._node_id, 'A_1')
+        nodes['A_1']._status = 'running'
+        self.assertEqual(dag.find_executable()._node_id, 'E_1')
+        # lengths are calculated again if edges are changed, even if the number
+        # of edges is not changed
+        dag.remove_edge(nodes['B_1'], nodes['C_1'])
+        dag.add_edge(nodes['E_1'], nodes['C_1'])
+        self.assertEqual(dag.critical_path_lengths()[nodes['E_1']], 15.5)
+        nodes['E_1']._status = 'completed'
+        self.assertEqual(dag.find_executable()._node_id, 'C_1')
+        # durations of steps are saved to signature database
+        script = SoS_Script('''
+[A_1]
+[A_2]
+''')
+        wf = script.workflow()
+        Base_Executor(wf).run()
+        from sos.signatures import signature_store
+        self.assertTrue('A_1' in signature_store().get_durations())
+        self.assertTrue('A_2' in signature_store().get_durations())
+
+    def testWaitForPendingStep(self):
+        '''Test waiting for a step that is locked by another process'''
+        from sos.dag import SoS_DAG
+        dag = SoS_DAG()
+        dag.add_step('A_1', 'A_1', None, [], [], [])
+        node = list(dag.nodes())[0]
+        node._status = 'signature_pending'
+        lock_file = os.path.abspath('temp/pending.lck')
+        os.makedirs('temp', exist_ok=True)
+        node._signature = (['a.txt'], lock_file)
+        # another process holds the lock of the step for 2 seconds
+        proc = subprocess.Popen([sys.executable, '-c', f'''
+import fasteners, time
+lock = fasteners.InterProcessLock({lock_file!r})
+lock.acquire()
+print('locked', flush=True)
+time.sleep(2)
+lock.release()
+'''], stdout=subprocess.PIPE)
+        self.assertEqual(proc.stdout.readline().strip(), b'locked')
+        st = time.time()
+        self.assertEqual(dag.find_executable(), node)
+        self.assertGreater(time.time() - st, 1)
+        self.assertIsNone(node._status)
+        proc.wait()
+
 if __name__ == '__main__':
     unittest.main()
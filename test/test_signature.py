@@ -20,9 +20,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import glob
 import os
 import sys
 import unittest
+import time
 import shutil
 
 from sos.parser import SoS_Script
@@ -558,6 +560,259 @@ run: input='test_action.txt', output='lc.txt', expand=True
         env.config['sig_mode'] = 'build'
         Base_Executor(wf).run()
 
+    def testBatchValidation(self):
+        '''Test validation of signatures of all input groups in one pass'''
+        self.touch(['temp/shared.txt'] + [f'temp/in_{i}.txt' for i in range(5)])
+        script = SoS_Script(r'''
+[0]
+input: [f'temp/in_{i}.txt' for i in range(5)], group_by=1
+depends: 'temp/shared.txt'
+output: f"{_input}.out"
+run: expand=True
+    cp {_input} {_output}
+''')
+        wf = script.workflow()
+        Base_Executor(wf).run()
+        ts = [os.path.getmtime(f'temp/in_{i}.txt.out') for i in range(5)]
+        # none of the input groups is executed again
+        Base_Executor(wf).run()
+        self.assertEqual(ts, [os.path.getmtime(f'temp/in_{i}.txt.out') for i in range(5)])
+        # changing one of the input files triggers the execution of one group
+        with open('temp/in_2.txt', 'w') as f:
+            f.write('changed')
+        Base_Executor(wf).run()
+        for i in range(5):
+            if i == 2:
+                self.assertNotEqual(ts[i], os.path.getmtime(f'temp/in_{i}.txt.out'))
+            else:
+                self.assertEqual(ts[i], os.path.getmtime(f'temp/in_{i}.txt.out'))
+        with open('temp/in_2.txt.out') as f:
+            self.assertEqual(f.read(), 'changed')
+
+    def testBatchValidationChangedByPreviousGroup(self):
+        '''Test that an input group is executed if its targets are changed by previous groups'''
+        self.touch(['temp/shared.txt'] + [f'temp/in_{i}.txt' for i in range(2)])
+        script = SoS_Script(r'''
+[0]
+input: [f'temp/in_{i}.txt' for i in range(2)], group_by=1
+depends: 'temp/shared.txt'
+output: f"{_input}.out"
+import shutil
+shutil.copy(str(_input), str(_output))
+if _index == 0:
+    with open('temp/shared.txt', 'a') as shared:
+        shared.write('changed\n')
+''')
+        wf = script.workflow()
+        Base_Executor(wf).run()
+        with open('temp/in_0.txt', 'w') as f:
+            f.write('changed')
+        ts = os.path.getmtime('temp/in_1.txt.out')
+        time.sleep(1)
+        # the first group changes temp/shared.txt so the second group is executed again
+        Base_Executor(wf).run()
+        self.assertNotEqual(ts, os.path.getmtime('temp/in_1.txt.out'))
+
+    def testBatchValidationEvaluation(self):
+        '''Test that directives evaluated for batch validation are not evaluated again'''
+        self.touch([f'temp/in_{i}.txt' for i in range(3)])
+        if os.path.isfile('temp/evaluated.txt'):
+            os.remove('temp/evaluated.txt')
+        script = SoS_Script(r'''
+[global]
+def out_file(ifile):
+    with open('temp/evaluated.txt', 'a') as log:
+        log.write(ifile + '\n')
+    return ifile + '.out'
+
+[0]
+input: [f'temp/in_{i}.txt' for i in range(3)], group_by=1
+output: out_file(str(_input))
+run: expand=True
+    cp {_input} {_output}
+''')
+        wf = script.workflow()
+        for i in range(2):
+            Base_Executor(wf).run()
+            with open('temp/evaluated.txt') as log:
+                self.assertEqual(len(log.readlines()), 3 * (i + 1))
+
+    def testValidateSignatures(self):
+        '''Test function validate_signatures'''
+        from sos.targets import RuntimeInfo, validate_signatures
+        self.touch(['temp/shared.txt', 'temp/in_0.txt', 'temp/in_1.txt', 'temp/out_0.txt', 'temp/out_1.txt'])
+        sigs = [RuntimeInfo('step_md5', 'script', [f'temp/in_{i}.txt'], [f'temp/out_{i}.txt'],
+            ['temp/shared.txt'], []) for i in range(2)]
+        for sig in sigs:
+            sig.write()
+        self.assertTrue(all(isinstance(x, dict) for x in validate_signatures(sigs)))
+        with open('temp/out_1.txt', 'w') as f:
+            f.write('changed')
+        res = validate_signatures(sigs + [RuntimeInfo('step_md5', 'other script', [], [], [], [])])
+        self.assertEqual(res[0]['output'], ['temp/out_0.txt'])
+        self.assertEqual(res[1], 'File has changed temp/out_1.txt')
+        self.assertTrue(res[2].startswith('Missing signature'))
+
+    def testWorkflowJournal(self):
+        '''Test journals of runtime signatures of workflows'''
+        from sos.signatures import write_workflow_sig, read_workflow_sig, workflow_journals, \
+            merge_workflow_journals
+        with open('temp/wf.sig', 'w') as sig:
+            sig.write('# runtime signatures\n')
+        write_workflow_sig('temp/wf.sig', ['EXE_SIG\tstep=a\tsession=1\n'])
+        # journal of a process that was killed while writing
+        with open('temp/wf.sig.99999999.journal', 'w') as journal:
+            journal.write('EXE_SIG\tstep=b\tsession=2\nEXE_SIG\tstep=c')
+        self.assertEqual(len(workflow_journals('temp/wf.sig')), 2)
+        self.assertEqual(sorted(read_workflow_sig('temp/wf.sig')), ['# runtime signatures\n',
+            'EXE_SIG\tstep=a\tsession=1\n', 'EXE_SIG\tstep=b\tsession=2\n'])
+        merge_workflow_journals('temp/wf.sig')
+        self.assertEqual(workflow_journals('temp/wf.sig'), [])
+        with open('temp/wf.sig') as sig:
+            self.assertEqual(sorted(sig.readlines()), ['# runtime signatures\n',
+                'EXE_SIG\tstep=a\tsession=1\n', 'EXE_SIG\tstep=b\tsession=2\n'])
+        if sys.platform != 'win32':
+            import fcntl
+            # journals are merged if they are not locked by their processes, even
+            # if their pids are used by other processes
+            with open(f'temp/wf.sig.{os.getppid()}.journal', 'w') as journal:
+                journal.write('EXE_SIG\tstep=d\tsession=4\n')
+            with open('temp/wf.sig.99999998.journal', 'w') as journal:
+                journal.write('EXE_SIG\tstep=e\tsession=5\n')
+            with open('temp/wf.sig.99999998.journal') as journal:
+                fcntl.flock(journal.fileno(), fcntl.LOCK_EX)
+                merge_workflow_journals('temp/wf.sig')
+            self.assertEqual(workflow_journals('temp/wf.sig'), ['temp/wf.sig.99999998.journal'])
+            self.assertEqual(len(read_workflow_sig('temp/wf.sig')), 5)
+            os.remove('temp/wf.sig.99999998.journal')
+        # missing signature file
+        write_workflow_sig('temp/missing.sig', ['EXE_SIG\tstep=a\tsession=1\n'])
+        self.assertEqual(read_workflow_sig('temp/missing.sig'), ['EXE_SIG\tstep=a\tsession=1\n'])
+        merge_workflow_journals('temp/missing.sig')
+        # journals are merged after the execution of workflows
+        self.touch('temp/a.txt')
+        script = SoS_Script(r'''
+[0]
+input: 'temp/a.txt'
+output: 'temp/journal.txt'
+run:
+    cp temp/a.txt temp/journal.txt
+''')
+        Base_Executor(script.workflow()).run()
+        sig_files = [os.path.join('.sos', x) for x in os.listdir('.sos') if x.endswith('.sig')]
+        sig_files = [x for x in sig_files if 'OUT_FILE\tfilename=temp/journal.txt' in ''.join(read_workflow_sig(x))]
+        self.assertTrue(sig_files)
+        # other tests might have left journals of other workflows
+        self.assertTrue(all(workflow_journals(x) == [] for x in sig_files))
+
+    def testOutputCache(self):
+        '''Test restoring step output from cache of another project'''
+        cache_dir = os.path.abspath('temp/cache')
+        with open('temp/cache.yml', 'w') as cfg:
+            cfg.write(f'sos_output_cache: {cache_dir}\n')
+        script = r'''
+[0]
+input: 'a.txt'
+output: 'b.txt'
+run:
+    echo "executed" >> count.txt
+    cp a.txt b.txt
+'''
+        for proj in ('temp/proj1', 'temp/proj2'):
+            os.makedirs(proj)
+            with open(os.path.join(proj, 'test.sos'), 'w') as sos_file:
+                sos_file.write(script)
+            with open(os.path.join(proj, 'a.txt'), 'w') as a:
+                a.write('content')
+            self.assertEqual(subprocess.call(f'sos run test.sos -c {os.path.abspath("temp/cache.yml")}',
+                shell=True, cwd=proj), 0)
+            with open(os.path.join(proj, 'b.txt')) as b:
+                self.assertEqual(b.read(), 'content')
+        # step is executed only in the first project
+        self.assertTrue(os.path.isfile('temp/proj1/count.txt'))
+        self.assertFalse(os.path.isfile('temp/proj2/count.txt'))
+        # output of the second project is validated with its own signature
+        self.assertEqual(subprocess.call(f'sos run test.sos -s assert -c {os.path.abspath("temp/cache.yml")}',
+            shell=True, cwd='temp/proj2'), 0)
+        # changing restored output does not change the cache
+        with open('temp/proj2/b.txt', 'a') as b:
+            b.write(' changed')
+        for obj in glob.glob(os.path.join(cache_dir, 'objects', '*', '*', '0')):
+            with open(obj) as o:
+                self.assertEqual(o.read(), 'content')
+        # different input content is not restored from cache
+        os.makedirs('temp/proj3')
+        shutil.copy('temp/proj1/test.sos', 'temp/proj3')
+        with open('temp/proj3/a.txt', 'w') as a:
+            a.write('other content')
+        self.assertEqual(subprocess.call(f'sos run test.sos -c {os.path.abspath("temp/cache.yml")}',
+            shell=True, cwd='temp/proj3'), 0)
+        self.assertTrue(os.path.isfile('temp/proj3/count.txt'))
+        #
+        from sos.cache import OutputCache
+        cache = OutputCache(cache_dir)
+        self.assertEqual(len(cache.entries()), 2)
+        self.assertEqual(cache.size(), len('content') + len('other content'))
+        # least recently used entry is removed first
+        self.assertEqual([x[1] for x in cache.prune(15, dryrun=True)], [['b.txt']])
+        self.assertEqual(len(cache.entries()), 2)
+        self.assertEqual(len(cache.prune(15)), 1)
+        self.assertEqual(cache.size(), len('other content'))
+        self.assertEqual(subprocess.call(f'sos cache --prune -c {os.path.abspath("temp/cache.yml")}', shell=True), 0)
+        self.assertEqual(cache.entries(), [])
+        cache.close()
+
+    def testSignatureStore(self):
+        '''Test saving and retrieving signatures in batch'''
+        from sos.signatures import SignatureStore
+        store = SignatureStore(os.path.abspath('temp/.sos/signatures.db'))
+        store.write(targets=[(f'/path/to/file{i}', 1.0, i, f'md5_{i}', '') for i in range(1200)],
+            steps=[('sig1', 'content1'), ('sig2', 'content2')])
+        sigs = store.get_targets([f'/path/to/file{i}' for i in range(0, 1500, 2)])
+        self.assertEqual(len(sigs), 600)
+        self.assertEqual(sigs['/path/to/file10'], (1.0, 10, 'md5_10', ''))
+        self.assertEqual(store.get_step('sig2'), 'content2')
+        self.assertEqual(store.get_steps(['sig1', 'sig3']), {'sig1': 'content1'})
+        store.remove_targets(['/path/to/file10'])
+        self.assertIsNone(store.get_target('/path/to/file10'))
+        self.assertEqual(store.clear_targets(), 1199)
+        self.assertEqual(store.list_targets(), [])
+        store.close()
+
+    def testReplacedSignatureStore(self):
+        '''Test reconnecting to a signature database that is removed'''
+        from sos.signatures import SignatureStore
+        store = SignatureStore(os.path.abspath('temp/.sos/replaced.db'))
+        store.write(steps=[('sig1', 'content1')])
+        self.assertFalse(store.validate())
+        os.remove(os.path.abspath('temp/.sos/replaced.db'))
+        # writes to the removed database are redirected to a new one
+        store.write(steps=[('sig2', 'content2')])
+        self.assertEqual(store.get_steps(['sig1', 'sig2']), {'sig2': 'content2'})
+        os.remove(os.path.abspath('temp/.sos/replaced.db'))
+        self.assertTrue(store.validate())
+        self.assertIsNone(store.get_step('sig2'))
+        store.close()
+
+    def testLegacySignatureFiles(self):
+        '''Test importing .file_info and .exe_info files of previous versions'''
+        from sos.signatures import SignatureStore
+        os.makedirs('temp/.sos/.runtime')
+        self.touch('temp/a.txt')
+        fullname = os.path.abspath('temp/a.txt')
+        with open('temp/.sos/.runtime/abc.file_info', 'w') as info:
+            info.write(f'{fullname}\t{os.path.getmtime(fullname)}\t4\tmd5_a\n')
+        with open('temp/.sos/.runtime/executable_abc.file_info', 'w') as info:
+            info.write('ls\tmd5_ls\n')
+        with open('temp/.sos/.runtime/def.exe_info', 'w') as info:
+            info.write('content')
+        store = SignatureStore(os.path.abspath('temp/.sos/signatures.db'))
+        self.assertEqual(store.get_target(os.path.realpath(fullname))[2], 'md5_a')
+        self.assertEqual(store.get_target('executable("ls")')[2], 'md5_ls')
+        self.assertEqual(store.get_step('def'), 'content')
+        self.assertEqual(os.listdir('temp/.sos/.runtime'), [])
+        store.close()
+
 
 if __name__ == '__main__':
     unittest.main()
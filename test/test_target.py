@@ -24,6 +24,7 @@ import os
 import sys
 import unittest
 import shutil
+import time
 
 from sos.parser import SoS_Script
 from sos.utils import env
@@ -377,6 +378,122 @@ run:
             self.assertTrue(file_target(file).target_exists(), file + ' should exist')
             file_target(file).remove('both')
 
+    def testHashCache(self):
+        '''Test caching of hashes of unchanged files'''
+        from sos.targets import fileMD5
+        from sos.signatures import hash_cache
+        with open('large.txt', 'w') as large:
+            large.write('a' * 2**21)
+        self.temp_files.append('large.txt')
+        # recently modified files are not cached
+        md5 = fileMD5('large.txt')
+        self.assertIsNone(hash_cache().get(os.stat('large.txt'), 'partial'))
+        os.utime('large.txt', (time.time() - 10, time.time() - 10))
+        self.assertEqual(fileMD5('large.txt'), md5)
+        self.assertEqual(hash_cache().get(os.stat('large.txt'), 'partial'), md5)
+        # cached hash is used for unchanged file
+        hash_cache().set(os.stat('large.txt'), 'partial', 'cached')
+        self.assertEqual(fileMD5('large.txt'), 'cached')
+        # but not in paranoid mode
+        env.sos_dict.set('CONFIG', {'sos_paranoid_hash': True})
+        self.assertEqual(fileMD5('large.txt'), md5)
+        env.sos_dict.set('CONFIG', {})
+        # or if the file is changed
+        os.utime('large.txt', (time.time() - 20, time.time() - 20))
+        self.assertEqual(fileMD5('large.txt'), md5)
+
+    def testHashStrategy(self):
+        '''Test signatures calculated with different hashing strategies'''
+        import pickle
+        from sos.targets import fileMD5, RuntimeInfo
+        with open('large.txt', 'w') as large:
+            large.write('a' * 2**25)
+        self.temp_files.append('large.txt')
+        # full hash with and without mmap are the same
+        self.assertEqual(fileMD5('large.txt', strategy='mmap'), fileMD5('large.txt', partial=False))
+        self.assertNotEqual(fileMD5('large.txt', strategy='mmap'), fileMD5('large.txt'))
+        self.assertNotEqual(fileMD5('large.txt', strategy='sample'), fileMD5('large.txt'))
+        # strategy is recorded in signature
+        self.assertFalse(':' in file_target('large.txt').target_signature())
+        self.assertTrue(file_target('large.txt', hash_strategy='mmap').target_signature().startswith('full:'))
+        self.assertTrue(file_target('large.txt', hash_strategy='sample4').target_signature().startswith('sample4:'))
+        env.sos_dict.set('CONFIG', {'sos_hash_strategy': 'sample', 'sos_hash_samples': 8})
+        self.assertTrue(file_target('large.txt').target_signature().startswith('sample8:'))
+        self.assertRaises(ValueError, file_target, 'large.txt', hash_strategy='unknown')
+        # per-target strategy is kept when the target is pickled
+        t = pickle.loads(pickle.dumps(file_target('large.txt', hash_strategy='mmap')))
+        self.assertTrue(t.target_signature().startswith('full:'))
+        # signature is validated with the strategy used to create it
+        sig = RuntimeInfo('step', 'script', [], [file_target('large.txt', hash_strategy='mmap')], [], [])
+        self.assertTrue(sig.write())
+        env.sos_dict.set('CONFIG', {})
+        self.assertTrue(isinstance(sig.validate(), dict))
+        # changes in the middle of large files are detected by full hash
+        with open('large.txt', 'r+') as large:
+            large.seek(2**24)
+            large.write('b')
+        self.assertTrue(isinstance(sig.validate(), str))
+
+    def testConcurrentHashing(self):
+        '''Test calculating signatures with a pool of threads'''
+        from sos.targets import hash_map, fileMD5, RuntimeInfo
+        files = [f'hash_{i}.txt' for i in range(20)]
+        for idx, f in enumerate(files):
+            with open(f, 'w') as hf:
+                hf.write(str(idx) * (idx + 1))
+        self.temp_files.extend(files)
+        for threads in (1, 4):
+            env.sos_dict.set('CONFIG', {'sos_hash_threads': threads})
+            self.assertEqual(hash_map(fileMD5, files), [fileMD5(x) for x in files])
+            sig = RuntimeInfo('step', 'script', files[:10], files[10:], [], [])
+            self.assertTrue(sig.write())
+            res = sig.validate()
+            self.assertEqual(res['input'], files[:10])
+            self.assertEqual(res['output'], files[10:])
+
+    def testDirTarget(self):
+        '''Test signatures of directories'''
+        from unittest import mock
+        import sos.targets
+        from sos.targets import dir_target, RuntimeInfo
+        shutil.rmtree('dir_target', ignore_errors=True)
+        for i in range(10):
+            os.makedirs(f'dir_target/chr{i}')
+            with open(f'dir_target/chr{i}/shard.txt', 'w') as shard:
+                shard.write(str(i))
+            os.utime(f'dir_target/chr{i}/shard.txt', (time.time() - 20, time.time() - 20))
+        sig = dir_target('dir_target').target_signature()
+        self.assertTrue(sig.startswith('dir:'))
+        self.assertEqual(dir_target('dir_target').size(), 10)
+        # directories are handled as dir_target
+        self.assertEqual(file_target('dir_target').target_signature(), sig)
+        # entries of files are saved only with the record of the directory
+        from sos.signatures import signature_store
+        d = dir_target('dir_target')
+        d.remove('signature')
+        d.sig_record()
+        self.assertEqual(signature_store().get_dir_entries(d.sig_key()), {})
+        rt = RuntimeInfo('step', 'script', [], ['dir_target'], [], [])
+        self.assertTrue(rt.write())
+        self.assertEqual(len(signature_store().get_dir_entries(d.sig_key())), 10)
+        self.assertTrue(isinstance(rt.validate(), dict))
+        self.assertTrue(dir_target('dir_target').validate())
+        # only changed files are rehashed
+        with open('dir_target/chr3/shard.txt', 'w') as shard:
+            shard.write('changed')
+        with mock.patch('sos.targets.file_signature', wraps=sos.targets.file_signature) as hashed:
+            self.assertNotEqual(dir_target('dir_target').target_signature(), sig)
+            self.assertEqual(hashed.call_count, 1)
+        self.assertEqual(rt.validate(), 'File has changed dir_target')
+        # renaming a file changes the signature
+        with open('dir_target/chr3/shard.txt', 'w') as shard:
+            shard.write('3')
+        self.assertEqual(dir_target('dir_target').target_signature(), sig)
+        os.rename('dir_target/chr3/shard.txt', 'dir_target/chr3/shard1.txt')
+        self.assertNotEqual(dir_target('dir_target').target_signature(), sig)
+        dir_target('dir_target').remove()
+        self.assertFalse(os.path.exists('dir_target'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -26,6 +26,8 @@ import time
 import unittest
 import shutil
 import glob
+import random
+import tempfile
 
 from sos.parser import SoS_Script, ParsingError
 from sos.utils import env
@@ -54,9 +56,12 @@ class TestTask(unittest.TestCase):
         subprocess.call('sos remove -s', shell=True)
         #self.resetDir('~/.sos')
         self.temp_files = []
+        self.engines = []
         Host.reset()
 
     def tearDown(self):
+        for engine in self.engines:
+            engine.stop()
         for f in self.temp_files:
             file_target(f).remove('both')
 
@@ -467,6 +472,45 @@ run: expand=True
             file_target(f'{i}.txt').remove('both')
         file_target('test_trunksize.sos').remove()
 
+    def testAutoTrunkSize(self):
+        '''Test option trunk_size="auto"'''
+        from sos.step_executor import auto_trunk_size
+        from sos.signatures import signature_store
+        env.config['max_running_jobs'] = None
+        env.config['default_queue'] = None
+        # a small trunk size if the step has not been executed before
+        self.assertEqual(auto_trunk_size('auto_unknown', 100, 0, {}), 4)
+        # tasks of auto_1 take about 60 seconds
+        signature_store().add_duration('auto_1', 60, tasks=True)
+        self.assertEqual(auto_trunk_size('auto_1', 100, 0, {}), 10)
+        self.assertEqual(auto_trunk_size('auto_1', 100, 2, {}), 20)
+        self.assertEqual(auto_trunk_size('auto_1', 6, 2, {}), 6)
+        # master tasks should not exceed max_walltime of the host
+        env.sos_dict.set('CONFIG', {'hosts': {'auto_queue': {'max_walltime': '00:05:00'}}})
+        self.assertEqual(auto_trunk_size('auto_1', 100, 0,
+            {'queue': 'auto_queue', 'walltime': '00:01:00'}), 5)
+        # and tasks should be spread to running jobs
+        env.config['max_running_jobs'] = 20
+        self.assertEqual(auto_trunk_size('auto_1', 100, 0, {}), 5)
+        #
+        script = SoS_Script('''
+[10]
+input: for_each={'i': range(6)}
+task: trunk_size='auto'
+sh: expand=True
+    echo {i}
+''')
+        wf = script.workflow()
+        env.config['sig_mode'] = 'force'
+        env.config['max_running_jobs'] = 2
+        env.config['wait_for_task'] = False
+        res = Base_Executor(wf).run()
+        self.assertEqual(len(res['pending_tasks']), 2)
+        subprocess.call('sos resume -w', shell=True)
+        env.config['wait_for_task'] = True
+        Base_Executor(wf).run()
+        self.assertTrue('default_10' in signature_store().get_durations(tasks=True))
+
     def testTrunkWorkersOption(self):
         '''Test option trunk_workers'''
         with open('test_trunkworker.sos', 'w') as tt:
@@ -500,6 +544,291 @@ run: expand=True
             file_target('{}.txt'.format(i)).remove('both')
         file_target('test_trunkworker.sos').remove()
 
+    def testResumeMasterTask(self):
+        '''Test skipping completed subtasks of resubmitted master tasks'''
+        for i in range(4):
+            if os.path.isfile(f'master_{i}.txt'):
+                os.remove(f'master_{i}.txt')
+        if os.path.isfile('master_ok.txt'):
+            os.remove('master_ok.txt')
+        script = SoS_Script('''
+[10]
+input: for_each={'i': range(4)}
+task: trunk_size=4, trunk_workers=2
+sh: expand=True
+    echo {i} >> master_{i}.txt
+    if [ "{i}" = "2" ] && [ ! -f master_ok.txt ]; then exit 1; fi
+''')
+        wf = script.workflow()
+        env.config['sig_mode'] = 'force'
+        self.assertRaises(Exception, Base_Executor(wf).run)
+        # all subtasks are executed
+        for i in range(4):
+            self.assertTrue(os.path.isfile(f'master_{i}.txt'))
+        self.touch('master_ok.txt')
+        # subtasks are skipped because they are completed, not because of signatures
+        env.config['sig_mode'] = 'ignore'
+        Base_Executor(wf).run()
+        # only the failed subtask is executed again
+        for i in range(4):
+            with open(f'master_{i}.txt') as res:
+                self.assertEqual(len(res.read().split()), 2 if i == 2 else 1)
+        for i in range(4):
+            os.remove(f'master_{i}.txt')
+
+    def testMonitorSubtasks(self):
+        '''Test attributing resources of a process tree to subtasks'''
+        from sos.monitor import ProcessMonitor, summarizeResources
+        m = ProcessMonitor('monitor_master', monitor_interval=1, resource_monitor_interval=1)
+        child = subprocess.Popen(['sleep', '10'])
+        try:
+            m.register_subtask(os.getpid(), 'monitor_sub1')
+            (cpu, mem, nch, ch_cpu, ch_mem), usage = m._check()
+            self.assertGreaterEqual(nch, 1)
+            self.assertEqual(list(usage.keys()), ['monitor_sub1'])
+            # the sleep process is a child of the process that executes the subtask
+            self.assertGreaterEqual(usage['monitor_sub1'][2], 1)
+            self.assertGreater(usage['monitor_sub1'][1], 0)
+            # subtasks reported by worker processes through the queue
+            m.register_subtask(os.getpid(), None)
+            m.subtask_queue().put((child.pid, 'monitor_sub2'))
+            time.sleep(0.5)
+            self.assertEqual(list(m._check()[1].keys()), ['monitor_sub2'])
+            # samples of the task and subtasks are saved to the task database
+            m.start()
+            time.sleep(1.5)
+            m.stop()
+            m.join()
+        finally:
+            child.kill()
+        self.assertTrue(summarizeResources('monitor_master')['start'] is not None)
+        self.assertTrue(summarizeResources('monitor_master', 'monitor_sub2')['start'] is not None)
+        self.assertTrue(summarizeResources('monitor_master', 'monitor_sub1')['start'] is None)
+        from sos.task_store import task_store
+        samples = task_store().get_samples('monitor_master', 'monitor_sub2')
+        self.assertGreaterEqual(len(samples['time']), 1)
+        self.assertEqual(samples['time'], sorted(samples['time']))
+        task_store().remove(['monitor_master'])
+        self.assertEqual(task_store().summarize_samples('monitor_master'), None)
+        os.remove(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', 'monitor_master.pulse'))
+
+    def testMonitorSubtaskLimits(self):
+        '''Test killing subtasks that exceed their max_walltime'''
+        from sos.monitor import ProcessMonitor
+        m = ProcessMonitor('monitor_limits', monitor_interval=0.5, resource_monitor_interval=1)
+        # a process that executes a subtask, with a child process
+        worker = subprocess.Popen(['sh', '-c', 'sleep 20 & wait'])
+        err_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', 'monitor_limit_sub.err')
+        if os.path.isfile(err_file):
+            os.remove(err_file)
+        try:
+            time.sleep(0.5)
+            m.subtask_queue().put((worker.pid, 'monitor_limit_sub', {'max_walltime': 1}, time.time()))
+            m.start()
+            # the child process is killed so the worker completes the subtask
+            self.assertEqual(worker.wait(10), 0)
+            m.stop()
+            m.join()
+        finally:
+            if worker.poll() is None:
+                subprocess.call(['pkill', '-P', str(worker.pid)])
+                worker.kill()
+        with open(err_file) as err:
+            self.assertTrue('excessive run time' in err.read())
+        # the task is still being monitored
+        self.assertTrue(os.access(m.pulse_file, os.W_OK))
+        os.remove(err_file)
+        os.remove(m.pulse_file)
+
+    def testMonitorPooledTask(self):
+        '''Test killing tasks executed by workers of a process pool'''
+        from sos.monitor import ProcessMonitor
+        m = ProcessMonitor('monitor_pooled', monitor_interval=1, resource_monitor_interval=1, pooled=True)
+        child = subprocess.Popen(['sleep', '10'])
+        try:
+            # only the child process is killed, not the worker (this process)
+            m._kill()
+            self.assertEqual(child.wait(5), -9)
+        finally:
+            if child.poll() is None:
+                child.kill()
+        os.remove(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', 'monitor_pooled.pulse'))
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), 'Only Linux has /proc')
+    def testProcReader(self):
+        '''Test reading usage of process trees from /proc'''
+        import psutil
+        from sos.monitor import ProcReader
+        busy = subprocess.Popen([sys.executable, '-c', 'while True: pass'])
+        shell = subprocess.Popen(['sh', '-c', 'sleep 10 & sleep 10 & wait'])
+        try:
+            time.sleep(1)
+            for list_children in (True, False):
+                reader = ProcReader()
+                if list_children and not reader._list_children:
+                    continue
+                reader._list_children = list_children
+                tree = reader.tree(os.getpid())
+                self.assertEqual(set(tree.keys()), {os.getpid()} |
+                    {x.pid for x in psutil.Process().children(recursive=True)})
+                self.assertEqual(tree[busy.pid][0], os.getpid())
+                self.assertGreater(tree[busy.pid][2], 0)
+                # processes that are sampled for the first time have their cpu use
+                # averaged since their start
+                self.assertGreater(tree[busy.pid][1], 10)
+                time.sleep(0.5)
+                self.assertGreater(reader.tree(os.getpid())[busy.pid][1], 10)
+        finally:
+            busy.kill()
+            subprocess.call(['pkill', '-P', str(shell.pid)])
+            shell.kill()
+
+    def testTaskFileFormat(self):
+        '''Test header and compression of task files'''
+        import lzma
+        import pickle
+        from sos.tasks import TaskParams, loadTask, loadTaskHeader, addTags
+        from sos.targets import path
+        params = TaskParams(name='format', global_def='', task='print(1)',
+            sos_dict={'step_name': 'format_10', '__critical_path__': 5,
+                '_runtime': {'mem': 1000, 'walltime': '00:01:00', 'to_host': {'a': path('b')}},
+                'data': 'a' * 100}, tags=['format_tag'])
+        for size, compressor in ((10, 'none'), (1000, 'zlib'), (50000, 'lzma')):
+            # many small variables, which are not saved as blobs
+            for i in range(size):
+                params.sos_dict['var{}'.format(i)] = ''.join(random.choice('abcdefgh') for j in range(20))
+            params.save('format.task')
+            with open('format.task', 'rb') as task:
+                self.assertEqual(task.readline(), b'SOSTASK1.3\n')
+            header = loadTaskHeader('format.task')
+            self.assertEqual(header['compressor'], compressor)
+            self.assertEqual(loadTask('format.task').sos_dict, params.sos_dict)
+        # specified compressor
+        params.save('format.task', compressor='lzma')
+        self.assertEqual(loadTaskHeader('format.task')['compressor'], 'lzma')
+        self.assertRaises(ValueError, params.save, 'format.task', compressor='gzip')
+        # tags are kept in the second line
+        addTags('format.task', 'new_tag')
+        header = loadTaskHeader('format.task')
+        self.assertEqual(header['tags'], ['format_tag', 'new_tag'])
+        self.assertEqual(loadTask('format.task').sos_dict['step_name'], 'format_10')
+        # header can be read without the payload
+        with open('format.task', 'rb') as task:
+            content = task.read()
+        with open('format.task', 'wb') as task:
+            task.write(content[:content.index(b'}\n') + 2])
+        header = loadTaskHeader('format.task')
+        self.assertEqual(header['step_name'], 'format_10')
+        self.assertEqual(header['critical_path'], 5)
+        self.assertEqual(header['runtime']['mem'], 1000)
+        self.assertEqual(header['runtime']['to_host'], {'a': 'b'})
+        # task files of previous format
+        with open('format.task', 'wb') as task:
+            task.write(b'SOSTASK1.2\nformat_tag\n')
+            task.write(lzma.compress(pickle.dumps(params)))
+        self.assertEqual(loadTask('format.task').sos_dict['data'], params.sos_dict['data'])
+        header = loadTaskHeader('format.task')
+        self.assertEqual(header['runtime']['walltime'], '00:01:00')
+        self.assertEqual(header['tags'], ['format_tag'])
+        os.remove('format.task')
+
+    def testTaskBlobs(self):
+        '''Test saving large objects of tasks once as blobs'''
+        import copy
+        from sos.tasks import TaskParams, MasterTaskParams, loadTask, loadTaskHeader, blob_dir
+        table = {'row{}'.format(i): list(range(20)) for i in range(2000)}
+        script = '\n'.join('echo line {}'.format(i) for i in range(1000))
+        tasks = [TaskParams(name='blob', global_def='', task=script,
+            sos_dict={'step_name': 'blob_10', '_runtime': {}, '_index': i, 'table': copy.deepcopy(table)},
+            tags=['blob_tag']) for i in range(2)]
+        for i, params in enumerate(tasks):
+            params.save('blob_{}.task'.format(i))
+        header = loadTaskHeader('blob_0.task')
+        # the script and the table
+        self.assertEqual(len(header['blobs']), 2)
+        self.assertEqual(loadTaskHeader('blob_1.task')['blobs'], header['blobs'])
+        for blob in header['blobs']:
+            self.assertTrue(os.path.isfile(os.path.join(blob_dir(), blob)))
+        self.assertLess(os.path.getsize('blob_0.task'), 4096)
+        params = loadTask('blob_1.task')
+        self.assertEqual(params.task, script)
+        self.assertEqual(params.sos_dict['table'], table)
+        self.assertEqual(params.sos_dict['_index'], 1)
+        # objects shared by tasks are pickled once with a blob cache
+        blob_cache = {}
+        for i in range(2):
+            TaskParams(name='blob', global_def='', task=script,
+                sos_dict={'step_name': 'blob_10', '_runtime': {}, '_index': i, 'table': table},
+                tags=['blob_tag']).save('blob_{}.task'.format(i), blob_cache=blob_cache)
+        self.assertEqual(sorted(x[1][0] for x in blob_cache.values()), header['blobs'])
+        self.assertEqual(loadTaskHeader('blob_1.task')['blobs'], header['blobs'])
+        # subtasks of master tasks
+        master = MasterTaskParams()
+        for i, params in enumerate(tasks):
+            master.push('blob_{}'.format(i), params)
+        master.save('blob_master.task')
+        self.assertEqual(loadTaskHeader('blob_master.task')['blobs'], header['blobs'])
+        self.assertLess(os.path.getsize('blob_master.task'), 4096)
+        master = loadTask('blob_master.task')
+        self.assertEqual(master.task_stack[1][1].sos_dict['table'], table)
+        # subtasks have their own copies of the table
+        self.assertFalse(master.task_stack[0][1].sos_dict['table'] is master.task_stack[1][1].sos_dict['table'])
+        # missing blobs
+        for blob in header['blobs']:
+            os.remove(os.path.join(blob_dir(), blob))
+        self.assertRaises(ValueError, loadTask, 'blob_0.task')
+        for f in ('blob_0.task', 'blob_1.task', 'blob_master.task'):
+            os.remove(f)
+
+    def testTaskStats(self):
+        '''Test summarizing resource usage of tasks by steps and tags'''
+        import random
+        tag = "stats{}".format(random.randint(1, 100000))
+        script = SoS_Script('''
+[stats_10]
+input: for_each={{'i': range(3)}}
+task: tags='{}'
+sh: expand=True
+  sleep {{i}}
+'''.format(tag))
+        wf = script.workflow('stats')
+        Base_Executor(wf, config={'sig_mode': 'force'}).run()
+        ret = subprocess.check_output('sos status --stats -t {}'.format(tag), shell=True).decode()
+        lines = [x.split('\t') for x in ret.splitlines()]
+        self.assertEqual(lines[0][:3], ['group', 'name', 'tasks'])
+        groups = {(x[0], x[1]): x for x in lines[1:]}
+        self.assertEqual(groups[('step', 'stats_10')][2], '3')
+        self.assertEqual(groups[('tag', tag)][2], '3')
+        # maximum run time is at least 2 seconds
+        self.assertGreaterEqual(groups[('tag', tag)][5], '00:00:02')
+
+    def testTaskSignatureMismatch(self):
+        '''Test status of completed tasks of which output has been changed'''
+        tag = f'mismatch{random.randint(1, 100000)}'
+        file_target('temp/mismatch.txt').remove('both')
+        os.makedirs('temp', exist_ok=True)
+        script = SoS_Script(f'''
+[10]
+output: 'temp/mismatch.txt'
+task: tags='{tag}'
+with open('temp/mismatch.txt', 'w') as out:
+    out.write('task output')
+''')
+        wf = script.workflow()
+        Base_Executor(wf, config={'sig_mode': 'force', 'default_queue': 'localhost'}).run()
+        ret = subprocess.check_output(f'sos status -t {tag} -v 0', shell=True).decode()
+        self.assertEqual(ret.strip(), 'completed')
+        with open('temp/mismatch.txt', 'w') as out:
+            out.write('changed output')
+        ret = subprocess.check_output(f'sos status -t {tag} -v 0', shell=True).decode()
+        self.assertEqual(ret.strip(), 'signature-mismatch')
+        file_target('temp/mismatch.txt').remove('both')
+
+    def testStatusHelp(self):
+        '''Test help message of sos status, which is formatted by argparse'''
+        ret = subprocess.check_output('sos status -h', shell=True).decode()
+        self.assertTrue('50% and 90% percentiles' in ret)
+
     def testTaskTags(self):
         '''Test option tags of tasks'''
         import random
@@ -683,5 +1012,404 @@ print('a')
                 'sig_mode': 'force',
                 }).run)
 
+    def testTaskStore(self):
+        '''Test recording and querying tasks through the task database'''
+        from unittest import mock
+        import random
+        from sos.task_store import task_store, TaskStore
+        from sos.tasks import check_task
+        tag = f'tag{random.randint(1, 100000)}'
+        script = SoS_Script(f'''
+[10]
+input: for_each={{'i': range(2)}}
+task: tags='{tag}'
+print(i)
+''')
+        wf = script.workflow()
+        Base_Executor(wf, config={
+                'sig_mode': 'force',
+                'default_queue': 'localhost',
+                }).run()
+        tasks = [x[0] for x in task_store().match() if tag in x[2].split()]
+        self.assertEqual(len(tasks), 2)
+        for task in tasks:
+            rec = task_store().get(task)
+            self.assertEqual(rec['status'], 'completed')
+            self.assertEqual(rec['ret_code'], 0)
+            self.assertTrue(rec['started'] <= rec['completed'])
+            self.assertEqual(check_task(task), 'completed')
+        # status of indexed tasks is read from the database, except for completed
+        # tasks, of which signatures are checked
+        task_store().update(tasks[0], status='failed')
+        with mock.patch('sos.tasks._check_task_files', side_effect=RuntimeError('files checked')):
+            self.assertEqual(check_task(tasks[0]), 'failed')
+            self.assertRaises(RuntimeError, check_task, tasks[1])
+        self.assertEqual(check_task(tasks[1]), 'completed')
+        # tasks are indexed from existing task files
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'abc.task'), 'wb') as task:
+                task.write(b'SOSTASK1.2\ntag1 tag2\n')
+            store = TaskStore(os.path.join(tmpdir, 'tasks.db'))
+            rec = store.get('abc')
+            self.assertEqual(rec['tags'], 'tag1 tag2')
+            self.assertEqual(rec['status'], None)
+            # samples of each flush are appended to those of the task and subtasks
+            store.add_samples('abc', [('', 1.0, 10.0, 100, 1, 5.0, 50), ('sub', 1.0, 1.0, 10, 0, 0, 0)])
+            store.add_samples('abc', [('', 2.0, 20.0, 200, 2, 5.0, 50)])
+            self.assertEqual(store.get_samples('abc'), {'time': [1.0, 2.0], 'proc_cpu': [10.0, 20.0],
+                'proc_mem': [100, 200], 'children': [1, 2], 'children_cpu': [5.0, 5.0], 'children_mem': [50, 50]})
+            self.assertEqual(store.summarize_samples('abc'), {'start': 1.0, 'end': 2.0, 'samples': 2,
+                'nproc': 2, 'peak_cpu': 25.0, 'avg_cpu': 20.0, 'peak_mem': 250, 'avg_mem': 200.0})
+            self.assertEqual(store.get_samples('abc', 'sub')['proc_mem'], [10])
+            store.remove_samples('abc')
+            self.assertEqual(store.summarize_samples('abc', 'sub'), None)
+        # purged tasks are removed from the database
+        subprocess.call(['sos', 'purge', '-t', tag])
+        self.assertEqual(task_store().get_tasks(tasks), {})
+
+    def testNonBlockingTaskStatus(self):
+        '''Test that status of running and dead tasks is determined without waiting'''
+        import socket
+        from sos.task_store import task_store
+        from sos.tasks import check_task, monitor_interval
+        task = 'f' * 15 + str(random.randint(0, 9))
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        with open(os.path.join(task_dir, task + '.task'), 'wb') as tf:
+            tf.write(b'SOSTASK1.2\n\n')
+        os.utime(os.path.join(task_dir, task + '.task'), (time.time() - 2 * monitor_interval,) * 2)
+        with open(os.path.join(task_dir, task + '.pulse'), 'w') as pulse:
+            pulse.write('#task: {}\n'.format(task))
+        # a pulse that missed one update
+        os.utime(os.path.join(task_dir, task + '.pulse'), (time.time() - 1.5 * monitor_interval,) * 2)
+        task_store().remove([task])
+        st = time.time()
+        self.assertEqual(check_task(task), 'running')
+        self.assertLess(time.time() - st, monitor_interval)
+        # a task executed by a process that no longer exists
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        task_store().update(task, status='running', task_mtime=os.path.getmtime(os.path.join(task_dir, task + '.task')),
+            pid=proc.pid, hostname=socket.gethostname())
+        self.assertEqual(check_task(task), 'aborted')
+        self.assertEqual(task_store().get(task)['status'], 'aborted')
+        subprocess.call(['sos', 'purge', task])
+
+    def testTaskWatcher(self):
+        '''Test watching status changes of tasks'''
+        from unittest import mock
+        from sos.task_store import TaskStore, TaskWatcher
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = TaskStore(os.path.join(tmpdir, 'tasks.db'))
+            watcher = TaskWatcher(store, poll_interval=0)
+            self.assertFalse(watcher.changed())
+            # a task completes, from another process
+            with open(os.path.join(tmpdir, 'abc.res'), 'wb') as res:
+                res.write(b'result')
+            TaskStore(store.db_file).update('abc', status='completed')
+            self.assertTrue(watcher.changed(['abc']))
+            self.assertFalse(watcher.changed(['abc']))
+            # changes of other tasks are kept for later calls
+            for task in ('def', 'ghi'):
+                with open(os.path.join(tmpdir, f'{task}.res'), 'wb') as res:
+                    res.write(b'result')
+            self.assertFalse(watcher.changed(['abc']))
+            self.assertTrue(watcher.changed(['def']))
+            self.assertTrue(watcher.changed())
+            self.assertFalse(watcher.changed())
+            # any task might have changed if the inotify queue overflows
+            overflow = TaskWatcher._event_header.pack(-1, TaskWatcher._IN_Q_OVERFLOW, 0, 0)
+            with mock.patch('os.read', side_effect=[overflow, BlockingIOError(), BlockingIOError()]):
+                self.assertFalse(watcher.changed([]))
+                self.assertTrue(watcher.changed(['xyz']))
+            # and the overflow is reported once to each task
+            self.assertFalse(watcher.changed(['xyz']))
+            self.assertTrue(watcher.changed(['xyz', 'uvw']))
+            self.assertTrue(watcher.changed())
+            self.assertFalse(watcher.changed())
+            watcher.close()
+            # without inotify, changes of the task database are polled
+            with mock.patch.object(TaskWatcher, '_inotify', return_value=None):
+                watcher = TaskWatcher(store, poll_interval=0)
+            self.assertFalse(watcher.wait(0))
+            TaskStore(store.db_file).update('abc', status='failed')
+            self.assertTrue(watcher.wait(0))
+            self.assertFalse(watcher.changed([]))
+            self.assertTrue(watcher.changed(['abc']))
+            self.assertFalse(watcher.changed(['abc']))
+            self.assertTrue(watcher.changed(['def']))
+            self.assertTrue(watcher.changed())
+            self.assertFalse(watcher.changed())
+
+    def testQueryTaskStatus(self):
+        '''Test querying status of local tasks without calling sos status'''
+        import json
+        from unittest import mock
+        from sos.tasks import query_task_status
+        from sos.hosts import LocalHost
+        tag = f'tag{random.randint(1, 100000)}'
+        script = SoS_Script(f'''
+[10]
+task: tags='{tag}'
+print('hello')
+''')
+        wf = script.workflow()
+        # local task engine should not check status through command sos status
+        with mock.patch.object(LocalHost, 'check_output', side_effect=RuntimeError('sos status called')):
+            Base_Executor(wf, config={
+                    'sig_mode': 'force',
+                    'default_queue': 'localhost',
+                    }).run()
+        res = query_task_status(tags=[tag])
+        self.assertEqual(len(res), 1)
+        task, mtime, status = res[0]
+        self.assertEqual(status, 'completed')
+        self.assertEqual(mtime, os.path.getmtime(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task + '.task')))
+        self.assertEqual(query_task_status(['nonexisting_task']), [('nonexisting_task', None, 'missing')])
+        # structured output for remote hosts
+        out = json.loads(subprocess.check_output(['sos', 'status', task, '--json']).decode())
+        self.assertEqual(len(out), 1)
+        self.assertEqual((out[0]['id'], out[0]['status'], out[0]['time']), (task, 'completed', mtime))
+        self.assertTrue(tag in out[0]['tags'].split())
+
+    def testTaskEngineEvents(self):
+        '''Test that status changes of tasks wake up the task engine'''
+        import queue
+        from sos.tasks import TaskEngine
+        from sos.task_store import task_store
+
+        class Agent:
+            alias = 'events'
+            address = 'localhost'
+            # status of running tasks would not be checked during the test
+            # without status changes
+            config = {'alias': 'events', 'status_check_interval': 1000, 'max_running_jobs': 10}
+
+            def prepare_task(self, task_id):
+                return True
+
+        class Engine(TaskEngine):
+            checked = queue.Queue()
+
+            def execute_tasks(self, task_ids):
+                return True
+
+            def query_task_status(self, tasks=None, age=None, tags=None, status=None):
+                if tasks:
+                    self.checked.put(list(tasks))
+                return [(x, None, 'running') for x in tasks or []]
+
+        task_id = f'events_{random.randint(1, 100000)}'
+        engine = Engine(Agent())
+        self.engines.append(engine)
+        engine.start()
+        engine.submit_task(task_id)
+        for i in range(600):
+            with engine._lock:
+                if task_id in engine.running_tasks:
+                    break
+            time.sleep(0.1)
+        with engine._lock:
+            self.assertEqual(engine.running_tasks, [task_id])
+        self.assertTrue(engine.checked.empty())
+        # the task completes
+        res_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', f'{task_id}.res')
+        self.temp_files.append(res_file)
+        with open(res_file, 'wb') as res:
+            res.write(b'result')
+        task_store().update(task_id, status='completed')
+        self.assertEqual(engine.checked.get(timeout=60), [task_id])
+        task_store().remove([task_id])
+
+    def testConcurrentSubmission(self):
+        '''Test submitting tasks concurrently, with a limit per host'''
+        import threading
+        from sos.tasks import TaskEngine
+
+        class Agent:
+            alias = 'concurrent'
+            address = 'concurrent'
+            config = {'alias': 'concurrent', 'max_running_jobs': 20, 'max_submitting_jobs': 3}
+            lock = threading.Lock()
+            active = 0
+            max_active = 0
+
+            def check_output(self, cmd):
+                return '[]'
+
+            def prepare_task(self, task_id):
+                # e.g. copying files to a remote host
+                with self.lock:
+                    Agent.active += 1
+                    Agent.max_active = max(Agent.active, Agent.max_active)
+                time.sleep(0.2)
+                with self.lock:
+                    Agent.active -= 1
+                return True
+
+        engine = TaskEngine(Agent())
+        self.assertEqual(engine.max_submitting_jobs, 3)
+        engine.start()
+        st = time.time()
+        for i in range(12):
+            engine.submit_task(f'concurrent_{i}')
+        while True:
+            with engine._lock:
+                if len(engine.running_tasks) == 12:
+                    break
+            time.sleep(0.01)
+        # 12 tasks in 4 rounds of 3 concurrent submissions
+        self.assertLess(time.time() - st, 12 * 0.2 / 2)
+        self.assertEqual(Agent.max_active, 3)
+
+    def testProcessPoolEngine(self):
+        '''Test executing tasks with a pool of worker processes'''
+        with open('pool.yml', 'w') as cfg:
+            cfg.write('''
+localhost: localhost
+hosts:
+    localhost:
+        address: localhost
+    local_pool:
+        address: localhost
+        queue_type: pool
+''')
+        script = SoS_Script('''
+[10]
+input: for_each={'i': range(6)}
+task:
+import os
+with open(f'pool_{i}.txt', 'w') as out:
+    out.write(f'{os.getpid()} {"leaked" in globals()}')
+leaked = True
+''')
+        wf = script.workflow()
+        Base_Executor(wf, config={
+                'config_file': 'pool.yml',
+                'default_queue': 'local_pool',
+                'max_running_jobs': 2,
+                'wait_for_task': True,
+                'sig_mode': 'force',
+                }).run()
+        pids = set()
+        for i in range(6):
+            with open(f'pool_{i}.txt') as res:
+                pid, leaked = res.read().split()
+            pids.add(pid)
+            # variables defined by a task do not leak to the next one
+            self.assertEqual(leaked, 'False')
+        # tasks are executed by at most max_running_jobs workers
+        self.assertLessEqual(len(pids), 2)
+        self.assertFalse(str(os.getpid()) in pids)
+
+    def testPoolWorkerExit(self):
+        '''Test that SystemExit from a task fails the task instead of the pool worker'''
+        import multiprocessing
+        from unittest import mock
+        from sos.tasks import _pool_worker
+        conn, worker_conn = multiprocessing.Pipe()
+        conn.send(('exit_task', 1, 'force', 'run'))
+        conn.send(('exit_task2', 1, 'force', 'run'))
+        conn.send(None)
+        with mock.patch('sos.tasks.execute_task', side_effect=SystemExit(1)):
+            _pool_worker(worker_conn, 1)
+        self.assertEqual(conn.recv(), ('exit_task', 'failed'))
+        self.assertEqual(conn.recv(), ('exit_task2', 'failed'))
+
+    def testResourceAwareDispatch(self):
+        '''Test admitting tasks according to cores and memory they request'''
+        from sos.tasks import TaskEngine
+
+        class Agent:
+            alias = 'packing'
+            address = 'packing'
+            config = {'alias': 'packing'}
+
+        engine = TaskEngine(Agent())
+        engine.max_running_jobs = 100
+        engine.max_cores = 16
+        engine.max_mem = 64
+        # cores and mem requested by tasks
+        engine._resources = {'r1': (8, 8), 'big': (12, 8), 's1': (2, 8), 's2': (2, 8),
+            's3': (1, 8), 'm1': (1, 48)}
+        engine.running_tasks = ['r1']
+        for task in ['big', 's1', 's2', 's3']:
+            engine._add_pending(task)
+            engine.task_status[task] = 'pending'
+        # big does not fit, and only tasks that do not delay it are backfilled
+        self.assertEqual(engine._pack_pending(1), [['s1'], ['s2']])
+        self.assertEqual(list(engine.pending_tasks), ['big', 's3'])
+        # big starts after r1 is completed, with backfilled tasks still running
+        engine.running_tasks = ['s1', 's2']
+        self.assertEqual(engine._pack_pending(2), [['big']])
+        # tasks are also limited by memory
+        engine.running_tasks = ['s1', 's2', 'big']
+        engine._add_pending('m1')
+        engine.task_status['m1'] = 'pending'
+        self.assertEqual(engine._pack_pending(3), [])
+        engine.running_tasks = ['big']
+        self.assertEqual(engine._pack_pending(1), [['s3'], ['m1']])
+        # resources of completed tasks are forgotten
+        engine.update_task_status('big', 'completed')
+        self.assertEqual(engine.running_tasks, [])
+        self.assertFalse('big' in engine._resources)
+
+    def testTaskPriority(self):
+        '''Test dispatching tasks by priorities and critical paths of their steps'''
+        from sos.tasks import TaskEngine
+
+        class Agent:
+            alias = 'priority'
+            address = 'priority'
+            config = {'alias': 'priority'}
+
+        engine = TaskEngine(Agent())
+        # priority and length of critical path of tasks
+        engine._priorities = {'a': (0, 1), 'b': (0, 5), 'c': (10, 0), 'd': (0, 1)}
+        for task in ['a', 'b', 'c', 'd']:
+            engine._add_pending(task)
+        self.assertEqual([engine._pop_pending()[2] for i in range(4)], ['c', 'b', 'a', 'd'])
+        self.assertIsNone(engine._pop_pending())
+        # tasks with higher priorities are packed first
+        engine.pending_tasks = {}
+        for task in ['a', 'b', 'c', 'd']:
+            engine._add_pending(task)
+        engine.max_running_jobs = 2
+        engine.max_cores = 4
+        engine.max_mem = 64
+        engine._resources = {x: (1, 0) for x in engine.pending_tasks}
+        for task in engine.pending_tasks:
+            engine.task_status[task] = 'pending'
+        self.assertEqual(engine._pack_pending(0), [['c'], ['b']])
+        self.assertEqual(list(engine.pending_tasks), ['a', 'd'])
+        # killed tasks are skipped, and tasks pending again are queued by their
+        # new order
+        del engine.pending_tasks['a']
+        engine._add_pending('a')
+        self.assertEqual(engine._pack_pending(0), [['d'], ['a']])
+        # priority should be a number
+        script = SoS_Script('''
+[10]
+task: priority='high'
+sh:
+    echo a
+''')
+        wf = script.workflow()
+        env.config['sig_mode'] = 'force'
+        self.assertRaises(Exception, Base_Executor(wf).run)
+
+    def testCommandStartupTime(self):
+        '''Test that commands used to query and execute tasks do not import
+        modules that are only needed to run workflows'''
+        for cmd in (['status', 'nonexisting_task'], ['execute', 'nonexisting_task'],
+            ['purge', 'nonexisting_task']):
+            imported = set()
+            for line in subprocess.run([sys.executable, '-X', 'importtime', '-m', 'sos'] + cmd,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).stderr.decode().splitlines():
+                if line.startswith('import time:') and 'self [us]' not in line:
+                    imported.add(line[12:].split('|')[2].strip())
+            for module in ('networkx', 'pydot', 'pygments', 'tqdm', 'psutil', 'pexpect',
+                'pkg_resources', 'sos.runtime', 'sos.workflow_executor'):
+                self.assertFalse(module in imported, f'{module} is imported by sos {cmd[0]}')
+
 if __name__ == '__main__':
     unittest.main()
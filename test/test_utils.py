@@ -22,6 +22,7 @@
 
 import os
 import sys
+import json
 import unittest
 import cProfile
 import timeit
@@ -264,5 +265,39 @@ task:
         self.assertEqual(stable_repr({1 : 2, 3:4}), "{1:2, 3:4}")
         self.assertEqual(stable_repr([1, 3, 4]), "[1, 3, 4]")
 
+    def testPluginRegistry(self):
+        '''Test index of entry points of plugins'''
+        from unittest import mock
+        from sos.plugins import PluginRegistry
+        from sos.targets import file_target
+        index_file = os.path.join('temp', 'plugins.json')
+        os.makedirs('temp', exist_ok=True)
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+        registry = PluginRegistry(index_file)
+        self.assertEqual(registry.load('sos_targets', 'file_target'), file_target)
+        self.assertTrue(os.path.isfile(index_file))
+        self.assertTrue('script' in [x.name for x in registry.iter_entry_points('sos_actions')])
+        self.assertEqual(registry.load('sos_targets', 'non_existing_target'), None)
+        # a new registry uses saved index without scanning installed packages
+        registry = PluginRegistry(index_file)
+        with mock.patch.object(PluginRegistry, '_scan', side_effect=RuntimeError('scanned')):
+            self.assertEqual(registry.load('sos_targets', 'file_target'), file_target)
+        # and rescans if installed packages are changed
+        registry = PluginRegistry(index_file)
+        with mock.patch.object(PluginRegistry, '_stamp', return_value='changed'), \
+            mock.patch.object(PluginRegistry, '_scan', wraps=registry._scan) as scan:
+            self.assertEqual(registry.load('sos_targets', 'file_target'), file_target)
+            self.assertEqual(scan.call_count, 1)
+        # rescanning removes index files of removed python environments
+        for name, prefix in (('stale', '/non/existing/prefix'), ('other', sys.prefix)):
+            with open(os.path.join('temp', f'plugins_{name}.json'), 'w') as idx:
+                json.dump({'stamp': '', 'prefix': prefix, 'groups': {}}, idx)
+        registry = PluginRegistry(index_file)
+        with mock.patch.object(PluginRegistry, '_stamp', return_value='changed again'):
+            self.assertEqual(registry.load('sos_targets', 'file_target'), file_target)
+        self.assertFalse(os.path.isfile(os.path.join('temp', 'plugins_stale.json')))
+        self.assertTrue(os.path.isfile(os.path.join('temp', 'plugins_other.json')))
+
 if __name__ == '__main__':
     unittest.main()